@@ -0,0 +1,108 @@
+import json
+import os
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from async_manager import get_async_manager
+from data import LuminositySensorData, TemperatureSensorData, parse_sensor_data
+from exceptions import InconsistentPositionException, NotFoundException
+from http_server import app
+from manager import batch_response
+import payload_codec
+
+# The reading submission routes are served natively on the event loop through the
+# async manager. Every other route of http_server.app still runs in Flask, on a pool
+# of HTTP_WORKERS threads, so all of them share one process, storage client and cache.
+manager = get_async_manager()
+flask_app = WSGIMiddleware(app, workers=int(os.environ.get("HTTP_WORKERS", 10)))
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+async def send_json(send, status:int, data) -> None:
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def submit_reading(data, reading_type, add) -> tuple[int, dict]:
+    reading = parse_sensor_data(data)
+    if not isinstance(reading, reading_type):
+        return 400, {"status":"failure", "msg":"missing input parameter"}
+
+    try:
+        await add(reading)
+    except (InconsistentPositionException, NotFoundException) as e:
+        return 400, {"status":"failure", "msg":str(e)}
+
+    return 200, {"status": "success"}
+
+async def submit_light_data(data) -> tuple[int, dict]:
+    return await submit_reading(data, LuminositySensorData, manager.add_light_data)
+
+async def submit_temperature_data(data) -> tuple[int, dict]:
+    return await submit_reading(data, TemperatureSensorData, manager.add_temperature_data)
+
+async def submit_batch_data(data) -> tuple[int, dict]:
+    if not isinstance(data, list):
+        return 400, {"status":"failure", "msg":"a list of readings is needed"}
+
+    return 200, batch_response(await manager.add_batch(data))
+
+# route -> (handler, whether a binary body holds several readings)
+ROUTES = {
+    ("PUT", "/submitLight"): (submit_light_data, False),
+    ("PUT", "/submitTemperature"): (submit_temperature_data, False),
+    ("PUT", "/submitBatch"): (submit_batch_data, True),
+}
+
+def is_binary(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.split(b";")[0].strip().decode("latin-1") == payload_codec.BINARY_CONTENT_TYPE
+    return False
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await manager.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def asgi_app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    route = None
+    if scope["type"] == "http":
+        route = ROUTES.get((scope["method"], scope["path"]))
+    if route is None:
+        return await flask_app(scope, receive, send)
+
+    handler, batch = route
+    try:
+        data = payload_codec.decode(await read_body(receive), is_binary(scope), batch)
+    except ValueError as e:
+        return await send_json(send, 400, {"status":"failure", "msg":f"invalid body: {e}"})
+
+    status, response = await handler(data)
+    await send_json(send, status, response)
+
+def create_http_server(host:str, port:int) -> uvicorn.Server:
+    config = uvicorn.Config(asgi_app,
+                            host=host,
+                            port=port,
+                            timeout_keep_alive=int(os.environ.get("HTTP_KEEP_ALIVE", 75)),
+                            log_level=os.environ.get("HTTP_LOG_LEVEL", "warning"))
+    return uvicorn.Server(config)
@@ -0,0 +1,52 @@
+import asyncio
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+from db import DB, registry_query, registry_records, rebuild
+
+class AsyncDB:
+    # Non-blocking counterpart of DB for the ingestion path, it reuses the
+    # connection settings and point building of the synchronous DB. The aiohttp
+    # based client has to be created inside the running event loop, so it is
+    # created on first use.
+    def __init__(self, db:DB, pool_size:int=64) -> None:
+        self.db = db
+        self.pool_size = pool_size
+        self.client = None
+
+    def connect(self) -> InfluxDBClientAsync:
+        if self.client is None:
+            self.client = InfluxDBClientAsync(url=self.db.url,
+                                              token=self.db.token,
+                                              org=self.db.org,
+                                              connection_pool_maxsize=self.pool_size)
+            self.write_api = self.client.write_api()
+            self.query_api = self.client.query_api()
+        return self.client
+
+    async def insert_time_series_batch(self, records:list[dict]) -> None:
+        points = [self.db.build_point(**record) for record in records]
+        # readings go through the write pipeline of the synchronous DB, batched with
+        # the other front-ends; submitting only blocks while its queue is full
+        if self.db.pipeline is not None:
+            await asyncio.to_thread(self.db.pipeline.submit_many, points)
+            return
+        self.connect()
+        await self.write_api.write(bucket=self.db.bucket, org=self.db.org, record=points)
+
+    async def get_registry(self, measurement:str, id_tag:str, id=None) -> list:
+        self.connect()
+        response = await self.query_api.query(registry_query(self.db.bucket, measurement, id_tag, id), org=self.db.org)
+        return rebuild(registry_records(response), id_tag)
+
+    async def get_device(self, device_id=None) -> list:
+        return await self.get_registry("device", "deviceId", device_id)
+
+    async def get_position(self, position_id=None) -> list:
+        return await self.get_registry("position", "positionId", position_id)
+
+    async def get_plant(self, plant_id=None) -> list:
+        return await self.get_registry("plant", "plantId", plant_id)
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
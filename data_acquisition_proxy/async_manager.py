@@ -0,0 +1,163 @@
+import asyncio
+import os
+from data import LuminositySensorData, Plant, SensorConfiguration, Position, TemperatureSensorData, parse_sensor_data
+from exceptions import NotFoundException, InconsistentPositionException
+from backend import StorageBackend
+from manager import SensorDataManager, get_manager
+
+# Concurrency limit: at most STORAGE_CONCURRENCY (default 64) storage operations,
+# reads and writes together, are in flight at any time. Further requests wait on
+# the semaphore without blocking the event loop. For InfluxDB the same value sizes
+# the connection pool of the async client.
+
+class ThreadedBackend:
+    # runs a synchronous StorageBackend in worker threads, used for backends without an async client
+    def __init__(self, backend:StorageBackend) -> None:
+        self.backend = backend
+
+    async def insert_time_series_batch(self, records:list[dict]) -> None:
+        await asyncio.to_thread(self.backend.insert_time_series_batch, records)
+
+    async def get_device(self, device_id=None) -> list:
+        return await asyncio.to_thread(self.backend.get_device, device_id)
+
+    async def get_position(self, position_id=None) -> list:
+        return await asyncio.to_thread(self.backend.get_position, position_id)
+
+    async def get_plant(self, plant_id=None) -> list:
+        return await asyncio.to_thread(self.backend.get_plant, plant_id)
+
+    async def close(self) -> None:
+        pass
+
+def create_async_backend(backend:StorageBackend, pool_size:int):
+    if os.environ.get("STORAGE_BACKEND", "influxdb") == "influxdb":
+        from async_db import AsyncDB
+        return AsyncDB(backend, pool_size)
+    return ThreadedBackend(backend)
+
+class AsyncSensorDataManager:
+    # Async front of a SensorDataManager: it shares the registry caches and the
+    # write-ahead log of the synchronous manager. Registry changes are rare and go
+    # through the synchronous manager in a worker thread so the write-through
+    # cache logic stays in one place.
+    def __init__(self, manager:SensorDataManager, storage, concurrency:int=64) -> None:
+        self.manager = manager
+        self.storage = storage
+        self.limit = asyncio.Semaphore(concurrency)
+
+    async def get_device(self, device_id:str) -> list:
+        device = self.manager.devices.get(device_id)
+        if device is None:
+            async with self.limit:
+                device = await self.storage.get_device(device_id)
+            self.manager.devices.put(device_id, device)
+        return device
+
+    async def check_sensor(self, sensor_id:str, position:str) -> None:
+        self.manager.validate_sensor(await self.get_device(sensor_id), sensor_id, position)
+
+    async def add_light_data(self, data:LuminositySensorData):
+
+        await self.check_sensor(data.id, data.position)
+
+        if self.manager.accept(data):
+            await self.store_readings([data])
+
+    async def add_temperature_data(self, data:TemperatureSensorData):
+
+        await self.check_sensor(data.id, data.position)
+
+        if self.manager.accept(data):
+            await self.store_readings([data])
+
+    async def add_batch(self, readings:list) -> list[dict]:
+        parsed = [parse_sensor_data(reading) for reading in readings]
+
+        # distinct device/position pairs are checked concurrently, once each
+        keys = list({(data.id, data.position) for data in parsed if data is not None})
+        errors = await asyncio.gather(*(self.check_error(*key) for key in keys))
+        checked = dict(zip(keys, errors))
+
+        results = []
+        accepted = []
+        for data in parsed:
+            if data is None:
+                results.append({"status":"failure", "msg":"missing input parameter"})
+            elif checked[(data.id, data.position)] is not None:
+                results.append({"status":"failure", "msg":checked[(data.id, data.position)]})
+            elif not self.manager.accept(data):
+                results.append({"status":"success", "duplicate":True})
+            else:
+                accepted.append(data)
+                results.append({"status":"success"})
+
+        if len(accepted) > 0:
+            await self.store_readings(accepted)
+
+        return results
+
+    async def store_readings(self, readings:list) -> None:
+        try:
+            await self.store([self.manager.time_series_record(data) for data in readings])
+        except Exception:
+            self.manager.forget(readings)
+            raise
+
+    async def check_error(self, sensor_id:str, position:str) -> str|None:
+        try:
+            await self.check_sensor(sensor_id, position)
+        except (InconsistentPositionException, NotFoundException) as e:
+            return str(e)
+        return None
+
+    async def store(self, records:list[dict]) -> None:
+        async with self.limit:
+            if self.manager.wal is None:
+                await self.storage.insert_time_series_batch(records)
+            else:
+                await asyncio.to_thread(self.manager.wal.append_many, records)
+
+    async def run_sync(self, function, *args, **kwargs):
+        async with self.limit:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def new_sensor(self, device:SensorConfiguration):
+        await self.run_sync(self.manager.new_sensor, device)
+
+    async def update_position(self, sensor_id:str, new_position:str):
+        await self.run_sync(self.manager.update_position, sensor_id, new_position)
+
+    async def delete_sensor(self, sensor_id:str):
+        await self.run_sync(self.manager.delete_sensor, sensor_id)
+
+    async def new_position(self, position:Position):
+        await self.run_sync(self.manager.new_position, position)
+
+    async def update_position_data(self, position_id:str, new_position_data:Position):
+        await self.run_sync(self.manager.update_position_data, position_id, new_position_data)
+
+    async def delete_position(self, position_id:str):
+        await self.run_sync(self.manager.delete_position, position_id)
+
+    async def new_plant(self, plant:Plant):
+        await self.run_sync(self.manager.new_plant, plant)
+
+    async def update_plant(self, plant_id:str, new_plant_data:Plant):
+        await self.run_sync(self.manager.update_plant, plant_id, new_plant_data)
+
+    async def delete_plant(self, plant_id:str):
+        await self.run_sync(self.manager.delete_plant, plant_id)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+_async_manager = None
+
+def get_async_manager() -> AsyncSensorDataManager:
+    global _async_manager
+    if _async_manager is None:
+        manager = get_manager()
+        concurrency = int(os.environ.get("STORAGE_CONCURRENCY", 64))
+        _async_manager = AsyncSensorDataManager(manager, create_async_backend(manager.db, concurrency), concurrency)
+    return _async_manager
@@ -0,0 +1,91 @@
+import os
+from abc import ABC, abstractmethod
+from data import Position, SensorConfiguration, Plant
+
+class StorageBackend(ABC):
+
+    @abstractmethod
+    def insert_time_series(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> None:
+        pass
+
+    # records are dicts with the insert_time_series keyword arguments
+    def insert_time_series_batch(self, records:list[dict]) -> None:
+        for record in records:
+            self.insert_time_series(**record)
+
+    # unlike insert_time_series_batch this must only return once the records are stored
+    # and raise otherwise, it is what the write-ahead log drainer relies on
+    def write_time_series_batch(self, records:list[dict]) -> None:
+        self.insert_time_series_batch(records)
+        self.flush()
+
+    @abstractmethod
+    def query_time_series(self, measurement:str, time:dict[str, str], values:dict[str,str], tags:dict[str,str], aggregation:str|None = None):
+        pass
+
+    def flush(self, timeout:float|None=None) -> None:
+        pass
+
+    # called on shutdown, nothing buffered may be lost after it returns
+    def close(self) -> None:
+        self.flush()
+
+    @abstractmethod
+    def create_device(self, sensor_configuration:SensorConfiguration):
+        pass
+
+    @abstractmethod
+    def get_device(self, device_id=None) -> list:
+        pass
+
+    @abstractmethod
+    def update_device(self, device:SensorConfiguration):
+        pass
+
+    @abstractmethod
+    def delete_device(self, device_id:str):
+        pass
+
+    @abstractmethod
+    def create_position(self, position:Position):
+        pass
+
+    @abstractmethod
+    def get_position(self, position_id=None) -> list:
+        pass
+
+    @abstractmethod
+    def update_position(self, position:Position):
+        pass
+
+    @abstractmethod
+    def delete_position(self, position_id:str):
+        pass
+
+    @abstractmethod
+    def create_plant(self, plant:Plant):
+        pass
+
+    @abstractmethod
+    def get_plant(self, plant_id=None) -> list:
+        pass
+
+    @abstractmethod
+    def update_plant(self, plant:Plant):
+        pass
+
+    @abstractmethod
+    def delete_plant(self, plant_id:str):
+        pass
+
+# STORAGE_BACKEND selects the implementation, backends are imported lazily so
+# the local one can run without the influxdb client installed
+def create_backend() -> StorageBackend:
+    backend = os.environ.get("STORAGE_BACKEND", "influxdb")
+    if backend == "influxdb":
+        from db import DB
+        return DB()
+    if backend == "local":
+        from local_db import LocalDB
+        return LocalDB(os.environ.get("LOCAL_DB_PATH", "local_db"))
+    raise ValueError(f"unknown storage backend {backend}")
@@ -0,0 +1,75 @@
+import argparse
+import random
+import struct
+import time
+from gorilla import encode_timestamps, decode_timestamps, encode_floats, decode_floats
+
+# Compares the gorilla columns LocalDB writes with LOCAL_DB_COMPRESSION=gorilla against
+# the raw (int64 timestamp, float64 value) representation, on synthetic series shaped
+# like the ones the Pico sensors send.
+
+def adc_temperature(adc_value:int) -> float:
+    # same conversion as Sender.__read_temperature on the device
+    voltage = adc_value * (3.3 / 65535.0)
+    return 27 - (voltage - 0.706) / 0.001721
+
+def make_series(points:int, sampling_rate:int, kind:str) -> list[tuple[int, float]]:
+    start = int(time.time()) * 1000
+    adc_value = 14000
+    light = 500.0
+    series = []
+    for i in range(points):
+        timestamp = start + i * sampling_rate * 1000
+        if random.random() < 0.01:
+            timestamp += random.randint(-1000, 1000)
+        if kind == "temperature":
+            adc_value += random.choice([-8, 0, 0, 0, 8])
+            value = adc_temperature(adc_value)
+        elif kind == "rounded":
+            adc_value += random.choice([-8, 0, 0, 0, 8])
+            value = round(adc_temperature(adc_value), 2)
+        else:
+            light = max(0.0, light + random.choice([-1.0, 0.0, 0.0, 1.0]))
+            value = light
+        series.append((timestamp, value))
+    return series
+
+def encode_raw(series:list[tuple[int, float]]) -> bytes:
+    return b"".join(struct.pack("<qd", t, v) for t, v in series)
+
+def decode_raw(data:bytes) -> list[tuple[int, float]]:
+    return list(struct.iter_unpack("<qd", data))
+
+def measure(function, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def encode_gorilla(series:list[tuple[int, float]]) -> tuple[bytes, bytes]:
+    return encode_timestamps([t for t, _ in series]), encode_floats([v for _, v in series])
+
+def decode_gorilla(columns:tuple[bytes, bytes], count:int) -> list[tuple[int, float]]:
+    return list(zip(decode_timestamps(columns[0], count), decode_floats(columns[1], count)))
+
+def run(points:int, sampling_rate:int) -> None:
+    print(f"{'series':<12} {'format':<8} {'bytes/pt':>9} {'encode pt/s':>13} {'decode pt/s':>13}")
+    for kind in ["temperature", "rounded", "light"]:
+        series = make_series(points, sampling_rate, kind)
+        raw_encode_time, raw = measure(encode_raw, series)
+        raw_decode_time, raw_decoded = measure(decode_raw, raw)
+        assert raw_decoded == series
+
+        encode_time, columns = measure(encode_gorilla, series)
+        decode_time, decoded = measure(decode_gorilla, columns, points)
+        assert decoded == series
+        size = len(columns[0]) + len(columns[1])
+
+        print(f"{kind:<12} {'raw':<8} {len(raw) / points:>9.2f} {points / raw_encode_time:>13.0f} {points / raw_decode_time:>13.0f}")
+        print(f"{kind:<12} {'gorilla':<8} {size / points:>9.2f} {points / encode_time:>13.0f} {points / decode_time:>13.0f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="gorilla chunk format benchmark")
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--sampling-rate", type=int, default=300, help="seconds between samples")
+    args = parser.parse_args()
+    run(args.points, args.sampling_rate)
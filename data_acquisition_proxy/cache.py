@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+import time
+
+class RegistryCache:
+    # Caches the result of a registry lookup (the list returned by DB.get_device/get_position/get_plant).
+    # Empty results are cached too, with their own shorter TTL, so unknown ids do not hit the database.
+    def __init__(self, ttl:float=300.0, negative_ttl:float=30.0, max_entries:int=100000) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries:dict[str, tuple[float, list]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def get(self, key:str) -> list|None:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if len(entry[1]) == 0:
+                self.negative_hits += 1
+            return entry[1]
+
+    def put(self, key:str, value:list) -> None:
+        ttl = self.ttl if len(value) > 0 else self.negative_ttl
+        with self.lock:
+            if len(self.entries) >= self.max_entries and key not in self.entries:
+                self.evict_expired()
+                if len(self.entries) >= self.max_entries:
+                    self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, key:str|None=None) -> None:
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self.entries.items() if expires < now]:
+            del self.entries[key]
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+                "size": len(self.entries)
+            }
+
+class SequenceFilter:
+    # Remembers the last window sequence numbers accepted from each device, so readings
+    # a device replays from its flash ring after a lost acknowledgement are stored once.
+    def __init__(self, window:int=4096, max_devices:int=100000) -> None:
+        self.window = window
+        self.max_devices = max_devices
+        # per device the accepted sequence numbers, oldest first
+        self.devices:dict[str, OrderedDict[int, None]] = {}
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+
+    def accept(self, device:str, seq:int) -> bool:
+        with self.lock:
+            seen = self.devices.get(device)
+            if seen is None:
+                if len(self.devices) >= self.max_devices:
+                    self.devices.pop(next(iter(self.devices)))
+                seen = self.devices[device] = OrderedDict()
+            if seq in seen:
+                self.duplicates += 1
+                return False
+            seen[seq] = None
+            if len(seen) > self.window:
+                seen.popitem(last=False)
+            self.accepted += 1
+            return True
+
+    # undoes accept for readings that could not be stored, so the device's retry is not dropped
+    def forget(self, device:str, seq:int) -> None:
+        with self.lock:
+            seen = self.devices.get(device)
+            if seen is not None:
+                seen.pop(seq, None)
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"accepted": self.accepted, "duplicates": self.duplicates, "devices": len(self.devices)}
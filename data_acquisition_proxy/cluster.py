@@ -0,0 +1,191 @@
+import asyncio
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+# Prefork mode: the master forks CLUSTER_WORKERS processes and only supervises them.
+# Every worker binds its own HTTP socket and CoAP socket on the shared ports with
+# SO_REUSEPORT, so the kernel spreads connections and datagrams across workers.
+# Registry changes made by one worker are broadcast to the others over localhost UDP
+# (ports CLUSTER_BUS_PORT + worker index) so their caches drop the stale entries.
+# Device configuration changes go over the same bus to reach every worker's observers.
+# The write-ahead log and the MQTT spill log are per worker (see worker_path), the
+# local storage backend keeps its registry in one process and cannot be clustered.
+
+# the path with the worker index appended in a cluster worker, unchanged otherwise
+def worker_path(path:str) -> str:
+    index = os.environ.get("CLUSTER_WORKER_INDEX")
+    if index is None:
+        return path
+    return f"{path}.{index}"
+
+class InvalidationBus:
+    def __init__(self, index:int, workers:int, base_port:int) -> None:
+        self.index = index
+        self.peers = [("127.0.0.1", base_port + i) for i in range(workers) if i != index]
+        self.listeners = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", base_port + index))
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        threading.Thread(target=self.receive, name="invalidation-bus", daemon=True).start()
+
+    def publish(self, kind:str, id:str) -> None:
+        message = f"{kind}\n{id}".encode("utf-8")
+        for peer in self.peers:
+            try:
+                self.sender.sendto(message, peer)
+            except OSError as e:
+                print(f"could not send invalidation to {peer}: {e}")
+
+    def receive(self) -> None:
+        while True:
+            data, _ = self.sock.recvfrom(4096)
+            # anything on localhost can send here, a malformed datagram (bad UTF-8, no
+            # separator, unknown kind) is skipped and the thread keeps receiving
+            try:
+                kind, id = data.decode("utf-8").split("\n", 1)
+                for listener in self.listeners:
+                    listener(kind, id)
+            except (ValueError, KeyError):
+                print(f"ignoring malformed invalidation {data!r}")
+
+def reuse_port_socket(host:str, port:int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+async def serve_worker(index:int, host:str, port:int, coap_host:str, coap_port:int) -> None:
+    # imported after the fork so every worker builds its own manager, clients and threads
+    from asgi_server import create_http_server
+    from coap_server import create_coap_context
+
+    http_server = create_http_server(host, port)
+    # create_coap_context only starts the udp6 transport, which binds with SO_REUSEPORT
+    coap_context = await create_coap_context((coap_host, coap_port))
+    try:
+        # uvicorn handles SIGTERM: it stops accepting, waits for in-flight requests and returns
+        await http_server.serve(sockets=[reuse_port_socket(host, port)])
+    finally:
+        await coap_context.shutdown()
+
+def run_worker(index:int, workers:int, host:str, port:int) -> None:
+    from manager import get_manager
+    from device_config import get_device_config_store
+    from main import mqtt_enabled, close_storage
+
+    manager = get_manager()
+    store = get_device_config_store()
+    bus = InvalidationBus(index, workers, int(os.environ.get("CLUSTER_BUS_PORT", 47000)))
+
+    def invalidate(kind:str, id:str) -> None:
+        if kind == "device_config":
+            store.notify(id)
+        else:
+            manager.invalidate(kind, id)
+
+    bus.listeners.append(invalidate)
+    manager.invalidation_listeners.append(bus.publish)
+    store.broadcast = lambda device_id: bus.publish("device_config", device_id)
+
+    mqtt_server = None
+    try:
+        # without a shared subscription group only one worker subscribes to MQTT,
+        # the broker would deliver every message to each of them
+        if mqtt_enabled() and (index == 0 or "MQTT_SHARE_GROUP" in os.environ):
+            from mqtt_server import create_mqtt_server
+            mqtt_server = create_mqtt_server()
+
+        coap_host = os.environ.get("COAP_ADDRESS", "::")
+        coap_port = int(os.environ.get("COAP_PORT", 5683))
+        asyncio.run(serve_worker(index, host, port, coap_host, coap_port))
+    finally:
+        close_storage(mqtt_server)
+
+class Master:
+    def __init__(self, workers:int, host:str, port:int) -> None:
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.children:dict[int, int] = {}
+        self.started:dict[int, float] = {}
+        self.crashes:dict[int, int] = {}
+        self.stopping = False
+        self.drain_timeout = float(os.environ.get("CLUSTER_DRAIN_TIMEOUT", 30))
+
+    def spawn(self, index:int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            os.environ["CLUSTER_WORKER_INDEX"] = str(index)
+            # the master's handlers are replaced by ones raising SystemExit, run_worker
+            # closes the storage on the way out
+            from main import install_signal_handlers
+            install_signal_handlers()
+            try:
+                run_worker(index, self.workers, self.host, self.port)
+            except Exception:
+                traceback.print_exc()
+                sys.exit(1)
+            sys.exit(0)
+        self.children[pid] = index
+        self.started[index] = time.monotonic()
+        print(f"started worker {index} (pid {pid})")
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        deadline = None
+        while len(self.children) > 0:
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + self.drain_timeout
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in list(self.children):
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                deadline = float("inf")
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            index = self.children.pop(pid)
+            if self.stopping:
+                continue
+            # workers that die quickly are restarted with an increasing delay
+            if time.monotonic() - self.started[index] < 10:
+                self.crashes[index] = self.crashes.get(index, 0) + 1
+            else:
+                self.crashes[index] = 0
+            delay = min(30, 2 ** self.crashes[index] - 1)
+            print(f"worker {index} (pid {pid}) exited with status {status}, restarting in {delay}s")
+            time.sleep(delay)
+            if not self.stopping:
+                self.spawn(index)
+
+def run_cluster(workers:int, host:str, port:int) -> None:
+    if os.environ.get("STORAGE_BACKEND", "influxdb") == "local":
+        raise ValueError("the local storage backend cannot be shared by cluster workers, set CLUSTER_WORKERS=1")
+    Master(workers, host, port).run()
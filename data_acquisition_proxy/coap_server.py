@@ -1,16 +1,25 @@
 import json
 import asyncio
-from aiocoap import resource, CONTENT, Context, Message
-from manager import SensorDataManager
+from aiocoap import resource, BAD_REQUEST, CONTENT, NOT_FOUND, Context, Message
+from manager import batch_response
+from async_manager import get_async_manager
+from device_config import get_device_config_store
 from data import LuminositySensorData, Plant, Position, SensorConfiguration, TemperatureSensorData
 from exceptions import AlreadyPresentException, InconsistentPositionException, NotFoundException
+import payload_codec
 
-manager = SensorDataManager()
+manager = get_async_manager()
+
+def request_data(request, batch=False):
+    binary = request.opt.content_format == payload_codec.BINARY_CONTENT_FORMAT
+    return payload_codec.decode(request.payload, binary, batch)
 
 class Light_data(resource.Resource):
     async def render_put(self, request):
-        payload = request.payload.decode('utf-8')
-        data = json.loads(payload)
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
 
         if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "LUMINOSITY", "TIME"]):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input parameter"}).encode('utf-8'))
@@ -19,20 +28,23 @@ class Light_data(resource.Resource):
             id=data["ID"],
             position=data["POSITION"],
             luminosity=data["LUMINOSITY"],
-            time_stamp=data["TIME"]
+            time_stamp=data["TIME"],
+            report=data.get("REPORT")
         )
 
         try:
-            manager.add_light_data(luminosity_data)
+            await manager.add_light_data(luminosity_data)
         except (InconsistentPositionException, NotFoundException) as e:
-            return json.dumps({"status":"failure", "msg":str(e)})
+            return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
         
         return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
 class Temperature_data(resource.Resource):
     async def render_put(self, request):
-        payload = request.payload.decode('utf-8')
-        data = json.loads(payload)
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
 
         if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "TEMPERATURE", "TIME"]):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input parameter"}).encode('utf-8'))
@@ -41,16 +53,30 @@ class Temperature_data(resource.Resource):
             id=data["ID"],
             position=data["POSITION"],
             temperature=data["TEMPERATURE"],
-            time_stamp=data["TIME"]
+            time_stamp=data["TIME"],
+            report=data.get("REPORT")
         )
 
         try:
-            manager.add_temperature_data(luminosity_data)
+            await manager.add_temperature_data(luminosity_data)
         except (InconsistentPositionException, NotFoundException) as e:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
         
         return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
+class Batch_data(resource.Resource):
+    async def render_put(self, request):
+        try:
+            data = request_data(request, batch=True)
+        except ValueError as e:
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
+
+        if not isinstance(data, list):
+            return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"a list of readings is needed"}).encode('utf-8'))
+
+        results = await manager.add_batch(data)
+
+        return Message(code=CONTENT, payload=json.dumps(batch_response(results)).encode('utf-8'))
 
 class New_sensor(resource.Resource):
     async def render_post(self, request):
@@ -61,7 +87,7 @@ class New_sensor(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input parameter"}).encode('utf-8'))
 
         try:
-            manager.new_sensor(SensorConfiguration(
+            await manager.new_sensor(SensorConfiguration(
                 id=data["ID"],
                 position=data["POSITION"],
                 ip=data["IP"]
@@ -69,7 +95,7 @@ class New_sensor(resource.Resource):
         except (AlreadyPresentException, NotFoundException) as e:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
         
-        return json.dumps({"status": "success"})
+        return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
 class Update_sensor(resource.Resource):
     async def render_patch(self, request):
@@ -80,7 +106,7 @@ class Update_sensor(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input parameter"}).encode('utf-8'))
 
         try:
-            manager.update_position(sensor_id=data["ID"], new_position=data["POSITION"])
+            await manager.update_position(sensor_id=data["ID"], new_position=data["POSITION"])
         except NotFoundException as e:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
 
@@ -94,7 +120,7 @@ class Delete_sensor(resource.Resource):
         if not isinstance(data, dict) or "ID" not in data:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"Missing ID field"}).encode('utf-8'))
 
-        manager.delete_sensor(sensor_id=data["ID"])
+        await manager.delete_sensor(sensor_id=data["ID"])
 
         return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
@@ -107,7 +133,7 @@ class New_position(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"Missing input field"}).encode('utf-8'))
 
         try:
-            manager.new_position(Position(
+            await manager.new_position(Position(
                 id=data["ID"],
                 name=data["NAME"],
                 description=data["DESCRIPTION"]
@@ -126,7 +152,7 @@ class Update_position(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input field"}).encode('utf-8'))
 
         try:
-            manager.update_position_data(data["ID"], Position(
+            await manager.update_position_data(data["ID"], Position(
                 id=data["ID"],
                 name=data["NAME"],
                 description=data["DESCRIPTION"]
@@ -134,7 +160,7 @@ class Update_position(resource.Resource):
         except NotFoundException as e:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
 
-        return json.dumps({"status": "success"})
+        return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
 class Delete_position(resource.Resource):
     async def render_delete(self, request):
@@ -144,7 +170,7 @@ class Delete_position(resource.Resource):
         if not isinstance(data, dict) or "ID" not in data:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input parameter"}).encode('utf-8'))
 
-        manager.delete_position(data["ID"])
+        await manager.delete_position(data["ID"])
 
         return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
@@ -157,7 +183,7 @@ class New_plant(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input field"}).encode('utf-8'))
 
         try:
-            manager.new_plant(Plant(
+            await manager.new_plant(Plant(
                 id=data["ID"],
                 name=data["NAME"],
                 description=data["DESCRIPTION"],
@@ -178,7 +204,7 @@ class Update_plant(resource.Resource):
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input field"}).encode('utf-8'))
 
         try:
-            manager.update_plant(data["ID"], Plant(
+            await manager.update_plant(data["ID"], Plant(
                 id=data["ID"],
                 name=data["NAME"],
                 description=data["DESCRIPTION"],
@@ -198,14 +224,74 @@ class Delete_plant(resource.Resource):
         if not isinstance(data, dict) or "ID" not in data:
             return Message(code=CONTENT, payload=json.dumps({"status":"failure", "msg":"missing input field"}).encode('utf-8'))
 
-        manager.delete_plant(data["ID"])
+        await manager.delete_plant(data["ID"])
 
         return Message(code=CONTENT, payload=json.dumps({"status": "success"}).encode('utf-8'))
 
-async def start_coap_server():
+class Device_config(resource.ObservableResource, resource.PathCapable):
+    # deviceConfig/{id}: GET returns the device configuration, with Observe (rfc7641) the
+    # device is notified of every change. PUT merges new values and notifies the observers.
+    def __init__(self) -> None:
+        super().__init__()
+        self.store = get_device_config_store()
+        self.observations:dict[str, set] = {}
+        self.loop:asyncio.AbstractEventLoop|None = None
+        self.store.subscribe(self.config_changed)
+
+    def device_id(self, request) -> str|None:
+        path = request.opt.uri_path
+        return path[0] if len(path) == 1 else None
+
+    async def add_observation(self, request, serverobservation) -> None:
+        device_id = self.device_id(request)
+        if device_id is None:
+            return
+        self.loop = asyncio.get_running_loop()
+        observations = self.observations.setdefault(device_id, set())
+        observations.add(serverobservation)
+        serverobservation.accept(lambda: observations.discard(serverobservation))
+
+    # the store calls this from whichever thread changed it
+    def config_changed(self, device_id:str) -> None:
+        if self.loop is not None and device_id in self.observations:
+            self.loop.call_soon_threadsafe(self.notify, device_id)
+
+    def notify(self, device_id:str) -> None:
+        for observation in list(self.observations.get(device_id, ())):
+            observation.trigger()
+
+    async def render_get(self, request):
+        device_id = self.device_id(request)
+        if device_id is None:
+            return Message(code=NOT_FOUND)
+        # one small packet: the SEQ and the values that differ from the device's own configuration
+        return Message(code=CONTENT, payload=json.dumps(self.store.get(device_id), separators=(",", ":")).encode('utf-8'))
+
+    async def render_put(self, request):
+        device_id = self.device_id(request)
+        if device_id is None:
+            return Message(code=NOT_FOUND)
+        try:
+            data = json.loads(request.payload.decode('utf-8'))
+        except ValueError as e:
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
+
+        if not isinstance(data, dict):
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":"a configuration object is needed"}).encode('utf-8'))
+
+        # nothing is stored or pushed to the observers unless every key and value is valid
+        try:
+            seq = self.store.update(device_id, data)
+        except ValueError as e:
+            return Message(code=BAD_REQUEST, payload=json.dumps({"status":"failure", "msg":str(e)}).encode('utf-8'))
+
+        return Message(code=CONTENT, payload=json.dumps({"status": "success", "SEQ": seq}).encode('utf-8'))
+
+def create_coap_site() -> resource.Site:
     root = resource.Site()
     root.add_resource(['lightData'], Light_data())
     root.add_resource(['temperatureData'], Temperature_data())
+    root.add_resource(['batchData'], Batch_data())
     root.add_resource(['newSensor'], New_sensor())
     root.add_resource(['updateSensorPosition'], Update_sensor())
     root.add_resource(['deleteSensor'], Delete_sensor())
@@ -215,5 +301,14 @@ async def start_coap_server():
     root.add_resource(['newPlant'], New_plant())
     root.add_resource(['updatePlant'], Update_plant())
     root.add_resource(['deletePlant'], Delete_plant())
-    await Context.create_server_context(root)
+    root.add_resource(['deviceConfig'], Device_config())
+    return root
+
+# only the UDP transport is served: the TCP and WebSocket server transports bind
+# their ports without SO_REUSEPORT, so cluster workers could not share them
+async def create_coap_context(bind:tuple[str, int]|None=None) -> Context:
+    return await Context.create_server_context(create_coap_site(), bind=bind, transports=["udp6"])
+
+async def start_coap_server():
+    await create_coap_context()
     await asyncio.get_running_loop().create_future()
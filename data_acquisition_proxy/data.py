@@ -4,33 +4,41 @@ class SensorData:
         self.position = position
 
 class LuminositySensorData(SensorData):
-    def __init__(self, id:str, position:str, luminosity:float, time_stamp:float) -> None:
+    def __init__(self, id:str, position:str, luminosity:float, time_stamp:float, report:str|None=None, seq:int|None=None) -> None:
         self.id = id
         self.position = position
         self.luminosity = luminosity
         self.time_stamp = time_stamp
+        self.report = report
+        self.seq = seq
 
     def to_dict(self):
         return {
             "id": self.id,
             "position": self.position,
             "luminosity": self.luminosity,
-            "time_stamp": self.time_stamp
+            "time_stamp": self.time_stamp,
+            "report": self.report,
+            "seq": self.seq
         }
 
 class TemperatureSensorData(SensorData):
-    def __init__(self, id:str, position:str, temperature:float, time_stamp:float) -> None:
+    def __init__(self, id:str, position:str, temperature:float, time_stamp:float, report:str|None=None, seq:int|None=None) -> None:
         self.id = id
         self.position = position
         self.temperature = temperature
         self.time_stamp = time_stamp
+        self.report = report
+        self.seq = seq
 
     def to_dict(self):
         return {
             "id": self.id,
             "position": self.position,
             "temperature": self.temperature,
-            "time_stamp": self.time_stamp
+            "time_stamp": self.time_stamp,
+            "report": self.report,
+            "seq": self.seq
         }
 
 class SensorConfiguration(SensorData):
@@ -51,3 +59,36 @@ class Plant:
         self.description = description
         self.sensor = sensor
         self.type = type
+
+# builds the reading described by a submitted JSON object, the type is given by the value key present.
+# REPORT is optional: "exception" or "heartbeat" for devices sending by exception,
+# SEQ is optional: the device sequence number of readings replayed from its flash ring
+def parse_sensor_data(data) -> SensorData|None:
+    if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "TIME"]):
+        return None
+    # ID, POSITION and SEQ key the registry cache and the sequence filter, a list or
+    # object there would fail as an unhashable key deep inside the manager
+    if not isinstance(data["ID"], str) or not isinstance(data["POSITION"], str):
+        return None
+    seq = data.get("SEQ")
+    if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool)):
+        return None
+    if "TEMPERATURE" in data:
+        return TemperatureSensorData(
+            id=data["ID"],
+            position=data["POSITION"],
+            temperature=data["TEMPERATURE"],
+            time_stamp=data["TIME"],
+            report=data.get("REPORT"),
+            seq=data.get("SEQ")
+        )
+    if "LUMINOSITY" in data:
+        return LuminositySensorData(
+            id=data["ID"],
+            position=data["POSITION"],
+            luminosity=data["LUMINOSITY"],
+            time_stamp=data["TIME"],
+            report=data.get("REPORT"),
+            seq=data.get("SEQ")
+        )
+    return None
@@ -3,14 +3,51 @@ from influxdb_client import Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 from datetime import datetime
 from data import Position, SensorConfiguration, Plant
-
-class DB:
+from backend import StorageBackend
+from write_pipeline import WritePipeline
+
+INFLUXDB_URL = "https://us-east-1-1.aws.cloud2.influxdata.com"
+
+def registry_query(bucket:str, measurement:str, id_tag:str, id=None) -> str:
+    id_filter = ''
+    if id:
+        id_filter = f' and r.{id_tag} == "{str(id)}"'
+
+    return f'from(bucket: "{bucket}") ' \
+           f'|> range(start: 0) ' \
+           f'|> filter(fn: (r) => r._measurement == "{measurement}"{id_filter}) ' \
+           f'|> last()'
+
+def registry_records(response) -> list:
+    result = []
+    for table in response:
+        for record in table.records:
+            try:
+                _ = 'updatedAt' in record
+            except KeyError:
+                record['updatedAt'] = record.get_time()
+                record[record.get_field()] = record.get_value()
+            result.append(record.values)
+    return result
+
+def rebuild(data, indexing):
+    final = {}
+
+    for element in data:
+        id = element[indexing]
+        if not id in final:
+            final[id] = {indexing:id}
+        final[id][element["_field"]] = element["_value"]
+
+    return list(final.values())
+
+class DB(StorageBackend):
     def __init__(self) -> None:
         super().__init__()
         self.token = os.environ.get("INFLUXDB_TOKEN")
         self.org = os.environ.get("INFLUXDB_ORG") 
         self.bucket:str = os.environ.get("INFLUXDB_BUCKET")
-        self.url = "https://us-east-1-1.aws.cloud2.influxdata.com"
+        self.url = os.environ.get("INFLUXDB_URL", INFLUXDB_URL)
 
         assert self.token is not None, "could not find a token. Set it up via the INFLUXDB_TOKEN"
         assert self.org is not None, "could not find a org. Set it up via the INFLUXDB_ORG"
@@ -19,11 +56,18 @@ class DB:
         self.client = influxdb_client.InfluxDBClient(url=self.url, 
                                                            token=self.token, 
                                                            org=self.org)
-
-    def insert_time_series(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> None:
-        
-        write_api = self.client.write_api(write_options=SYNCHRONOUS)
-
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        # WRITE_MODE=sync keeps the old one-request-per-point behaviour
+        self.points_written = 0
+        self.points_dropped = 0
+        self.pipeline = None
+        if os.environ.get("WRITE_MODE", "batch") == "batch":
+            self.pipeline = WritePipeline.from_env(self.write_points,
+                                                   on_success=self.on_batch_written,
+                                                   on_failure=self.on_batch_failed)
+
+    def build_point(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> Point:
         point = Point(measurement)
         for k,v in values.items():
             point.field(k, v)
@@ -31,8 +75,47 @@ class DB:
             point.tag(k,v)
 
         point.time(datetime.fromtimestamp(time))
+        return point
+
+    def write_points(self, points:list[Point]) -> None:
+        self.write_api.write(bucket=self.bucket, org=self.org, record=points)
+
+    def on_batch_written(self, points:list[Point]) -> None:
+        self.points_written += len(points)
+
+    def on_batch_failed(self, points:list[Point], error:Exception) -> None:
+        self.points_dropped += len(points)
+        print(f"dropping {len(points)} points after failed write: {error}")
+
+    def insert_time_series(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> None:
+
+        point = self.build_point(measurement, values, tags, time)
 
-        write_api.write(bucket=self.bucket, org=self.org, record=(point))
+        if self.pipeline is None:
+            self.write_points([point])
+        else:
+            self.pipeline.submit(point)
+
+    def insert_time_series_batch(self, records:list[dict]) -> None:
+
+        points = [self.build_point(**record) for record in records]
+
+        if self.pipeline is None:
+            self.write_points(points)
+        else:
+            self.pipeline.submit_many(points)
+
+    def write_time_series_batch(self, records:list[dict]) -> None:
+        self.write_points([self.build_point(**record) for record in records])
+
+    def flush(self, timeout:float|None=None) -> None:
+        if not self.pipeline is None:
+            self.pipeline.flush(timeout)
+
+    def close(self) -> None:
+        if not self.pipeline is None:
+            self.pipeline.close()
+        self.client.close()
 
     def query_time_series(self, measurement:str, time:dict[str, str], values:dict[str,str], tags:dict[str,str], aggregation:str|None = None):
         function = f"""fn(r) => r._measurement == "{measurement}" """
@@ -57,14 +140,12 @@ class DB:
 
     def create_device(self, sensor_configuration:SensorConfiguration):
 
-        write_api = self.client.write_api(write_options=SYNCHRONOUS)
-
         point = Point('device') \
             .tag("deviceId", sensor_configuration.id) \
             .field('ip', sensor_configuration.ip) \
             .field('position', sensor_configuration.position)
 
-        client_response = write_api.write(bucket=self.bucket, record=point)
+        client_response = self.write_api.write(bucket=self.bucket, record=point)
 
         if not client_response is None:
             raise Exception(client_response)
@@ -72,38 +153,8 @@ class DB:
     def get_device(self, device_id=None) -> list:
 
         query_api = self.client.query_api()
-        device_filter = ''
-        if device_id:
-            device_id = str(device_id)
-            device_filter = f'r.deviceId == "{device_id}"'
-
-        flux_query = f'from(bucket: "{self.bucket}") ' \
-                     f'|> range(start: 0) ' \
-                     f'|> filter(fn: (r) => r._measurement == "device" and {device_filter}) ' \
-                     f'|> last()'
-
-        response = query_api.query(flux_query)
-        result = []
-        for table in response:
-            for record in table.records:
-                try:
-                    _ = 'updatedAt' in record
-                except KeyError:
-                    record['updatedAt'] = record.get_time()
-                    record[record.get_field()] = record.get_value()
-                result.append(record.values)
-        return self.rebuild(result, "deviceId")
-
-    def rebuild(self, data, indexing):
-        final = {}
-        
-        for element in data:
-            id = element[indexing]
-            if not id in final:
-                final[id] = {indexing:id}
-            final[id][element["_field"]] = element["_value"]
-
-        return list(final.values())
+        response = query_api.query(registry_query(self.bucket, "device", "deviceId", device_id))
+        return rebuild(registry_records(response), "deviceId")
 
     def update_device(self, device:SensorConfiguration):
         self.create_device(device)
@@ -120,14 +171,12 @@ class DB:
 
     def create_position(self, position:Position):
 
-        write_api = self.client.write_api(write_options=SYNCHRONOUS)
-
         point = Point('position') \
             .tag("positionId", position.id) \
             .field('name', position.name) \
             .field('description', position.description)
 
-        client_response = write_api.write(bucket=self.bucket, record=point)
+        client_response = self.write_api.write(bucket=self.bucket, record=point)
 
         if not client_response is None:
             raise Exception(client_response)
@@ -135,27 +184,8 @@ class DB:
     def get_position(self, position_id=None) -> list:
 
         query_api = self.client.query_api()
-        device_filter = ''
-        if position_id:
-            position_id = str(position_id)
-            device_filter = f'r.positionId == "{position_id}"'
-
-        flux_query = f'from(bucket: "{self.bucket}") ' \
-                     f'|> range(start: 0) ' \
-                     f'|> filter(fn: (r) => r._measurement == "position" and {device_filter}) ' \
-                     f'|> last()'
-        
-        response = query_api.query(flux_query)
-        result = []
-        for table in response:
-            for record in table.records:
-                try:
-                    _ = 'updatedAt' in record
-                except KeyError:
-                    record['updatedAt'] = record.get_time()
-                    record[record.get_field()] = record.get_value()
-                result.append(record.values)
-        return self.rebuild(result, "positionId")
+        response = query_api.query(registry_query(self.bucket, "position", "positionId", position_id))
+        return rebuild(registry_records(response), "positionId")
 
     def update_position(self, position:Position):
         self.create_position(position)
@@ -172,8 +202,6 @@ class DB:
 
     def create_plant(self, plant:Plant):
 
-        write_api = self.client.write_api(write_options=SYNCHRONOUS)
-
         point = Point('plant') \
             .tag("plantId", plant.id) \
             .field('name', plant.name) \
@@ -181,7 +209,7 @@ class DB:
             .field('sensor', plant.sensor) \
             .field('type', plant.type)
 
-        client_response = write_api.write(bucket=self.bucket, record=point)
+        client_response = self.write_api.write(bucket=self.bucket, record=point)
 
         if not client_response is None:
             raise Exception(client_response)
@@ -189,27 +217,8 @@ class DB:
     def get_plant(self, plant_id=None) -> list:
 
         query_api = self.client.query_api()
-        device_filter = ''
-        if plant_id:
-            plant_id = str(plant_id)
-            device_filter = f'r.plantId == "{plant_id}"'
-
-        flux_query = f'from(bucket: "{self.bucket}") ' \
-                     f'|> range(start: 0) ' \
-                     f'|> filter(fn: (r) => r._measurement == "plant" and {device_filter}) ' \
-                     f'|> last()'
-        
-        response = query_api.query(flux_query)
-        result = []
-        for table in response:
-            for record in table.records:
-                try:
-                    _ = 'updatedAt' in record
-                except KeyError:
-                    record['updatedAt'] = record.get_time()
-                    record[record.get_field()] = record.get_value()
-                result.append(record.values)
-        return self.rebuild(result, "plantId")
+        response = query_api.query(registry_query(self.bucket, "plant", "plantId", plant_id))
+        return rebuild(registry_records(response), "plantId")
 
     def update_plant(self, plant:Plant):
         self.create_plant(plant)
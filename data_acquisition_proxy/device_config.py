@@ -0,0 +1,110 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# settings a device applies while running when they are pushed to it, with the values it can apply:
+# a device given a wrong one would stop sending until it is reconfigured by hand
+DEVICE_CONFIG_KEYS:dict[str, Callable[[object], bool]] = {
+    "sampling_rate": lambda v: is_number(v) and v > 0,
+    "server_address": lambda v: isinstance(v, str) and 0 < len(v) <= 253 and not any(c.isspace() or c in "/:@" for c in v),
+    "server_port": lambda v: isinstance(v, int) and not isinstance(v, bool) and 0 < v < 65536,
+    "protocol": lambda v: v in ("HTTP", "COAP", "MQTT"),
+    "payload_format": lambda v: v in ("json", "binary"),
+}
+
+class DeviceConfigStore:
+    # Per-device configuration overrides. Every change bumps the device's SEQ, devices
+    # ignore configurations with a SEQ not above the last one they applied. The store
+    # is kept in a JSON file when path is set, so the sequence survives restarts.
+    # Cluster workers share the file: updates hold an flock on path + ".lock" and start
+    # from the file's current content, reads reload it when another process replaced it.
+    def __init__(self, path:str|None=None) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.configs:dict[str, dict] = {}
+        self.version = None
+        self.listeners:list[Callable[[str], None]] = []
+        # set by the cluster to tell the other workers about changes made in this one
+        self.broadcast:Callable[[str], None]|None = None
+        with self.lock:
+            self.reload()
+
+    # called with self.lock held
+    def reload(self) -> None:
+        if self.path is None:
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        # every save replaces the file, so a new inode means new content
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version != self.version:
+            with open(self.path) as f:
+                self.configs = json.load(f)
+            self.version = version
+
+    @contextmanager
+    def file_lock(self):
+        if self.path is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, device_id:str) -> dict:
+        with self.lock:
+            self.reload()
+            return dict(self.configs.get(device_id, {"SEQ": 0}))
+
+    # merges changes into the device configuration, returns the new SEQ
+    def update(self, device_id:str, changes:dict) -> int:
+        unknown = [key for key in changes if key not in DEVICE_CONFIG_KEYS]
+        if len(unknown) > 0:
+            raise ValueError(f"unknown configuration keys {unknown}")
+        invalid = [key for key, value in changes.items() if not DEVICE_CONFIG_KEYS[key](value)]
+        if len(invalid) > 0:
+            raise ValueError(f"invalid values for {invalid}")
+        with self.lock, self.file_lock():
+            self.reload()
+            config = self.configs.setdefault(device_id, {"SEQ": 0})
+            config.update(changes)
+            config["SEQ"] += 1
+            seq = config["SEQ"]
+            if self.path is not None:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.configs, f)
+                os.replace(tmp_path, self.path)
+                stat = os.stat(self.path)
+                self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.notify(device_id)
+        if self.broadcast is not None:
+            self.broadcast(device_id)
+        return seq
+
+    # also called by the cluster for changes made in another worker
+    def notify(self, device_id:str) -> None:
+        for listener in self.listeners:
+            listener(device_id)
+
+    def subscribe(self, listener:Callable[[str], None]) -> None:
+        self.listeners.append(listener)
+
+_device_config_store = None
+
+def get_device_config_store() -> DeviceConfigStore:
+    global _device_config_store
+    if _device_config_store is None:
+        _device_config_store = DeviceConfigStore(os.environ.get("DEVICE_CONFIG_PATH", "device_configs.json"))
+    return _device_config_store
@@ -0,0 +1,182 @@
+import struct
+
+# Gorilla (Pelkonen et al., VLDB 2015) style compression: timestamps are stored as
+# delta-of-delta in variable size buckets, values as the XOR with the previous value.
+# Timestamps are integers, the callers use epoch milliseconds.
+
+class BitWriter:
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value:int, n:int) -> None:
+        self.acc = (self.acc << n) | (value & ((1 << n) - 1))
+        self.bits += n
+        while self.bits >= 8:
+            self.bits -= 8
+            self.buffer.append((self.acc >> self.bits) & 0xFF)
+        self.acc &= (1 << self.bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self.bits == 0:
+            return bytes(self.buffer)
+        return bytes(self.buffer) + bytes([(self.acc << (8 - self.bits)) & 0xFF])
+
+class BitReader:
+    def __init__(self, data:bytes) -> None:
+        self.data = data
+        self.pos = 0
+
+    def read(self, n:int) -> int:
+        start = self.pos >> 3
+        end = (self.pos + n + 7) >> 3
+        chunk = int.from_bytes(self.data[start:end], "big")
+        shift = end * 8 - (self.pos + n)
+        self.pos += n
+        return (chunk >> shift) & ((1 << n) - 1)
+
+    def read_bit(self) -> int:
+        bit = (self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return bit
+
+# (prefix, prefix bits, value bits, bias): dod values in [-bias, 2^bits - 1 - bias]
+DOD_BUCKETS = [
+    (0b10, 2, 7, 63),
+    (0b110, 3, 9, 255),
+    (0b1110, 4, 12, 2047),
+]
+
+class TimestampEncoder:
+    def __init__(self, writer:BitWriter) -> None:
+        self.writer = writer
+        self.previous = None
+        self.delta = 0
+
+    def append(self, timestamp:int) -> None:
+        if self.previous is None:
+            self.writer.write(timestamp, 64)
+            self.previous = timestamp
+            return
+        delta = timestamp - self.previous
+        dod = delta - self.delta
+        self.previous = timestamp
+        self.delta = delta
+        if dod == 0:
+            self.writer.write(0, 1)
+            return
+        for prefix, prefix_bits, bits, bias in DOD_BUCKETS:
+            if -bias <= dod < (1 << bits) - bias:
+                self.writer.write(prefix, prefix_bits)
+                self.writer.write(dod + bias, bits)
+                return
+        self.writer.write(0b1111, 4)
+        self.writer.write(dod, 64)
+
+class TimestampDecoder:
+    def __init__(self, reader:BitReader) -> None:
+        self.reader = reader
+        self.previous = None
+        self.delta = 0
+
+    def next(self) -> int:
+        if self.previous is None:
+            self.previous = self.reader.read(64)
+            return self.previous
+        prefix_bits = 0
+        while prefix_bits < 4 and self.reader.read_bit() == 1:
+            prefix_bits += 1
+        if prefix_bits == 0:
+            dod = 0
+        elif prefix_bits < 4:
+            _, _, bits, bias = DOD_BUCKETS[prefix_bits - 1]
+            dod = self.reader.read(bits) - bias
+        else:
+            dod = self.reader.read(64)
+            if dod >= 1 << 63:
+                dod -= 1 << 64
+        self.delta += dod
+        self.previous += self.delta
+        return self.previous
+
+def float_bits(value:float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+def bits_float(bits:int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+class FloatEncoder:
+    def __init__(self, writer:BitWriter) -> None:
+        self.writer = writer
+        self.previous = None
+        self.leading = -1
+        self.trailing = 0
+
+    def append(self, value:float) -> None:
+        bits = float_bits(value)
+        if self.previous is None:
+            self.writer.write(bits, 64)
+            self.previous = bits
+            return
+        xor = bits ^ self.previous
+        self.previous = bits
+        if xor == 0:
+            self.writer.write(0, 1)
+            return
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if self.leading >= 0 and leading >= self.leading and trailing >= self.trailing:
+            # meaningful bits fit in the previous window
+            self.writer.write(0b10, 2)
+            self.writer.write(xor >> self.trailing, 64 - self.leading - self.trailing)
+            return
+        length = 64 - leading - trailing
+        self.leading = leading
+        self.trailing = trailing
+        self.writer.write(0b11, 2)
+        self.writer.write(leading, 5)
+        self.writer.write(length - 1, 6)
+        self.writer.write(xor >> trailing, length)
+
+class FloatDecoder:
+    def __init__(self, reader:BitReader) -> None:
+        self.reader = reader
+        self.previous = None
+        self.leading = 0
+        self.trailing = 0
+
+    def next(self) -> float:
+        if self.previous is None:
+            self.previous = self.reader.read(64)
+            return bits_float(self.previous)
+        if self.reader.read_bit() == 1:
+            if self.reader.read_bit() == 1:
+                self.leading = self.reader.read(5)
+                length = self.reader.read(6) + 1
+                self.trailing = 64 - self.leading - length
+            length = 64 - self.leading - self.trailing
+            self.previous ^= self.reader.read(length) << self.trailing
+        return bits_float(self.previous)
+
+def encode_timestamps(timestamps:list[int]) -> bytes:
+    writer = BitWriter()
+    encoder = TimestampEncoder(writer)
+    for t in timestamps:
+        encoder.append(t)
+    return writer.getvalue()
+
+def decode_timestamps(data:bytes, count:int) -> list[int]:
+    decoder = TimestampDecoder(BitReader(data))
+    return [decoder.next() for _ in range(count)]
+
+def encode_floats(values:list[float]) -> bytes:
+    writer = BitWriter()
+    encoder = FloatEncoder(writer)
+    for v in values:
+        encoder.append(v)
+    return writer.getvalue()
+
+def decode_floats(data:bytes, count:int) -> list[float]:
+    decoder = FloatDecoder(BitReader(data))
+    return [decoder.next() for _ in range(count)]
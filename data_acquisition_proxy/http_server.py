@@ -1,11 +1,21 @@
 from flask import Flask, request, jsonify, abort
-from manager import SensorDataManager
+from manager import get_manager, batch_response
+import metrics
+import payload_codec
 from data import LuminositySensorData, Plant, Position, SensorConfiguration, TemperatureSensorData
 from exceptions import AlreadyPresentException, InconsistentPositionException, NotFoundException
 
-manager = SensorDataManager()
+manager = get_manager()
 app = Flask(__name__)
 
+def request_data(batch=False):
+    if request.mimetype == payload_codec.BINARY_CONTENT_TYPE:
+        try:
+            return payload_codec.decode(request.get_data(), True, batch)
+        except ValueError as e:
+            abort(400, description=str(e))
+    return request.json
+
 def submit_light_data_handler(data):
     if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "LUMINOSITY", "TIME"]):
         abort(400)
@@ -14,7 +24,8 @@ def submit_light_data_handler(data):
         id=data["ID"],
         position=data["POSITION"],
         luminosity=data["LUMINOSITY"],
-        time_stamp=data["TIME"]
+        time_stamp=data["TIME"],
+        report=data.get("REPORT")
     )
 
     try:
@@ -33,7 +44,8 @@ def submit_temperature_data_handler(data):
         id=data["ID"],
         position=data["POSITION"],
         temperature=data["TEMPERATURE"],
-        time_stamp=data["TIME"]
+        time_stamp=data["TIME"],
+        report=data.get("REPORT")
     )
 
     try:
@@ -43,6 +55,11 @@ def submit_temperature_data_handler(data):
     
     return jsonify({"status": "success"})
 
+def submit_batch_data_handler(data):
+    if not isinstance(data, list):
+        abort(400, description="a list of readings is needed")
+
+    return jsonify(batch_response(manager.add_batch(data)))
 
 def new_sensor_handler(data):
     if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "IP"]):
@@ -161,11 +178,15 @@ def delete_plant_handler(data):
 # HTTP Routes
 @app.route('/submitLight', methods=['PUT'])
 def submit_light_data():
-    return submit_light_data_handler(request.json)
+    return submit_light_data_handler(request_data())
 
 @app.route('/submitTemperature', methods=['PUT'])
 def submit_temperature_data():
-    return submit_temperature_data_handler(request.json)
+    return submit_temperature_data_handler(request_data())
+
+@app.route('/submitBatch', methods=['PUT'])
+def submit_batch_data():
+    return submit_batch_data_handler(request_data(batch=True))
 
 @app.route('/newSensor', methods=['POST'])
 def new_sensor():
@@ -206,3 +227,11 @@ def delete_plant():
 @app.route('/ping', methods=['GET'])
 def ping():
     return jsonify({"status": "success"})
+
+@app.route('/cacheStats', methods=['GET'])
+def cache_stats():
+    return jsonify(manager.cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(metrics.snapshot())
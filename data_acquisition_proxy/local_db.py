@@ -0,0 +1,428 @@
+import atexit
+import bisect
+import hashlib
+import json
+import os
+import struct
+import threading
+from array import array
+from time import monotonic
+from data import Position, SensorConfiguration, Plant
+from backend import StorageBackend
+import gorilla
+
+# Chunk file layout, all little endian:
+#   header   magic "IOTC", version u16, point count u32, min time f64, max time f64, column count u16
+#   column   name length u16, name, type u8, data length u32, data
+# the first column is always the "_time" column. Column types:
+COLUMN_FLOAT = 0    # every value of the column is the str() of a float, stored as float64
+COLUMN_STRING = 1   # anything else, stored as a JSON list
+COLUMN_GORILLA_TIME = 2     # times with millisecond precision, delta-of-delta encoded (LOCAL_DB_COMPRESSION=gorilla)
+COLUMN_GORILLA_FLOAT = 3    # COLUMN_FLOAT values, XOR encoded (LOCAL_DB_COMPRESSION=gorilla)
+
+CHUNK_MAGIC = b"IOTC"
+CHUNK_VERSION = 1
+CHUNK_HEADER = struct.Struct("<4sHIddH")
+COLUMN_HEADER = struct.Struct("<H")
+COLUMN_DATA_HEADER = struct.Struct("<BI")
+INDEX_ENTRY = struct.Struct("<ddII")
+
+def is_float_column(values:list) -> bool:
+    for v in values:
+        if not isinstance(v, str):
+            return False
+        try:
+            if str(float(v)) != v:
+                return False
+        except ValueError:
+            return False
+    return True
+
+def encode_column(name:str, values:list, compression:str|None=None) -> bytes:
+    if is_float_column(values):
+        if compression == "gorilla":
+            column_type, data = COLUMN_GORILLA_FLOAT, gorilla.encode_floats([float(v) for v in values])
+        else:
+            column_type, data = COLUMN_FLOAT, array("d", [float(v) for v in values]).tobytes()
+    else:
+        column_type, data = COLUMN_STRING, json.dumps(values).encode("utf-8")
+    encoded_name = name.encode("utf-8")
+    return COLUMN_HEADER.pack(len(encoded_name)) + encoded_name + COLUMN_DATA_HEADER.pack(column_type, len(data)) + data
+
+def encode_time_column(times:list[float], compression:str|None=None) -> bytes:
+    milliseconds = [round(t * 1000) for t in times]
+    if compression == "gorilla" and all(ms / 1000 == t for ms, t in zip(milliseconds, times)):
+        column_type, data = COLUMN_GORILLA_TIME, gorilla.encode_timestamps(milliseconds)
+    else:
+        column_type, data = COLUMN_FLOAT, array("d", times).tobytes()
+    return COLUMN_HEADER.pack(5) + b"_time" + COLUMN_DATA_HEADER.pack(column_type, len(data)) + data
+
+def decode_column(column_type:int, data:bytes, count:int) -> list:
+    if column_type == COLUMN_FLOAT:
+        return list(array("d", data))
+    if column_type == COLUMN_GORILLA_FLOAT:
+        return gorilla.decode_floats(data, count)
+    if column_type == COLUMN_GORILLA_TIME:
+        return [ms / 1000 for ms in gorilla.decode_timestamps(data, count)]
+    return json.loads(bytes(data).decode("utf-8"))
+
+def encode_chunk(times:list[float], fields:dict[str, list], compression:str|None=None) -> bytes:
+    columns = [encode_time_column(times, compression)]
+    for name, values in fields.items():
+        columns.append(encode_column(name, values, compression))
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION, len(times), min(times), max(times), len(columns))
+    return header + b"".join(columns)
+
+def decode_chunk(buffer:bytes) -> tuple[list[float], dict[str, list]]:
+    magic, version, count, _, _, column_count = CHUNK_HEADER.unpack_from(buffer, 0)
+    if magic != CHUNK_MAGIC or version != CHUNK_VERSION:
+        raise ValueError("not a chunk file")
+    offset = CHUNK_HEADER.size
+    times = []
+    fields = {}
+    for i in range(column_count):
+        (name_length,) = COLUMN_HEADER.unpack_from(buffer, offset)
+        offset += COLUMN_HEADER.size
+        name = bytes(buffer[offset:offset + name_length]).decode("utf-8")
+        offset += name_length
+        column_type, length = COLUMN_DATA_HEADER.unpack_from(buffer, offset)
+        offset += COLUMN_DATA_HEADER.size
+        data = buffer[offset:offset + length]
+        offset += length
+        values = decode_column(column_type, data, count)
+        if i == 0:
+            times = values
+        elif column_type in (COLUMN_FLOAT, COLUMN_GORILLA_FLOAT):
+            fields[name] = [str(v) for v in values]
+        else:
+            fields[name] = values
+    return times, fields
+
+class Series:
+    # One measurement + tag set. New points are buffered in memory and written as an
+    # immutable chunk file once chunk_size points are buffered or the oldest one reaches
+    # the maximum chunk age. Until then they are appended to the tail file, which is
+    # replayed on open. The index file holds one (min time, max time, count, chunk
+    # number) entry per chunk.
+    def __init__(self, path:str, measurement:str, tags:dict[str, str], compression:str|None=None) -> None:
+        self.path = path
+        self.compression = compression
+        self.measurement = measurement
+        self.tags = tags
+        self.times:list[float] = []
+        self.fields:dict[str, list] = {}
+        self.index:list[tuple[float, float, int, int]] = []
+        # tail lines not yet written and synced, and when the oldest buffered point arrived
+        self.unsynced:list[str] = []
+        self.started = 0.0
+
+        os.makedirs(path, exist_ok=True)
+        meta = os.path.join(path, "series.json")
+        if not os.path.exists(meta):
+            with open(meta, "w") as f:
+                json.dump({"measurement": measurement, "tags": tags}, f)
+        index = os.path.join(path, "index")
+        if os.path.exists(index):
+            with open(index, "rb") as f:
+                data = f.read()
+            # a torn trailing entry is ignored
+            for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+                self.index.append(INDEX_ENTRY.unpack_from(data, offset))
+            self.index.sort()
+        self.next_chunk = 0 if len(self.index) == 0 else max(entry[3] for entry in self.index) + 1
+        self.load_tail()
+
+    # The tail starts with {"chunk": n}, the chunk its points go into, then one
+    # [time, values] line per point. A tail whose chunk is already in the index was
+    # sealed before the tail could be reset and is dropped.
+    def load_tail(self) -> None:
+        tail = os.path.join(self.path, "tail")
+        if os.path.exists(tail):
+            with open(tail) as f:
+                lines = f.read().split("\n")
+            try:
+                header = json.loads(lines[0])
+            except ValueError:
+                header = None
+            if header is not None and header["chunk"] == self.next_chunk:
+                for line in lines[1:]:
+                    try:
+                        time, values = json.loads(line)
+                    except ValueError:
+                        # a torn trailing line
+                        break
+                    self.buffer(values, time)
+        self.reset_tail()
+
+    # rewrites the tail with the buffered points
+    def reset_tail(self) -> None:
+        tail = os.path.join(self.path, "tail")
+        with open(tail + ".tmp", "w") as f:
+            f.write(json.dumps({"chunk": self.next_chunk}) + "\n")
+            for i, t in enumerate(self.times):
+                values = {k: v[i] for k, v in self.fields.items() if v[i] is not None}
+                f.write(json.dumps([t, values]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tail + ".tmp", tail)
+        self.unsynced = []
+
+    def buffer(self, values:dict[str, str], time:float) -> None:
+        position = len(self.times)
+        if position == 0:
+            self.started = monotonic()
+        self.times.append(time)
+        for k, v in values.items():
+            if k not in self.fields:
+                self.fields[k] = [None] * position
+            self.fields[k].append(v)
+        for column in self.fields.values():
+            if len(column) <= position:
+                column.append(None)
+
+    def append(self, values:dict[str, str], time:float) -> None:
+        self.buffer(values, time)
+        self.unsynced.append(json.dumps([time, values]) + "\n")
+
+    # seconds since the oldest buffered point arrived
+    def age(self) -> float:
+        return 0.0 if len(self.times) == 0 else monotonic() - self.started
+
+    def sync(self) -> None:
+        if len(self.unsynced) == 0:
+            return
+        with open(os.path.join(self.path, "tail"), "a") as f:
+            f.write("".join(self.unsynced))
+            f.flush()
+            os.fsync(f.fileno())
+        self.unsynced = []
+
+    def seal(self) -> None:
+        if len(self.times) == 0:
+            return
+        number = self.next_chunk
+        chunk = os.path.join(self.path, f"{number:08d}.chunk")
+        with open(chunk + ".tmp", "wb") as f:
+            f.write(encode_chunk(self.times, self.fields, self.compression))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(chunk + ".tmp", chunk)
+
+        entry = (min(self.times), max(self.times), len(self.times), number)
+        with open(os.path.join(self.path, "index"), "ab") as f:
+            f.write(INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        bisect.insort(self.index, entry)
+        self.next_chunk = number + 1
+        self.times = []
+        self.fields = {}
+        self.reset_tail()
+
+    def read(self, start:float, stop:float):
+        for min_time, max_time, _, number in self.index:
+            if min_time >= stop:
+                break
+            if max_time < start:
+                continue
+            with open(os.path.join(self.path, f"{number:08d}.chunk"), "rb") as f:
+                times, fields = decode_chunk(f.read())
+            yield from self.rows(times, fields, start, stop)
+        yield from self.rows(self.times, self.fields, start, stop)
+
+    def rows(self, times, fields, start, stop):
+        for i, t in enumerate(times):
+            if start <= t < stop:
+                yield t, {k: v[i] for k, v in fields.items() if v[i] is not None}
+
+class LocalDB(StorageBackend):
+    def __init__(self, path:str, chunk_size:int|None=None, flush_interval:float|None=None) -> None:
+        super().__init__()
+        self.path = path
+        self.chunk_size = chunk_size or int(os.environ.get("LOCAL_DB_CHUNK_SIZE", 1024))
+        # every LOCAL_DB_FLUSH_INTERVAL seconds new points are synced to the tail files,
+        # series whose oldest buffered point is LOCAL_DB_MAX_CHUNK_AGE seconds old are sealed
+        self.flush_interval = flush_interval or float(os.environ.get("LOCAL_DB_FLUSH_INTERVAL", 5.0))
+        self.max_chunk_age = float(os.environ.get("LOCAL_DB_MAX_CHUNK_AGE", 3600))
+        self.compression = os.environ.get("LOCAL_DB_COMPRESSION")
+        self.lock = threading.RLock()
+        self.series:dict[str, Series] = {}
+        self.registry:dict[str, dict[str, dict]] = {}
+
+        os.makedirs(os.path.join(path, "series"), exist_ok=True)
+        os.makedirs(os.path.join(path, "registry"), exist_ok=True)
+        for key in os.listdir(os.path.join(path, "series")):
+            series_path = os.path.join(path, "series", key)
+            with open(os.path.join(series_path, "series.json")) as f:
+                meta = json.load(f)
+            self.series[key] = Series(series_path, meta["measurement"], meta["tags"], self.compression)
+        for kind in ["device", "position", "plant"]:
+            registry_file = os.path.join(path, "registry", f"{kind}.json")
+            self.registry[kind] = {}
+            if os.path.exists(registry_file):
+                with open(registry_file) as f:
+                    self.registry[kind] = json.load(f)
+
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.run_flusher, name="local-db-flush", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def run_flusher(self) -> None:
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                for series in self.series.values():
+                    if series.age() >= self.max_chunk_age:
+                        series.seal()
+                    else:
+                        series.sync()
+
+    def close(self) -> None:
+        self.closed.set()
+        self.flush()
+
+    def series_key(self, measurement:str, tags:dict[str, str]) -> str:
+        identity = json.dumps([measurement, sorted(tags.items())])
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:20]
+
+    def insert_time_series(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> None:
+        with self.lock:
+            self.append(measurement, values, tags, time)
+
+    def insert_time_series_batch(self, records:list[dict]) -> None:
+        with self.lock:
+            for record in records:
+                self.append(**record)
+
+    def append(self, measurement: str, values: dict[str, str], tags:dict[str, str], time:float) -> None:
+        key = self.series_key(measurement, tags)
+        series = self.series.get(key)
+        if series is None:
+            series = Series(os.path.join(self.path, "series", key), measurement, dict(tags), self.compression)
+            self.series[key] = series
+        series.append(values, float(time))
+        if len(series.times) >= self.chunk_size:
+            series.seal()
+
+    # makes every inserted point durable in the tail files, chunks are only sealed when full or old
+    def flush(self, timeout:float|None=None) -> None:
+        with self.lock:
+            for series in self.series.values():
+                series.sync()
+
+    # start and stop are epoch seconds, aggregation is one of the Flux selectors/aggregates
+    # count(), mean(), min(), max(), first() and last(), applied per series and field
+    def query_time_series(self, measurement:str, time:dict[str, str], values:dict[str,str], tags:dict[str,str], aggregation:str|None = None):
+        start = float(time.get("start", 0) or 0)
+        stop = float(time.get("stop", float("inf")) or float("inf"))
+        result = []
+        with self.lock:
+            for series in self.series.values():
+                if series.measurement != measurement or not all(series.tags.get(k) == v for k, v in tags.items()):
+                    continue
+                rows = [{"_time": t, "_measurement": measurement, **series.tags, **fields}
+                        for t, fields in series.read(start, stop)
+                        if all(fields.get(k) == v for k, v in values.items())]
+                if aggregation is None:
+                    result.extend(rows)
+                elif len(rows) > 0:
+                    result.append(self.aggregate(rows, series.tags, aggregation))
+        return result
+
+    def aggregate(self, rows:list[dict], tags:dict[str, str], aggregation:str) -> dict:
+        name = aggregation.strip().removesuffix("()")
+        rows.sort(key=lambda r: r["_time"])
+        if name == "first":
+            return rows[0]
+        if name == "last":
+            return rows[-1]
+        aggregated = {"_measurement": rows[0]["_measurement"], **tags}
+        fields = {k for r in rows for k in r if not k.startswith("_") and k not in tags}
+        for field in fields:
+            column = [r[field] for r in rows if field in r]
+            if name == "count":
+                aggregated[field] = len(column)
+                continue
+            numbers = [float(v) for v in column]
+            if name == "mean":
+                aggregated[field] = sum(numbers) / len(numbers)
+            elif name == "min":
+                aggregated[field] = min(numbers)
+            elif name == "max":
+                aggregated[field] = max(numbers)
+            else:
+                raise ValueError(f"unsupported aggregation {aggregation}")
+        return aggregated
+
+    def save_registry(self, kind:str) -> None:
+        registry_file = os.path.join(self.path, "registry", f"{kind}.json")
+        with open(registry_file + ".tmp", "w") as f:
+            json.dump(self.registry[kind], f)
+        os.replace(registry_file + ".tmp", registry_file)
+
+    def put_entity(self, kind:str, id:str, record:dict) -> None:
+        with self.lock:
+            self.registry[kind][id] = record
+            self.save_registry(kind)
+
+    def get_entity(self, kind:str, id=None) -> list:
+        with self.lock:
+            if not id:
+                return [dict(r) for r in self.registry[kind].values()]
+            record = self.registry[kind].get(str(id))
+            return [] if record is None else [dict(record)]
+
+    def delete_entity(self, kind:str, id:str) -> None:
+        with self.lock:
+            if self.registry[kind].pop(id, None) is not None:
+                self.save_registry(kind)
+
+    def create_device(self, sensor_configuration:SensorConfiguration):
+        self.put_entity("device", sensor_configuration.id, {
+            "deviceId": sensor_configuration.id,
+            "ip": sensor_configuration.ip,
+            "position": sensor_configuration.position
+        })
+
+    def get_device(self, device_id=None) -> list:
+        return self.get_entity("device", device_id)
+
+    def update_device(self, device:SensorConfiguration):
+        self.create_device(device)
+
+    def delete_device(self, device_id:str):
+        self.delete_entity("device", device_id)
+
+    def create_position(self, position:Position):
+        self.put_entity("position", position.id, {
+            "positionId": position.id,
+            "name": position.name,
+            "description": position.description
+        })
+
+    def get_position(self, position_id=None) -> list:
+        return self.get_entity("position", position_id)
+
+    def update_position(self, position:Position):
+        self.create_position(position)
+
+    def delete_position(self, position_id:str):
+        self.delete_entity("position", position_id)
+
+    def create_plant(self, plant:Plant):
+        self.put_entity("plant", plant.id, {
+            "plantId": plant.id,
+            "name": plant.name,
+            "description": plant.description,
+            "sensor": plant.sensor,
+            "type": plant.type
+        })
+
+    def get_plant(self, plant_id=None) -> list:
+        return self.get_entity("plant", plant_id)
+
+    def update_plant(self, plant:Plant):
+        self.create_plant(plant)
+
+    def delete_plant(self, plant_id:str):
+        self.delete_entity("plant", plant_id)
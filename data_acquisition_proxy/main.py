@@ -1,22 +1,83 @@
 import json
 import asyncio
 import os
+import signal
+import sys
 import threading
-from coap_server import start_coap_server
-from http_server import app
-from mqtt_server import create_mqtt_server
+
+async def serve_asgi(host_address:str, host_port:int):
+    # HTTP, CoAP and (with MQTT_ENABLED) MQTT share one event loop and one SensorDataManager
+    from asgi_server import create_http_server
+    from coap_server import create_coap_context
+    http_server = create_http_server(host_address, host_port)
+    coap_context = await create_coap_context()
+    try:
+        # uvicorn handles SIGTERM and SIGINT: it waits for in-flight requests and returns
+        await http_server.serve()
+    finally:
+        await coap_context.shutdown()
+
+def exit_on_signal(signum, frame):
+    sys.exit(128 + signum)
+
+# SIGTERM and SIGINT leave through SystemExit so the finally blocks close the storage:
+# atexit handlers do not run when the default handler kills the process
+def install_signal_handlers() -> None:
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    signal.signal(signal.SIGINT, exit_on_signal)
+
+# stops taking MQTT messages, stores the queued ones, then flushes the write pipeline
+# or local store and the write-ahead log
+def close_storage(mqtt_server) -> None:
+    from manager import close_manager
+    if mqtt_server is not None:
+        from mqtt_server import stop_mqtt_server
+        stop_mqtt_server(*mqtt_server)
+    close_manager()
+
+def mqtt_enabled() -> bool:
+    # setting MQTT_BROKER is enough to turn the MQTT transport on, MQTT_ENABLED forces it either way
+    enabled = os.environ.get("MQTT_ENABLED")
+    if enabled is None:
+        return "MQTT_BROKER" in os.environ
+    return enabled.lower() == "true"
+
+def serve_threads(host_address:str, host_port:int):
+    from http_server import app
+    from coap_server import start_coap_server
+    from werkzeug.serving import WSGIRequestHandler
+    # the development server closes every connection under HTTP/1.0, devices keep theirs open
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    flask_thread = threading.Thread(target=lambda: app.run(host=host_address, port=host_port), daemon=True)
+    flask_thread.start()
+
+    asyncio.run(start_coap_server())
 
 if __name__ == '__main__':
-    # Initialize MQTT client
-    # create_mqtt_server()
     host_address = os.environ.get("SERVER_ADDRESS")
     host_port = os.environ.get("SERVER_PORT")
     if host_address is None:
         host_address = "localhost"
     if host_port is None:
         host_port = 5000
-    flask_thread = threading.Thread(target=lambda: app.run(host=host_address, port=int(host_port)))
-    flask_thread.start()
+    workers = int(os.environ.get("CLUSTER_WORKERS", 1))
 
-    asyncio.run(start_coap_server())
+    # with CLUSTER_WORKERS > 1 the servers are only imported in the forked workers
+    if workers > 1:
+        from cluster import run_cluster
+        run_cluster(workers, host_address, int(host_port))
+    else:
+        install_signal_handlers()
+        mqtt_server = None
+        try:
+            if mqtt_enabled():
+                from mqtt_server import create_mqtt_server
+                mqtt_server = create_mqtt_server()
 
+            # SERVER_MODE=threads keeps Flask's development server in a thread next to the CoAP loop
+            if os.environ.get("SERVER_MODE", "asgi") == "threads":
+                serve_threads(host_address, int(host_port))
+            else:
+                asyncio.run(serve_asgi(host_address, int(host_port)))
+        finally:
+            close_storage(mqtt_server)
@@ -1,104 +1,305 @@
-from data import LuminositySensorData, Plant, SensorConfiguration, Position, TemperatureSensorData
+import os
+from typing import Callable
+from data import LuminositySensorData, Plant, SensorConfiguration, Position, TemperatureSensorData, parse_sensor_data
 from exceptions import NotFoundException, InconsistentPositionException, AlreadyPresentException
-from db import DB
+from cache import RegistryCache, SequenceFilter
+from backend import create_backend
+from wal import WriteAheadLog, WalDrainer
+from cluster import worker_path
+import metrics
 
 class SensorDataManager:
     def __init__(self) -> None:
-        self.db = DB()
-
-    def add_light_data(self, data:LuminositySensorData):
-
-
-        sensor = self.db.get_device(data.id)
+        self.db = create_backend()
+
+        ttl = float(os.environ.get("REGISTRY_CACHE_TTL", 300))
+        negative_ttl = float(os.environ.get("REGISTRY_NEGATIVE_TTL", 30))
+        self.devices = RegistryCache(ttl=ttl, negative_ttl=negative_ttl)
+        self.positions = RegistryCache(ttl=ttl, negative_ttl=negative_ttl)
+        self.plants = RegistryCache(ttl=ttl, negative_ttl=negative_ttl)
+        self.caches = {"device": self.devices, "position": self.positions, "plant": self.plants}
+        # called with (kind, id) after every registry change made through this manager,
+        # the cluster uses it to invalidate the caches of the other workers
+        self.invalidation_listeners:list[Callable[[str, str], None]] = []
+        # readings carrying a device SEQ are stored once even when the device sends them again
+        self.sequences = SequenceFilter(window=int(os.environ.get("SEQUENCE_WINDOW", 4096)))
+
+        # with WAL_PATH set readings are acknowledged once they are in the local log,
+        # a background drainer moves them to the storage backend
+        self.wal = None
+        self.drainer = None
+        wal_path = os.environ.get("WAL_PATH")
+        if wal_path is not None:
+            self.wal = WriteAheadLog(worker_path(wal_path),
+                                     segment_size=int(os.environ.get("WAL_SEGMENT_SIZE", 16 * 1024 * 1024)),
+                                     fsync=os.environ.get("WAL_FSYNC", "always"),
+                                     sync_interval=float(os.environ.get("WAL_FSYNC_INTERVAL", 1.0)))
+            self.drainer = WalDrainer(self.wal, self.db.write_time_series_batch,
+                                      batch_size=int(os.environ.get("WAL_BATCH_SIZE", 500)))
+
+    # the drainer stops after its current batch, then the backend writes out what it buffers
+    def close(self) -> None:
+        if self.drainer is not None:
+            self.drainer.close()
+        self.db.close()
+
+    def get_device(self, device_id:str) -> list:
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.db.get_device(device_id)
+            self.devices.put(device_id, device)
+        return device
+
+    def get_position(self, position_id:str) -> list:
+        position = self.positions.get(position_id)
+        if position is None:
+            position = self.db.get_position(position_id)
+            self.positions.put(position_id, position)
+        return position
+
+    def get_plant(self, plant_id:str) -> list:
+        plant = self.plants.get(plant_id)
+        if plant is None:
+            plant = self.db.get_plant(plant_id)
+            self.plants.put(plant_id, plant)
+        return plant
+
+    def notify(self, kind:str, id:str) -> None:
+        for listener in self.invalidation_listeners:
+            listener(kind, id)
+
+    def invalidate(self, kind:str, id:str) -> None:
+        self.caches[kind].invalidate(id)
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        return {
+            "devices": self.devices.stats(),
+            "positions": self.positions.stats(),
+            "plants": self.plants.stats()
+        }
+
+    def check_sensor(self, sensor_id:str, position:str) -> None:
+        self.validate_sensor(self.get_device(sensor_id), sensor_id, position)
+
+    def validate_sensor(self, sensor:list, sensor_id:str, position:str) -> None:
         if len(sensor) == 0:
-            raise NotFoundException(f"Sensor {data.id} not found in db")
+            raise NotFoundException(f"Sensor {sensor_id} not found in db")
 
         sensor = sensor[0]
-        if sensor["position"] != data.position:
-            raise InconsistentPositionException(f"Sensor {data.id} is registered at position {sensor['position']}. Got position {data.position}")
+        if sensor["position"] != position:
+            raise InconsistentPositionException(f"Sensor {sensor_id} is registered at position {sensor['position']}. Got position {position}")
 
-        self.db.insert_time_series(measurement="Light_data", tags={
-                                   "device": data.id,
-                                   "position": data.position}, 
-                                   values={"light":str(data.luminosity)},
-                                   time= data.time_stamp)
+    def add_light_data(self, data:LuminositySensorData):
 
-    def add_temperature_data(self, data:TemperatureSensorData):
+        self.check_sensor(data.id, data.position)
 
-        sensor = self.db.get_device(data.id)
-        if len(sensor) == 0:
-            raise NotFoundException(f"Sensor {data.id} not found in db")
+        if self.accept(data):
+            self.store_readings([data])
 
-        sensor = sensor[0]
-        if sensor["position"] != data.position:
-            raise InconsistentPositionException(f"Sensor {data.id} is registered at position {sensor['position']}. Got position {data.position}")
+    def add_temperature_data(self, data:TemperatureSensorData):
 
-        self.db.insert_time_series(measurement="Temperature_data", tags={
-                                   "device": data.id,
-                                   "position": data.position}, 
-                                   values={"temperature":str(data.temperature)},
-                                   time= data.time_stamp)
+        self.check_sensor(data.id, data.position)
+
+        if self.accept(data):
+            self.store_readings([data])
+
+    def add_batch(self, readings:list) -> list[dict]:
+        results = []
+        accepted = []
+        checked = {}
+
+        for reading in readings:
+            data = parse_sensor_data(reading)
+            if data is None:
+                results.append({"status":"failure", "msg":"missing input parameter"})
+                continue
+
+            # each distinct device/position pair is looked up once per batch
+            key = (data.id, data.position)
+            if key not in checked:
+                try:
+                    self.check_sensor(data.id, data.position)
+                    checked[key] = None
+                except (InconsistentPositionException, NotFoundException) as e:
+                    checked[key] = str(e)
+
+            if checked[key] is not None:
+                results.append({"status":"failure", "msg":checked[key]})
+                continue
+
+            if not self.accept(data):
+                results.append({"status":"success", "duplicate":True})
+                continue
+
+            accepted.append(data)
+            results.append({"status":"success"})
+
+        if len(accepted) > 0:
+            self.store_readings(accepted)
+
+        return results
+
+    def accept(self, data:LuminositySensorData|TemperatureSensorData) -> bool:
+        return data.seq is None or self.sequences.accept(data.id, data.seq)
+
+    def forget(self, readings:list) -> None:
+        for data in readings:
+            if data.seq is not None:
+                self.sequences.forget(data.id, data.seq)
+
+    def store_readings(self, readings:list) -> None:
+        try:
+            self.store([self.time_series_record(data) for data in readings])
+        except Exception:
+            self.forget(readings)
+            raise
+
+    def store(self, records:list[dict]) -> None:
+        if self.wal is None:
+            self.db.insert_time_series_batch(records)
+        else:
+            self.wal.append_many(records)
+
+    def time_series_record(self, data:LuminositySensorData|TemperatureSensorData) -> dict:
+        if isinstance(data, TemperatureSensorData):
+            measurement, values = "Temperature_data", {"temperature":str(data.temperature)}
+        else:
+            measurement, values = "Light_data", {"light":str(data.luminosity)}
+        # stored as a field so heartbeats and exception reports stay in the same series
+        if data.report is not None:
+            values["report"] = data.report
+        return {
+            "measurement": measurement,
+            "tags": {"device": data.id, "position": data.position},
+            "values": values,
+            "time": data.time_stamp
+        }
 
 
     def new_sensor(self, device:SensorConfiguration):
-        
-        if len(self.db.get_device(device.id)) > 0:
+
+        if len(self.get_device(device.id)) > 0:
             raise AlreadyPresentException(f"device {device.id} already present in db")
 
-        if len(self.db.get_position(device.position)) == 0:
+        if len(self.get_position(device.position)) == 0:
             raise NotFoundException(f"position {device.position} not found")
 
         self.db.create_device(device)
+        self.devices.put(device.id, [self.device_record(device)])
+        self.notify("device", device.id)
 
     def update_position(self, sensor_id:str, new_position:str):
 
-        sensor = self.db.get_device(sensor_id)
+        sensor = self.get_device(sensor_id)
         if len(sensor) == 0:
             raise NotFoundException(f"Sensor {sensor_id} not found in db")
 
-        if len(self.db.get_position(new_position)) == 0:
+        if len(self.get_position(new_position)) == 0:
             raise NotFoundException(f"position {new_position} not found")
 
-        sensor = sensor[0] 
+        sensor = sensor[0]
         sensor = SensorConfiguration(id=sensor_id, position=new_position, ip=sensor["ip"])
 
         self.db.update_device(sensor)
+        self.devices.put(sensor_id, [self.device_record(sensor)])
+        self.notify("device", sensor_id)
 
     def delete_sensor(self, sensor_id:str):
         self.db.delete_device(sensor_id)
+        self.devices.put(sensor_id, [])
+        self.notify("device", sensor_id)
 
     def new_position(self, position:Position):
 
-        if len(self.db.get_position(position.id)) > 0:
+        if len(self.get_position(position.id)) > 0:
             raise AlreadyPresentException(f"device {position.id} already present in db")
 
         self.db.create_position(position)
+        self.positions.put(position.id, [self.position_record(position)])
+        self.notify("position", position.id)
 
     def update_position_data(self, position_id:str, new_position_data:Position):
 
-        position = self.db.get_position(position_id)
+        position = self.get_position(position_id)
         if len(position) == 0:
             raise NotFoundException(f"Position {position_id} not found in db")
 
         self.db.update_position(new_position_data)
+        self.positions.invalidate(position_id)
+        self.notify("position", position_id)
+        self.positions.put(new_position_data.id, [self.position_record(new_position_data)])
+        self.notify("position", new_position_data.id)
 
     def delete_position(self, position_id:str):
         self.db.delete_position(position_id)
+        self.positions.put(position_id, [])
+        self.notify("position", position_id)
 
     def new_plant(self, plant:Plant):
 
-        if len(self.db.get_plant(plant.id)) > 0:
+        if len(self.get_plant(plant.id)) > 0:
             raise AlreadyPresentException(f"Plant {plant.id} already present in db")
 
         self.db.create_plant(plant)
+        self.plants.put(plant.id, [self.plant_record(plant)])
+        self.notify("plant", plant.id)
 
     def update_plant(self, plant_id:str, new_plant_data:Plant):
 
-        position = self.db.get_plant(plant_id)
+        position = self.get_plant(plant_id)
         if len(position) == 0:
             raise NotFoundException(f"Plant {plant_id} not found in db")
 
         self.db.update_plant(new_plant_data)
+        self.plants.invalidate(plant_id)
+        self.notify("plant", plant_id)
+        self.plants.put(new_plant_data.id, [self.plant_record(new_plant_data)])
+        self.notify("plant", new_plant_data.id)
 
     def delete_plant(self, plant_id:str):
         self.db.delete_plant(plant_id)
+        self.plants.put(plant_id, [])
+        self.notify("plant", plant_id)
+
+    # cached records mirror the shape DB.rebuild produces for the same entity
+    def device_record(self, device:SensorConfiguration) -> dict:
+        return {"deviceId": device.id, "ip": device.ip, "position": device.position}
+
+    def position_record(self, position:Position) -> dict:
+        return {"positionId": position.id, "name": position.name, "description": position.description}
+
+    def plant_record(self, plant:Plant) -> dict:
+        return {
+            "plantId": plant.id,
+            "name": plant.name,
+            "description": plant.description,
+            "sensor": plant.sensor,
+            "type": plant.type
+        }
+
+def batch_response(results:list[dict]) -> dict:
+    failed = sum(1 for r in results if r["status"] != "success")
+    if failed == 0:
+        status = "success"
+    elif failed == len(results):
+        status = "failure"
+    else:
+        status = "partial"
+    return {"status": status, "results": results}
+
+_manager = None
+
+# HTTP, CoAP and MQTT front-ends share one manager so they also share the DB client and its write pipeline
+def get_manager() -> SensorDataManager:
+    global _manager
+    if _manager is None:
+        _manager = SensorDataManager()
+        metrics.register("registry_cache", _manager.cache_stats)
+        metrics.register("sequences", _manager.sequences.stats)
+        if _manager.drainer is not None:
+            metrics.register("wal", _manager.drainer.stats)
+    return _manager
+
+def close_manager() -> None:
+    if _manager is not None:
+        _manager.close()
@@ -0,0 +1,10 @@
+from typing import Callable
+
+# named callables returning a JSON serialisable dict, collected by GET /metrics
+providers:dict[str, Callable[[], dict]] = {}
+
+def register(name:str, provider:Callable[[], dict]) -> None:
+    providers[name] = provider
+
+def snapshot() -> dict:
+    return {name: provider() for name, provider in providers.items()}
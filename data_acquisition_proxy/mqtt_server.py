@@ -1,10 +1,16 @@
 import json
+import os
 import paho.mqtt.client as mqtt
-from manager import SensorDataManager
+from manager import get_manager, batch_response
 from data import LuminositySensorData, Plant, Position, SensorConfiguration, TemperatureSensorData
 from exceptions import AlreadyPresentException, InconsistentPositionException, NotFoundException
+from topic_router import TopicRouter
+import payload_codec
+from worker_pool import BoundedWorkerPool, OVERFLOW_BLOCK
+import metrics
+from cluster import worker_path
 
-manager = SensorDataManager()
+manager = get_manager()
 
 def submit_light_data_handler(data):
     if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "LUMINOSITY", "TIME"]):
@@ -14,7 +20,8 @@ def submit_light_data_handler(data):
         id=data["ID"],
         position=data["POSITION"],
         luminosity=data["LUMINOSITY"],
-        time_stamp=data["TIME"]
+        time_stamp=data["TIME"],
+        report=data.get("REPORT")
     )
 
     try:
@@ -32,7 +39,8 @@ def submit_temperature_data_handler(data):
         id=data["ID"],
         position=data["POSITION"],
         temperature=data["TEMPERATURE"],
-        time_stamp=data["TIME"]
+        time_stamp=data["TIME"],
+        report=data.get("REPORT")
     )
 
     try:
@@ -42,6 +50,12 @@ def submit_temperature_data_handler(data):
     
     return json.dumps({"status": "success"})
 
+def submit_batch_data_handler(data):
+    if not isinstance(data, list):
+        return json.dumps({"status":"failure", "msg":"a list of readings is needed"})
+
+    return json.dumps(batch_response(manager.add_batch(data)))
+
 def new_sensor_handler(data):
     if not isinstance(data, dict) or not all(k in data for k in ["ID", "POSITION", "IP"]):
         return "ID, POSITION, and IP fields needed", 400
@@ -157,67 +171,115 @@ def delete_plant_handler(data):
     return json.dumps({"status": "success"})
 
 
+def submit_reading_handler(params, data, sensor_type):
+    # identity comes from the topic, the payload only carries {"VALUE": ..., "TIME": ...}
+    if not isinstance(data, dict) or not all(k in data for k in ["VALUE", "TIME"]):
+        return json.dumps({"status":"failure", "msg":"missing input parameter"})
+
+    try:
+        if sensor_type == "temperature":
+            manager.add_temperature_data(TemperatureSensorData(
+                id=params["id"],
+                position=params["position"],
+                temperature=data["VALUE"],
+                time_stamp=data["TIME"],
+                report=data.get("REPORT")
+            ))
+        else:
+            manager.add_light_data(LuminositySensorData(
+                id=params["id"],
+                position=params["position"],
+                luminosity=data["VALUE"],
+                time_stamp=data["TIME"],
+                report=data.get("REPORT")
+            ))
+    except (InconsistentPositionException, NotFoundException) as e:
+        return json.dumps({"status":"failure", "msg":str(e)})
+
+    return json.dumps({"status": "success"})
+
 # MQTT settings
-MQTT_BROKER = "localhost"
-MQTT_PORT = 1883
-MQTT_TOPICS = [
-    ("submit_light_data", 0),
-    ("submit_temperature_data", 0),
-    ("new_sensor", 0),
-    ("update_sensor_position", 0),
-    ("delete_sensor", 0),
-    ("new_position", 0),
-    ("update_position_data", 0),
-    ("delete_position", 0),
-    ("new_plant", 0),
-    ("update_plant", 0),
-    ("delete_plant", 0)
-]
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "localhost")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+# with MQTT_SHARE_GROUP set every proxy instance joins $share/{group}/ and the broker splits messages between them
+MQTT_SHARE_GROUP = os.environ.get("MQTT_SHARE_GROUP")
+MQTT_TOPICS = {
+    "submit_light_data": submit_light_data_handler,
+    "submit_temperature_data": submit_temperature_data_handler,
+    "submit_batch_data": submit_batch_data_handler,
+    "new_sensor": new_sensor_handler,
+    "update_sensor_position": update_sensor_position_handler,
+    "delete_sensor": delete_sensor_handler,
+    "new_position": new_position_handler,
+    "update_position_data": update_position_data_handler,
+    "delete_position": delete_position_handler,
+    "new_plant": new_plant_handler,
+    "update_plant": update_plant_handler,
+    "delete_plant": delete_plant_handler
+}
+# the plant level is only used for routing, devices are checked against their registered position
+READING_TOPIC = "plants/{plant}/positions/{position}/devices/{id}"
+
+# readings can also be published as binary payloads on the same topic plus /bin
+BINARY_TOPICS = {"submit_light_data": False, "submit_temperature_data": False, "submit_batch_data": True}
+
+def json_route(handler):
+    return lambda params, payload: handler(json.loads(payload))
+
+def binary_route(handler, batch):
+    return lambda params, payload: handler(payload_codec.decode(payload, True, batch))
+
+def reading_route(sensor_type, binary):
+    decode = payload_codec.decode_sample if binary else json.loads
+    return lambda params, payload: submit_reading_handler(params, decode(payload), sensor_type)
+
+router = TopicRouter()
+for topic, handler in MQTT_TOPICS.items():
+    router.add(topic, json_route(handler))
+for topic, batch in BINARY_TOPICS.items():
+    router.add(topic + payload_codec.MQTT_BINARY_SUFFIX, binary_route(MQTT_TOPICS[topic], batch))
+for sensor_type in ["temperature", "light"]:
+    router.add(f"{READING_TOPIC}/{sensor_type}", reading_route(sensor_type, False))
+    router.add(f"{READING_TOPIC}/{sensor_type}{payload_codec.MQTT_BINARY_SUFFIX}", reading_route(sensor_type, True))
 
 # MQTT message handling functions
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to MQTT broker")
-        for topic, qos in MQTT_TOPICS:
-            client.subscribe(topic)
+        client.subscribe([(topic_filter, 0) for topic_filter in router.subscriptions(MQTT_SHARE_GROUP)])
     else:
         print(f"Failed to connect to MQTT broker, return code {rc}")
 
+# runs in paho's network thread, so it only hands the message to the worker pool
 def on_message(client, userdata, msg):
-    payload = msg.payload.decode()
-    data = json.loads(payload)
-    
-    if msg.topic == "submit_light_data":
-        submit_light_data_handler(data)
-    elif msg.topic == "submit_temperature_data":
-        submit_temperature_data_handler(data)
-    elif msg.topic == "new_sensor":
-        new_sensor_handler(data)
-    elif msg.topic == "update_sensor_position":
-        update_sensor_position_handler(data)
-    elif msg.topic == "delete_sensor":
-        delete_sensor_handler(data)
-    elif msg.topic == "new_position":
-        new_position_handler(data)
-    elif msg.topic == "update_position_data":
-        update_position_data_handler(data)
-    elif msg.topic == "delete_position":
-        delete_position_handler(data)
-    elif msg.topic == "new_plant":
-        new_plant_handler(data)
-    elif msg.topic == "update_plant":
-        update_plant_handler(data)
-    elif msg.topic == "delete_plant":
-        delete_plant_handler(data)
+    userdata.submit(msg.topic, msg.payload)
+
+def handle_message(topic, payload):
+    router.dispatch(topic, payload)
 
 def create_mqtt_server():
-    mqtt_client = mqtt.Client()
+    # MQTT_OVERFLOW is block (stalls the network thread, the broker buffers), drop_oldest or spill (to MQTT_SPILL_PATH)
+    pool = BoundedWorkerPool(handle_message,
+                             workers=int(os.environ.get("MQTT_WORKERS", 4)),
+                             queue_size=int(os.environ.get("MQTT_QUEUE_SIZE", 1000)),
+                             overflow=os.environ.get("MQTT_OVERFLOW", OVERFLOW_BLOCK),
+                             spill_path=worker_path(os.environ.get("MQTT_SPILL_PATH", "mqtt_spill")))
+    metrics.register("mqtt", pool.metrics)
+
+    mqtt_client = mqtt.Client(userdata=pool)
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
 
     try:
-        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, int(os.environ.get("MQTT_KEEPALIVE", 60)))
     except Exception as e:
         print(f"Failed to connect to MQTT broker: {e}")
         exit(1)
     mqtt_client.loop_start()
+    return mqtt_client, pool
+
+# no new messages are taken, the ones already queued are handed to the manager
+def stop_mqtt_server(mqtt_client, pool:BoundedWorkerPool) -> None:
+    mqtt_client.disconnect()
+    mqtt_client.loop_stop()
+    pool.close()
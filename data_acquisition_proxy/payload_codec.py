@@ -0,0 +1,154 @@
+import json
+import struct
+
+# Compact binary readings, selected with CoAP Content-Format 42, HTTP Content-Type
+# application/octet-stream or a /bin suffix on the MQTT topic.
+#
+# reading:  <B kind | report << 5> <B id length> <id> <B position length> <position> <f32 value> <u32 time>
+# a body holding several readings is the readings one after the other (little endian throughout)
+# per-device MQTT topics already carry the identity, there the payload is only <f32 value> <u32 time>
+#
+# batch:    <B kind | 0x80 [| 0x40] [| 0x20]> <B id length> <id> <B position length> <position> <B scale> <varint count>
+#           then (<zigzag time delta> <zigzag value delta> [<zigzag seq delta>] [<B report>]) * count, deltas start from 0
+#           with 0x20 set every sample carries its sequence number (SEQ), with 0x40 its report byte
+# report codes: 0 none, 1 exception (the value moved past the device deadband), 2 heartbeat
+# values are sent as integers of value * 10^scale, a batch expands to count readings of the same device
+
+BINARY_CONTENT_FORMAT = 42
+BINARY_CONTENT_TYPE = "application/octet-stream"
+MQTT_BINARY_SUFFIX = "/bin"
+
+KIND_TEMPERATURE = 1
+KIND_LUMINOSITY = 2
+VALUE_KEYS = {KIND_TEMPERATURE: "TEMPERATURE", KIND_LUMINOSITY: "LUMINOSITY"}
+KINDS = {key: kind for kind, key in VALUE_KEYS.items()}
+BATCH_FLAG = 0x80
+BATCH_REPORTS = 0x40
+BATCH_SEQUENCES = 0x20
+KIND_MASK = 0x1F
+REPORT_SHIFT = 5
+REPORTS = {0: None, 1: "exception", 2: "heartbeat"}
+REPORT_CODES = {report: code for code, report in REPORTS.items()}
+
+SAMPLE = struct.Struct("<fI")
+
+def encode_reading(data:dict) -> bytes:
+    kind = next((KINDS[key] for key in KINDS if key in data), None)
+    if kind is None:
+        raise ValueError("the reading has neither TEMPERATURE nor LUMINOSITY")
+    id = data["ID"].encode("utf-8")
+    position = data["POSITION"].encode("utf-8")
+    report = REPORT_CODES[data.get("REPORT")] << REPORT_SHIFT
+    return (bytes([kind | report, len(id)]) + id + bytes([len(position)]) + position
+            + SAMPLE.pack(data[VALUE_KEYS[kind]], int(data["TIME"])))
+
+# a f32 holds about 7 significant digits, the value is rounded to them so 21.37 is
+# stored as 21.37 like on the JSON path and not as 21.3700008392334
+def round_f32(value:float) -> float:
+    return float(f"{value:.7g}")
+
+def read_varint(payload:bytes, offset:int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = payload[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def read_zigzag(payload:bytes, offset:int) -> tuple[int, int]:
+    value, offset = read_varint(payload, offset)
+    return (value >> 1) ^ -(value & 1), offset
+
+def decode_header_at(payload:bytes, offset:int) -> tuple[int, str, str, int]:
+    kind = payload[offset]
+    id_length = payload[offset + 1]
+    id = payload[offset + 2:offset + 2 + id_length].decode("utf-8")
+    offset += 2 + id_length
+    position_length = payload[offset]
+    position = payload[offset + 1:offset + 1 + position_length].decode("utf-8")
+    offset += 1 + position_length
+    if offset > len(payload):
+        raise IndexError("truncated header")
+    if kind & KIND_MASK not in VALUE_KEYS:
+        raise ValueError(f"unknown reading kind {kind}")
+    return kind, id, position, offset
+
+def decode_reading_at(payload:bytes, offset:int) -> tuple[dict, int]:
+    try:
+        kind, id, position, offset = decode_header_at(payload, offset)
+        if kind & BATCH_FLAG:
+            raise ValueError("a batch is only accepted where several readings are")
+        value, time = SAMPLE.unpack_from(payload, offset)
+        report = REPORTS[kind >> REPORT_SHIFT]
+    except (IndexError, KeyError, UnicodeDecodeError, struct.error) as e:
+        raise ValueError(f"malformed binary reading: {e}")
+    reading = {"ID": id, "POSITION": position, VALUE_KEYS[kind & KIND_MASK]: round_f32(value), "TIME": time}
+    if report is not None:
+        reading["REPORT"] = report
+    return reading, offset + SAMPLE.size
+
+def decode_batch_at(payload:bytes, offset:int) -> tuple[list[dict], int]:
+    try:
+        kind, id, position, offset = decode_header_at(payload, offset)
+        key = VALUE_KEYS[kind & KIND_MASK]
+        scale = 10 ** payload[offset]
+        count, offset = read_varint(payload, offset + 1)
+        readings = []
+        time = 0
+        value = 0
+        seq = 0
+        for _ in range(count):
+            delta, offset = read_zigzag(payload, offset)
+            time += delta
+            delta, offset = read_zigzag(payload, offset)
+            value += delta
+            reading = {"ID": id, "POSITION": position, key: value / scale, "TIME": time}
+            if kind & BATCH_SEQUENCES:
+                delta, offset = read_zigzag(payload, offset)
+                seq += delta
+                reading["SEQ"] = seq
+            if kind & BATCH_REPORTS:
+                report = REPORTS[payload[offset]]
+                offset += 1
+                if report is not None:
+                    reading["REPORT"] = report
+            readings.append(reading)
+    except (IndexError, KeyError, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed binary batch: {e}")
+    return readings, offset
+
+def decode_readings(payload:bytes) -> list[dict]:
+    readings = []
+    offset = 0
+    while offset < len(payload):
+        if payload[offset] & BATCH_FLAG:
+            batch, offset = decode_batch_at(payload, offset)
+            readings.extend(batch)
+        else:
+            reading, offset = decode_reading_at(payload, offset)
+            readings.append(reading)
+    return readings
+
+def decode_reading(payload:bytes) -> dict:
+    reading, offset = decode_reading_at(payload, 0)
+    if offset != len(payload):
+        raise ValueError("trailing bytes after the binary reading")
+    return reading
+
+def decode_sample(payload:bytes) -> dict:
+    if len(payload) != SAMPLE.size:
+        raise ValueError(f"a binary sample is {SAMPLE.size} bytes, got {len(payload)}")
+    value, time = SAMPLE.unpack(payload)
+    return {"VALUE": round_f32(value), "TIME": time}
+
+# the submission handlers take a dict for a single reading and a list for a batch,
+# decode gives them the same shape whatever the encoding was
+def decode(payload:bytes, binary:bool, batch:bool=False) -> dict|list:
+    if not binary:
+        return json.loads(payload)
+    if batch:
+        return decode_readings(payload)
+    return decode_reading(payload)
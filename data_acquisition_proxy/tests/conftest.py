@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the proxy modules import each other by their flat names, as when main.py runs from its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+import math
+import random
+import struct
+from gorilla import encode_timestamps, decode_timestamps, encode_floats, decode_floats
+
+def test_timestamps_round_trip():
+    random.seed(1)
+    timestamps = [1700000000000]
+    for _ in range(2000):
+        # regular spacing with jitter, long gaps and a step back now and then
+        timestamps.append(timestamps[-1] + random.choice([300000, 300000, 300001, 299000, 86400000, -5000]))
+    assert decode_timestamps(encode_timestamps(timestamps), len(timestamps)) == timestamps
+
+def test_extreme_deltas_round_trip():
+    timestamps = [0, 1, 2 ** 40, 3, 2 ** 62, 0]
+    assert decode_timestamps(encode_timestamps(timestamps), len(timestamps)) == timestamps
+
+def test_floats_round_trip_bit_for_bit():
+    random.seed(2)
+    values = [21.5, 21.5, 21.53, -0.0, 0.0, math.inf, -math.inf, 1e-300, 1e300, math.nan]
+    values += [round(20 + random.random(), 2) for _ in range(1000)]
+    decoded = decode_floats(encode_floats(values), len(values))
+    bits = lambda v: struct.pack(">d", v)
+    assert [bits(v) for v in decoded] == [bits(v) for v in values]
+
+def test_repeated_values_are_compact():
+    values = [21.5] * 1000
+    assert len(encode_floats(values)) < 8 + 1000 // 8 + 2
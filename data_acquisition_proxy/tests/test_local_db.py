@@ -0,0 +1,79 @@
+import os
+from local_db import LocalDB
+from data import SensorConfiguration
+
+def insert(db, n, start=0, device="id01"):
+    for i in range(start, start + n):
+        db.insert_time_series("Temperature_data", {"temperature": str(20.0 + i)}, {"device": device, "position": "P01"}, 1000 + i)
+
+def temperatures(rows):
+    return [row["temperature"] for row in sorted(rows, key=lambda r: r["_time"])]
+
+def test_points_survive_reopening(tmp_path):
+    db = LocalDB(str(tmp_path), chunk_size=4, flush_interval=60)
+    insert(db, 10)
+    db.close()
+
+    db = LocalDB(str(tmp_path), chunk_size=4, flush_interval=60)
+    rows = db.query_time_series("Temperature_data", {}, {}, {})
+    assert temperatures(rows) == [str(20.0 + i) for i in range(10)]
+    series = next(iter(db.series.values()))
+    assert len(series.index) == 2 and len(series.times) == 2
+    db.close()
+
+def test_flushed_tail_is_replayed_without_close(tmp_path):
+    db = LocalDB(str(tmp_path), chunk_size=100, flush_interval=60)
+    insert(db, 3)
+    db.flush()
+    # no close: the process is gone, only the tail file holds the points
+
+    db = LocalDB(str(tmp_path), chunk_size=100, flush_interval=60)
+    assert temperatures(db.query_time_series("Temperature_data", {}, {}, {})) == ["20.0", "21.0", "22.0"]
+    db.close()
+
+def test_tail_of_a_sealed_chunk_is_not_replayed(tmp_path):
+    db = LocalDB(str(tmp_path), chunk_size=2, flush_interval=60)
+    insert(db, 1)
+    db.flush()
+    series = next(iter(db.series.values()))
+    tail = os.path.join(series.path, "tail")
+    with open(tail) as f:
+        stale = f.read()
+    insert(db, 1, start=1)
+    # a crash after the chunk was sealed but before the tail was reset
+    with open(tail, "w") as f:
+        f.write(stale)
+
+    db = LocalDB(str(tmp_path), chunk_size=2, flush_interval=60)
+    assert temperatures(db.query_time_series("Temperature_data", {}, {}, {})) == ["20.0", "21.0"]
+    db.close()
+
+def test_query_filters_and_aggregates(tmp_path):
+    db = LocalDB(str(tmp_path), chunk_size=4, flush_interval=60)
+    insert(db, 6)
+    insert(db, 2, device="id02")
+    rows = db.query_time_series("Temperature_data", {"start": "1001", "stop": "1004"}, {}, {"device": "id01"})
+    assert temperatures(rows) == ["21.0", "22.0", "23.0"]
+    counts = db.query_time_series("Temperature_data", {}, {}, {}, "count()")
+    assert sorted(c["temperature"] for c in counts) == [2, 6]
+    mean = db.query_time_series("Temperature_data", {}, {}, {"device": "id02"}, "mean()")
+    assert mean[0]["temperature"] == 20.5
+    db.close()
+
+def test_gorilla_chunks_read_back(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCAL_DB_COMPRESSION", "gorilla")
+    db = LocalDB(str(tmp_path), chunk_size=4, flush_interval=60)
+    insert(db, 8)
+    db.close()
+    db = LocalDB(str(tmp_path), chunk_size=4, flush_interval=60)
+    assert temperatures(db.query_time_series("Temperature_data", {}, {}, {})) == [str(20.0 + i) for i in range(8)]
+    db.close()
+
+def test_registry_survives_reopening(tmp_path):
+    db = LocalDB(str(tmp_path), flush_interval=60)
+    db.create_device(SensorConfiguration(id="id01", position="P01", ip="10.0.0.2"))
+    db.close()
+    db = LocalDB(str(tmp_path), flush_interval=60)
+    assert db.get_device("id01") == [{"deviceId": "id01", "ip": "10.0.0.2", "position": "P01"}]
+    assert db.get_device("id02") == []
+    db.close()
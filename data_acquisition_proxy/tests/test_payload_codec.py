@@ -0,0 +1,58 @@
+import importlib.util
+import os
+from array import array
+import pytest
+import payload_codec
+
+# the device encoder, loaded by path: it has the same module name as the proxy decoder
+spec = importlib.util.spec_from_file_location("device_payload_codec",
+    os.path.join(os.path.dirname(__file__), "..", "..", "on_device_py", "payload_codec.py"))
+device_codec = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(device_codec)
+
+def device_batch(values, times, reports=None, seqs=None, kind=device_codec.KIND_TEMPERATURE):
+    out = bytearray(7 + 4 + 3 + 16 * len(values))
+    size = device_codec.encode_batch(out, kind, "id01", "P01", array("f", values), array("I", times), len(values),
+                                     reports=None if reports is None else array("B", reports),
+                                     seqs=None if seqs is None else array("I", seqs))
+    return bytes(out[:size])
+
+def test_device_reading_decodes_with_rounded_value():
+    payload = device_codec.encode_reading(device_codec.KIND_TEMPERATURE, "id01", "P01", 21.37, 1700000000, "heartbeat")
+    assert payload_codec.decode(payload, True) == {"ID": "id01", "POSITION": "P01", "TEMPERATURE": 21.37,
+                                                   "TIME": 1700000000, "REPORT": "heartbeat"}
+
+def test_proxy_and_device_readings_are_the_same_bytes():
+    reading = {"ID": "id01", "POSITION": "P01", "LUMINOSITY": 512.0, "TIME": 1700000000}
+    assert payload_codec.encode_reading(reading) == device_codec.encode_reading(device_codec.KIND_LUMINOSITY, "id01", "P01", 512.0, 1700000000)
+    assert payload_codec.decode(payload_codec.encode_reading(reading), True) == reading
+
+def test_batch_round_trip_with_reports_and_sequences():
+    readings = payload_codec.decode(device_batch([21.5, 21.25, 22.0], [1000, 1300, 1600], reports=[0, 1, 2], seqs=[7, 8, 10]), True, True)
+    assert [r["TEMPERATURE"] for r in readings] == [21.5, 21.25, 22.0]
+    assert [r["TIME"] for r in readings] == [1000, 1300, 1600]
+    assert [r["SEQ"] for r in readings] == [7, 8, 10]
+    assert [r.get("REPORT") for r in readings] == [None, "exception", "heartbeat"]
+
+@pytest.mark.parametrize("times", [[2 ** 31, 2 ** 31 + 300], [2200000000, 4000000000, 1000], [2 ** 32 - 1, 0]])
+def test_batch_times_past_2_to_the_31(times):
+    readings = payload_codec.decode(device_batch([-3.5] * len(times), times), True, True)
+    assert [r["TIME"] for r in readings] == times
+
+def test_large_value_and_sequence_deltas():
+    readings = payload_codec.decode(device_batch([-30000000.0, 30000000.0], [1000, 1001], seqs=[1, 2 ** 32 - 1]), True, True)
+    assert [r["TEMPERATURE"] for r in readings] == [-30000000.0, 30000000.0]
+    assert [r["SEQ"] for r in readings] == [1, 2 ** 32 - 1]
+
+def test_concatenated_batches_decode_together():
+    payload = device_batch([21.0], [1000]) + device_batch([300.0], [1000], kind=device_codec.KIND_LUMINOSITY)
+    readings = payload_codec.decode(payload, True, True)
+    assert readings[0]["TEMPERATURE"] == 21.0 and readings[1]["LUMINOSITY"] == 300.0
+
+def test_truncated_payloads_are_rejected():
+    payload = device_batch([21.0, 22.0], [1000, 1300])
+    with pytest.raises(ValueError):
+        payload_codec.decode(payload[:-1], True, True)
+    reading = device_codec.encode_reading(device_codec.KIND_TEMPERATURE, "id01", "P01", 21.0, 1000)
+    with pytest.raises(ValueError):
+        payload_codec.decode(reading[:-2], True)
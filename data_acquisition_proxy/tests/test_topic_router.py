@@ -0,0 +1,36 @@
+import pytest
+from topic_router import TopicRouter
+
+def make_router():
+    router = TopicRouter()
+    router.add("plants/{plant}/positions/{position}/devices/{id}", lambda params, payload: ("reading", params))
+    router.add("plants/{plant}/positions/{position}/devices/{id}/bin", lambda params, payload: ("binary", params))
+    router.add("submit_batch_data", lambda params, payload: ("batch", payload))
+    return router
+
+def test_share_group_subscriptions():
+    router = make_router()
+    assert router.subscriptions() == ["plants/+/positions/+/devices/+", "plants/+/positions/+/devices/+/bin", "submit_batch_data"]
+    assert router.subscriptions("proxies") == ["$share/proxies/plants/+/positions/+/devices/+",
+                                              "$share/proxies/plants/+/positions/+/devices/+/bin",
+                                              "$share/proxies/submit_batch_data"]
+
+def test_shared_deliveries_match_on_the_plain_topic():
+    # the broker delivers messages of a $share subscription with their original topic
+    router = make_router()
+    assert router.dispatch("plants/p1/positions/P01/devices/id01", b"") == ("reading", {"plant": "p1", "position": "P01", "id": "id01"})
+    assert router.dispatch("plants/p1/positions/P01/devices/id01/bin", b"")[0] == "binary"
+    assert router.dispatch("submit_batch_data", b"x") == ("batch", b"x")
+
+def test_share_prefixed_topics_are_not_routed():
+    router = make_router()
+    assert router.match("$share/proxies/submit_batch_data") is None
+    with pytest.raises(KeyError):
+        router.dispatch("plants/p1/positions/P01", b"")
+
+def test_conflicting_patterns_are_rejected():
+    router = make_router()
+    with pytest.raises(ValueError):
+        router.add("plants/{garden}/positions/{position}/devices/{id}/x", lambda params, payload: None)
+    with pytest.raises(ValueError):
+        router.add("submit_batch_data", lambda params, payload: None)
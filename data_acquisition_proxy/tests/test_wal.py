@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from wal import WriteAheadLog, WalDrainer
+
+def records(n, start=0):
+    return [{"measurement": "Temperature_data", "values": {"temperature": str(i)},
+             "tags": {"device": "id01"}, "time": 1000 + i} for i in range(start, start + n)]
+
+def test_records_are_replayed_after_reopening(tmp_path):
+    wal = WriteAheadLog(str(tmp_path), fsync="always")
+    wal.append_many(records(5))
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path))
+    read, position = wal.read(wal.load_checkpoint(), 100)
+    assert read == records(5)
+    wal.save_checkpoint(position)
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path))
+    read, _ = wal.read(wal.load_checkpoint(), 100)
+    assert read == []
+    wal.close()
+
+def test_torn_record_is_dropped_on_recovery(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    wal.append_many(records(3))
+    wal.close()
+    segment = os.path.join(str(tmp_path), sorted(os.listdir(str(tmp_path)))[0])
+    with open(segment, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    wal = WriteAheadLog(str(tmp_path))
+    wal.append_many(records(1, start=3))
+    read, _ = wal.read(wal.load_checkpoint(), 100)
+    assert read == records(4)
+    wal.close()
+
+def test_reads_span_rotated_segments(tmp_path):
+    wal = WriteAheadLog(str(tmp_path), segment_size=200)
+    for i in range(10):
+        wal.append_many(records(1, start=i))
+    assert len(wal.segments()) > 1
+    read, _ = wal.read(wal.load_checkpoint(), 100)
+    assert read == records(10)
+    wal.close()
+
+def test_drainer_retries_until_written(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    wal.append_many(records(4))
+    written = []
+    done = threading.Event()
+    calls = []
+
+    def write_batch(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise OSError("storage down")
+        written.extend(batch)
+        if len(written) == 4:
+            done.set()
+
+    drainer = WalDrainer(wal, write_batch, interval=0.01)
+    assert done.wait(5)
+    drainer.close()
+    assert written == records(4)
+    assert WriteAheadLog(str(tmp_path)).read(wal.load_checkpoint(), 100)[0] == []
+
+def test_interval_fsync_runs_without_the_drainer(tmp_path):
+    wal = WriteAheadLog(str(tmp_path), fsync="interval", sync_interval=0.01)
+    wal.append_many(records(1))
+    assert wal.dirty
+    deadline = time.monotonic() + 5
+    while wal.dirty and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not wal.dirty
+    wal.close()
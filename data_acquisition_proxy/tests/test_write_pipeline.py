@@ -0,0 +1,60 @@
+import threading
+from write_pipeline import WritePipeline
+
+def test_batches_are_written_and_flushed():
+    written = []
+    pipeline = WritePipeline(written.append, batch_size=3, flush_interval=0.05)
+    pipeline.submit_many([1, 2, 3, 4, 5])
+    assert pipeline.flush(timeout=5)
+    assert sorted(p for batch in written for p in batch) == [1, 2, 3, 4, 5]
+    assert all(len(batch) <= 3 for batch in written)
+    pipeline.close()
+
+def test_close_writes_what_is_queued():
+    written = []
+    pipeline = WritePipeline(written.extend, batch_size=100, flush_interval=10)
+    pipeline.submit_many(list(range(10)))
+    pipeline.close()
+    assert written == list(range(10))
+
+def test_failed_batch_is_retried_then_reported():
+    attempts = []
+    failures = []
+
+    def write(batch):
+        attempts.append(batch)
+        raise OSError("storage down")
+
+    pipeline = WritePipeline(write, flush_interval=0.05, max_retries=2, retry_base_delay=0,
+                             on_failure=lambda batch, e: failures.append((batch, str(e))))
+    pipeline.submit(1)
+    assert pipeline.flush(timeout=5)
+    assert len(attempts) == 3
+    assert failures == [([1], "storage down")]
+    pipeline.close()
+
+def test_raising_callbacks_do_not_stop_the_worker():
+    def fail(*args):
+        raise RuntimeError("callback bug")
+
+    pipeline = WritePipeline(lambda batch: None, flush_interval=0.05, max_queue_size=2, on_success=fail)
+    for i in range(5):
+        pipeline.submit(i)
+        assert pipeline.flush(timeout=5)
+    assert pipeline.worker.is_alive()
+    pipeline.close()
+
+def test_raising_failure_callback_does_not_stop_the_worker():
+    def write(batch):
+        raise OSError("storage down")
+
+    def fail(*args):
+        raise RuntimeError("callback bug")
+
+    pipeline = WritePipeline(write, flush_interval=0.05, max_retries=0, on_failure=fail)
+    pipeline.submit(1)
+    assert pipeline.flush(timeout=5)
+    pipeline.submit(2)
+    assert pipeline.flush(timeout=5)
+    assert pipeline.worker.is_alive()
+    pipeline.close()
@@ -0,0 +1,76 @@
+from typing import Any, Callable
+
+# Topic patterns use {name} for a single level captured as a parameter, e.g.
+# "plants/{plant}/positions/{position}/devices/{id}/temperature".
+# Patterns are compiled into a tree of levels so matching a topic is one dict lookup per level.
+
+class Node:
+    def __init__(self) -> None:
+        self.children:dict[str, "Node"] = {}
+        self.wildcard:"Node|None" = None
+        self.name:str|None = None
+        self.handler:Callable|None = None
+
+class TopicRouter:
+    def __init__(self) -> None:
+        self.root = Node()
+        self.patterns:list[str] = []
+
+    def add(self, pattern:str, handler:Callable[[dict[str, str], bytes], Any]) -> None:
+        node = self.root
+        for level in pattern.split("/"):
+            if level.startswith("{") and level.endswith("}"):
+                if node.wildcard is None:
+                    node.wildcard = Node()
+                    node.wildcard.name = level[1:-1]
+                elif node.wildcard.name != level[1:-1]:
+                    raise ValueError(f"{pattern} names level {level} differently from another route")
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(level, Node())
+        if node.handler is not None:
+            raise ValueError(f"a route for {pattern} is already present")
+        node.handler = handler
+        self.patterns.append(pattern)
+
+    def match(self, topic:str) -> tuple[Callable, dict[str, str]] | None:
+        params = {}
+        handler = self.walk(self.root, topic.split("/"), 0, params)
+        if handler is None:
+            return None
+        return handler, params
+
+    def walk(self, node:Node, levels:list[str], i:int, params:dict[str, str]) -> Callable | None:
+        if i == len(levels):
+            return node.handler
+        # literal levels take precedence over {name} levels
+        child = node.children.get(levels[i])
+        if child is not None:
+            handler = self.walk(child, levels, i + 1, params)
+            if handler is not None:
+                return handler
+        if node.wildcard is not None:
+            handler = self.walk(node.wildcard, levels, i + 1, params)
+            if handler is not None:
+                params[node.wildcard.name] = levels[i]
+                return handler
+        return None
+
+    def dispatch(self, topic:str, payload:bytes) -> Any:
+        route = self.match(topic)
+        if route is None:
+            raise KeyError(f"no route for topic {topic}")
+        handler, params = route
+        return handler(params, payload)
+
+    def subscriptions(self, share_group:str|None=None) -> list[str]:
+        # MQTT filters for the registered patterns, {name} levels become +.
+        # With a share group the broker delivers each message to only one subscriber of the group.
+        filters = []
+        for pattern in self.patterns:
+            topic_filter = "/".join("+" if level.startswith("{") and level.endswith("}") else level
+                                    for level in pattern.split("/"))
+            if share_group is not None:
+                topic_filter = f"$share/{share_group}/{topic_filter}"
+            filters.append(topic_filter)
+        return filters
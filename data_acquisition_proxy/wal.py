@@ -0,0 +1,226 @@
+import atexit
+import json
+import os
+import random
+import struct
+import threading
+import zlib
+from typing import Callable
+
+# Segment files are named <number>.wal and contain records of
+#   length u32, crc32 u32, JSON payload
+# A position in the log is the (segment number, byte offset) of the next record to read.
+RECORD_HEADER = struct.Struct("<II")
+CHECKPOINT = struct.Struct("<QQ")
+
+class WriteAheadLog:
+    # fsync "always" syncs every append before it returns, "interval" syncs at most
+    # sync_interval seconds later from its own thread, whatever the drainer is doing
+    def __init__(self, path:str, segment_size:int=16 * 1024 * 1024, fsync:str="always",
+                 sync_interval:float=1.0) -> None:
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        os.makedirs(path, exist_ok=True)
+
+        segments = self.segments()
+        self.segment = segments[-1] if len(segments) > 0 else 0
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.recover()
+        self.dirty = False
+
+        self.closed = threading.Event()
+        if fsync == "interval":
+            threading.Thread(target=self.run_syncer, name="wal-sync", daemon=True).start()
+
+    def run_syncer(self) -> None:
+        while not self.closed.wait(self.sync_interval):
+            self.sync()
+
+    def segments(self) -> list[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".wal"))
+
+    def segment_path(self, segment:int) -> str:
+        return os.path.join(self.path, f"{segment:012d}.wal")
+
+    def recover(self) -> None:
+        # a crash in the middle of an append leaves a torn record at the end of the active segment
+        valid = 0
+        with open(self.segment_path(self.segment), "rb") as f:
+            data = f.read()
+        for end, _ in self.parse(data, 0):
+            valid = end
+        if valid < len(data):
+            self.file.truncate(valid)
+        self.size = valid
+
+    def parse(self, data:bytes, offset:int):
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset = start + length
+            yield offset, payload
+
+    def append(self, record:dict) -> None:
+        self.append_many([record])
+
+    def append_many(self, records:list[dict]) -> None:
+        data = bytearray()
+        for record in records:
+            payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            data += RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            data += payload
+        with self.lock:
+            if self.size > 0 and self.size + len(data) > self.segment_size:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+            if self.fsync == "always":
+                os.fsync(self.file.fileno())
+            else:
+                self.dirty = True
+            self.size += len(data)
+            self.appended.notify_all()
+
+    def rotate(self) -> None:
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.segment += 1
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.size = 0
+
+    def sync(self) -> None:
+        with self.lock:
+            if self.dirty and not self.file.closed:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def wait(self, position:tuple[int, int], timeout:float) -> None:
+        with self.lock:
+            if position == (self.segment, self.size):
+                self.appended.wait(timeout)
+
+    # returns up to limit records after position and the position following the last one
+    def read(self, position:tuple[int, int], limit:int) -> tuple[list[dict], tuple[int, int]]:
+        segment, offset = position
+        records = []
+        while len(records) < limit:
+            with self.lock:
+                active, size = self.segment, self.size
+            if segment > active:
+                break
+            path = self.segment_path(segment)
+            if not os.path.exists(path):
+                segment, offset = segment + 1, 0
+                continue
+            end = size if segment == active else None
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read() if end is None else f.read(end - offset)
+            consumed = 0
+            for end_offset, payload in self.parse(data, 0):
+                records.append(json.loads(payload))
+                consumed = end_offset
+                if len(records) >= limit:
+                    break
+            offset += consumed
+            if len(records) >= limit or segment == active:
+                break
+            segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    def load_checkpoint(self) -> tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, "checkpoint"), "rb") as f:
+                return CHECKPOINT.unpack(f.read(CHECKPOINT.size))
+        except (FileNotFoundError, struct.error):
+            segments = self.segments()
+            return (segments[0] if len(segments) > 0 else 0, 0)
+
+    def save_checkpoint(self, position:tuple[int, int]) -> None:
+        checkpoint = os.path.join(self.path, "checkpoint")
+        with open(checkpoint + ".tmp", "wb") as f:
+            f.write(CHECKPOINT.pack(*position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint + ".tmp", checkpoint)
+        with self.lock:
+            active = self.segment
+        for segment in self.segments():
+            if segment < position[0] and segment != active:
+                os.remove(self.segment_path(segment))
+
+    def pending(self, position:tuple[int, int]) -> int:
+        with self.lock:
+            active, size = self.segment, self.size
+        total = size
+        for segment in self.segments():
+            if position[0] <= segment < active:
+                total += os.path.getsize(self.segment_path(segment))
+        return total - position[1]
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+
+class WalDrainer:
+    # Replays the log into write_batch, which must raise if the records were not stored.
+    # The checkpoint only advances past records that were written, failed batches are
+    # retried with backoff so nothing accepted is ever dropped.
+    def __init__(self, wal:WriteAheadLog, write_batch:Callable[[list[dict]], None],
+                 batch_size:int=500, interval:float=1.0, max_backoff:float=60.0) -> None:
+        self.wal = wal
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.position = wal.load_checkpoint()
+        self.closed = threading.Event()
+        self.failures = 0
+
+        self.worker = threading.Thread(target=self.run, name="wal-drainer", daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    def run(self) -> None:
+        while not self.closed.is_set():
+            records, position = self.wal.read(self.position, self.batch_size)
+            if len(records) == 0:
+                if position != self.position:
+                    self.commit(position)
+                self.wal.wait(self.position, self.interval)
+                continue
+            try:
+                self.write_batch(records)
+            except Exception as e:
+                self.failures += 1
+                backoff = min(self.max_backoff, self.interval * (2 ** min(self.failures, 16)))
+                print(f"could not drain {len(records)} records, retrying: {e}")
+                self.closed.wait(random.uniform(backoff / 2, backoff))
+                continue
+            self.failures = 0
+            self.commit(position)
+
+    def commit(self, position:tuple[int, int]) -> None:
+        self.position = position
+        self.wal.save_checkpoint(position)
+
+    def close(self, timeout:float=10.0) -> None:
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.worker.join(timeout=timeout)
+        self.wal.close()
+
+    def stats(self) -> dict[str, int]:
+        return {"pending_bytes": self.wal.pending(self.position), "failures": self.failures}
@@ -0,0 +1,122 @@
+import atexit
+import base64
+import queue
+import threading
+import time
+from typing import Callable
+from wal import WriteAheadLog, WalDrainer
+
+# What submit does when the queue is full:
+OVERFLOW_BLOCK = "block"              # wait for a free slot, the caller is slowed down
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # discard the oldest queued message
+OVERFLOW_SPILL = "spill"              # append the message to a log on disk, it is queued again once there is room
+
+class BoundedWorkerPool:
+    # Messages are (topic, payload bytes) pairs handled by handler(topic, payload) on a fixed set of threads.
+    def __init__(self, handler:Callable[[str, bytes], None], workers:int=4, queue_size:int=1000,
+                 overflow:str=OVERFLOW_BLOCK, spill_path:str|None=None) -> None:
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL):
+            raise ValueError(f"unknown overflow policy {overflow}")
+        if overflow == OVERFLOW_SPILL and spill_path is None:
+            raise ValueError("the spill policy needs a spill path")
+
+        self.handler = handler
+        self.overflow = overflow
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.processing_time = 0.0
+        self.max_processing_time = 0.0
+
+        self.spill = None
+        self.refiller = None
+        if overflow == OVERFLOW_SPILL:
+            self.spill = WriteAheadLog(spill_path, fsync="interval")
+            self.refiller = WalDrainer(self.spill, self.refill, batch_size=max(1, queue_size // 10))
+
+        self.threads = [threading.Thread(target=self.run, name=f"mqtt-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        atexit.register(self.close)
+
+    def submit(self, topic:str, payload:bytes) -> None:
+        item = (topic, payload)
+        if self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == OVERFLOW_SPILL:
+            self.spill.append({"topic": topic, "payload": base64.b64encode(payload).decode("ascii")})
+            with self.lock:
+                self.spilled += 1
+            return
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                with self.lock:
+                    self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def refill(self, records:list[dict]) -> None:
+        # blocking puts: spilled messages only come back as fast as the workers free slots
+        for record in records:
+            self.queue.put((record["topic"], base64.b64decode(record["payload"])))
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            start = time.perf_counter()
+            try:
+                self.handler(*item)
+                failed = 0
+            except Exception as e:
+                print(f"error while handling message on {item[0]}: {e}")
+                failed = 1
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.processed += 1
+                self.failed += failed
+                self.processing_time += elapsed
+                self.max_processing_time = max(self.max_processing_time, elapsed)
+            self.queue.task_done()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            metrics = {
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "avg_processing_ms": 1000 * self.processing_time / self.processed if self.processed > 0 else 0.0,
+                "max_processing_ms": 1000 * self.max_processing_time
+            }
+        if self.refiller is not None:
+            metrics["spill_pending_bytes"] = self.refiller.stats()["pending_bytes"]
+        return metrics
+
+    def close(self, timeout:float=10.0) -> None:
+        if self.refiller is not None:
+            self.refiller.close()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
@@ -0,0 +1,136 @@
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable
+
+class WritePipeline:
+    # Points are queued in-process and handed to write_batch in groups, either when
+    # batch_size points are waiting or when the oldest queued point is older than
+    # flush_interval seconds. The queue is bounded: submit blocks once it is full.
+    def __init__(self, write_batch:Callable[[list], None],
+                 batch_size:int=500,
+                 flush_interval:float=1.0,
+                 max_queue_size:int=10000,
+                 max_retries:int=3,
+                 retry_base_delay:float=0.5,
+                 on_success:Callable[[list], None]|None=None,
+                 on_failure:Callable[[list, Exception], None]|None=None) -> None:
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.flush_requested = threading.Event()
+        self.flushed = threading.Condition()
+        self.pending = 0
+        self.closed = False
+
+        self.worker = threading.Thread(target=self.run, name="write-pipeline", daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def from_env(write_batch:Callable[[list], None], **kwargs) -> "WritePipeline":
+        return WritePipeline(write_batch,
+                             batch_size=int(os.environ.get("WRITE_BATCH_SIZE", 500)),
+                             flush_interval=float(os.environ.get("WRITE_FLUSH_INTERVAL", 1.0)),
+                             max_queue_size=int(os.environ.get("WRITE_QUEUE_SIZE", 10000)),
+                             max_retries=int(os.environ.get("WRITE_MAX_RETRIES", 3)),
+                             retry_base_delay=float(os.environ.get("WRITE_RETRY_DELAY", 0.5)),
+                             **kwargs)
+
+    def submit(self, record) -> None:
+        self.submit_many([record])
+
+    def submit_many(self, records:list) -> None:
+        if self.closed:
+            raise RuntimeError("write pipeline is closed")
+        with self.flushed:
+            self.pending += len(records)
+        for record in records:
+            self.queue.put(record)
+
+    def flush(self, timeout:float|None=None) -> bool:
+        self.flush_requested.set()
+        with self.flushed:
+            return self.flushed.wait_for(lambda: self.pending == 0, timeout=timeout)
+
+    def close(self, timeout:float|None=10.0) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.flush_requested.set()
+        self.worker.join(timeout=timeout)
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect()
+            if len(batch) > 0:
+                self.write_with_retry(batch)
+                with self.flushed:
+                    self.pending -= len(batch)
+                    self.flushed.notify_all()
+            elif self.closed:
+                return
+
+    def collect(self) -> list:
+        batch = []
+        # every wait is sliced so a flush or close requested meanwhile is seen
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) == 0:
+            try:
+                batch.append(self.queue.get(timeout=min(self.flush_interval, 0.05)))
+            except queue.Empty:
+                if self.closed or time.monotonic() >= deadline:
+                    self.flush_requested.clear()
+                    return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self.flush_requested.is_set() or self.closed:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    self.flush_requested.clear()
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def write_with_retry(self, batch:list) -> None:
+        attempt = 0
+        while True:
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.notify(self.on_failure, batch, e)
+                    return
+                # full jitter: sleep anywhere up to the exponential backoff ceiling
+                time.sleep(random.uniform(0, self.retry_base_delay * (2 ** attempt)))
+                attempt += 1
+                continue
+            self.notify(self.on_success, batch)
+            return
+
+    # a failing callback must not take the worker down with it, submit would block for good
+    def notify(self, callback:Callable|None, *args) -> None:
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"write pipeline callback failed: {e}")
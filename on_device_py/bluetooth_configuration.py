@@ -10,6 +10,7 @@ import time
 import machine
 import ubinascii
 import json
+import wifi
 import network
 from utime import sleep
 from ble_advertising import advertising_payload
@@ -114,17 +115,7 @@ class BLEConfigReceiver:
         
        
     def try_connect(self, ssid, pwd):
-        wlan = network.WLAN(network.STA_IF)
-        wlan.active(True)
-        wlan.connect(ssid, pwd)
-        connected = False
-        for i in range(20):
-            print(f'({i}) Waiting for connection...')
-            sleep(1)
-            if wlan.isconnected():
-                connected = True
-                break
-        return connected
+        return wifi.connect(ssid, pwd).isconnected()
     
     def updated_configuration(self):
         if self._new_configuration:
@@ -0,0 +1,102 @@
+import struct
+from binascii import crc32
+
+# record: <u32 seq> <u32 time> <f32 value> <B kind> <B report> <u16 crc of the first 14 bytes>
+RECORD = struct.Struct("<IIfBBH")
+# acknowledgement slot: <u32 acked seq> <u32 crc>
+ACK = struct.Struct("<II")
+
+class FlashRing:
+    # Readings waiting to be delivered, kept in a file of capacity fixed-size slots.
+    # Record seq goes to slot seq % capacity, so the newest record is found by scanning
+    # and no head pointer has to be rewritten. The highest delivered seq is written to
+    # the next of ack_slots small slots in turn, spreading those writes over the flash.
+    # When the ring is full the oldest undelivered records are overwritten.
+    def __init__(self, path="ring.bin", capacity=512, ack_path="ring.ack", ack_slots=16):
+        self.path = path
+        self.capacity = capacity
+        self.ack_path = ack_path
+        self.ack_slots = ack_slots
+        self.record = bytearray(RECORD.size)
+        self.next_seq = 1
+        self.acked = 0
+        self.ack_slot = 0
+        self.open()
+
+    def open(self):
+        try:
+            self.file = open(self.path, "r+b")
+        except OSError:
+            self.file = open(self.path, "w+b")
+            self.file.write(bytes(RECORD.size * self.capacity))
+            self.file.flush()
+        for slot in range(self.capacity):
+            self.file.seek(slot * RECORD.size)
+            record = self.read_record()
+            if record is not None and record[0] >= self.next_seq:
+                self.next_seq = record[0] + 1
+
+        try:
+            self.ack_file = open(self.ack_path, "r+b")
+        except OSError:
+            self.ack_file = open(self.ack_path, "w+b")
+            self.ack_file.write(bytes(ACK.size * self.ack_slots))
+            self.ack_file.flush()
+        for slot in range(self.ack_slots):
+            self.ack_file.seek(slot * ACK.size)
+            data = self.ack_file.read(ACK.size)
+            if len(data) < ACK.size:
+                break
+            seq, check = ACK.unpack(data)
+            if check == crc32(data[:4]) and seq >= self.acked:
+                self.acked = seq
+                self.ack_slot = (slot + 1) % self.ack_slots
+        self.acked = min(self.acked, self.next_seq - 1)
+
+    def read_record(self):
+        data = self.file.read(RECORD.size)
+        if len(data) < RECORD.size:
+            return None
+        fields = RECORD.unpack(data)
+        if fields[0] == 0 or fields[5] != crc32(data[:RECORD.size - 2]) & 0xFFFF:
+            return None
+        return fields[:5]
+
+    def append(self, kind, value, time, report=0):
+        seq = self.next_seq
+        RECORD.pack_into(self.record, 0, seq, int(time), value, kind, report, 0)
+        struct.pack_into("<H", self.record, RECORD.size - 2, crc32(memoryview(self.record)[:RECORD.size - 2]) & 0xFFFF)
+        self.file.seek((seq % self.capacity) * RECORD.size)
+        self.file.write(self.record)
+        self.file.flush()
+        self.next_seq = seq + 1
+        return seq
+
+    def pending(self):
+        return min(self.next_seq - 1 - self.acked, self.capacity)
+
+    # up to limit undelivered records, oldest first, as (seq, time, value, kind, report)
+    def peek(self, limit):
+        records = []
+        seq = self.next_seq - self.pending()
+        while seq < self.next_seq and len(records) < limit:
+            self.file.seek((seq % self.capacity) * RECORD.size)
+            record = self.read_record()
+            if record is not None and record[0] == seq:
+                records.append(record)
+            seq += 1
+        return records
+
+    def ack(self, seq):
+        if seq <= self.acked:
+            return
+        self.acked = seq
+        self.ack_file.seek(self.ack_slot * ACK.size)
+        seq_bytes = struct.pack("<I", seq)
+        self.ack_file.write(seq_bytes + struct.pack("<I", crc32(seq_bytes)))
+        self.ack_file.flush()
+        self.ack_slot = (self.ack_slot + 1) % self.ack_slots
+
+    def close(self):
+        self.file.close()
+        self.ack_file.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+class HttpClient:
+    # HTTP/1.1 client keeping one connection open to the proxy. The request line and
+    # fixed headers of each (method, path, content type) are rendered once, a dropped
+    # connection is reopened and the request sent again once.
+    def __init__(self, host, port, timeout=5):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.heads = {}
+
+    def head(self, method, path, content_type):
+        key = (method, path, content_type)
+        head = self.heads.get(key)
+        if head is None:
+            head = ("%s /%s HTTP/1.1\r\nHost: %s:%d\r\nConnection: keep-alive\r\nContent-Type: %s\r\nContent-Length: "
+                    % (method, path, self.host, self.port, content_type)).encode()
+            self.heads[key] = head
+        return head
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body, content_type):
+        if isinstance(body, str):
+            body = body.encode()
+        for attempt in range(2):
+            if self.writer is None:
+                await self.connect()
+            try:
+                self.writer.write(self.head(method, path, content_type))
+                self.writer.write(("%d\r\n\r\n" % len(body)).encode())
+                self.writer.write(body)
+                await self.writer.drain()
+                return await asyncio.wait_for(self.read_response(), self.timeout)
+            except (OSError, EOFError, asyncio.TimeoutError):
+                await self.close()
+                if attempt == 1:
+                    raise
+
+    async def put(self, path, body, content_type):
+        return await self.request("PUT", path, body, content_type)
+
+    async def read_response(self):
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError("connection closed by the server")
+        status = int(line.split(None, 2)[1])
+        length = None
+        chunked = False
+        keep_alive = True
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif name == b"connection":
+                keep_alive = value != b"close"
+
+        if chunked:
+            body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size > 0:
+                    body += await self.reader.readexactly(size)
+                await self.reader.readline()
+                if size == 0:
+                    break
+        elif length is not None:
+            body = await self.reader.readexactly(length) if length > 0 else b""
+        else:
+            body = await self.reader.read(-1)
+            keep_alive = False
+
+        if not keep_alive:
+            await self.close()
+        return status, body
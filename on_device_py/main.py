@@ -1,5 +1,11 @@
+# taken before the imports, the boot to first sample time is logged by the sender
+from time import ticks_ms
+boot_ms = ticks_ms()
+
 from bluetooth_configuration import BLEConfigReceiver
 from sender import Sender
+from scheduler import DutyCycleScheduler
+import machine
 import json
 import asyncio
 
@@ -8,6 +14,10 @@ config = json.load(f)
 f.close()
 temperature_sensor = machine.ADC(4)
 sender = Sender(config["configs"][-1], {})
+sender.boot_ms = boot_ms
+# sleep_mode "light" or "deep" sleeps the board between samples, "none" keeps the event loop running
+if config["configs"][-1].get("sleep_mode", "none") != "none":
+    DutyCycleScheduler(sender, config["configs"][-1]).run()
 loop = asyncio.get_event_loop()
 loop = sender.collect_and_send(loop)
 loop.run_forever()
@@ -1,3 +1,4 @@
 from .microcoapy import Coap
 from .coap_macros import COAP_CONTENT_FORMAT
 from .coap_macros import COAP_RESPONSE_CODE
+from .coap_macros import _MAX_TRANSMIT_WAIT_MS as MAX_TRANSMIT_WAIT_MS
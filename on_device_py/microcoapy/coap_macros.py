@@ -5,6 +5,20 @@ _COAP_PAYLOAD_MARKER = 0xFF
 _MAX_OPTION_NUM = 10
 _BUF_MAX_SIZE = 1024
 _COAP_DEFAULT_PORT = 5683
+# rfc7252 #4.8 transmission parameters
+_ACK_TIMEOUT_MS = 2000
+_ACK_RANDOM_FACTOR = 1.5
+_MAX_RETRANSMIT = 4
+# longest wait for the response to a confirmable message, every retransmission timing out
+_MAX_TRANSMIT_WAIT_MS = int(_ACK_TIMEOUT_MS * ((2 << _MAX_RETRANSMIT) - 1) * _ACK_RANDOM_FACTOR)
+# number of recent (peer, message id) pairs remembered to drop duplicates
+_DEDUP_TABLE_SIZE = 16
+# number of (host, url) whose encoded uri options are cached
+_URI_CACHE_SIZE = 8
+# how long a resolved peer address is reused before getaddrinfo is called again
+_ADDRESS_TTL_MS = 300000
+# a notification older than this is fresh whatever its sequence number (rfc7641 #3.4)
+_OBSERVE_FRESHNESS_MS = 128000
 
 def enum(**enums):
     return type('Enum', (), enums)
@@ -72,6 +86,7 @@ COAP_OPTION_NUMBER = enum(
     COAP_URI_HOST=3,
     COAP_E_TAG=4,
     COAP_IF_NONE_MATCH=5,
+    COAP_OBSERVE=6,
     COAP_URI_PORT=7,
     COAP_LOCATION_PATH=8,
     COAP_URI_PATH=11,
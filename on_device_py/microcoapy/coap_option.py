@@ -1,7 +1,9 @@
 class CoapOption:
+    # the option keeps a reference to buffer, a str is stored encoded
     def __init__(self, number=-1, buffer=None):
         self.number = number
-        byteBuf = bytearray()
-        if buffer is not None:
-            byteBuf.extend(buffer)
-        self.buffer = byteBuf
+        if buffer is None:
+            buffer = b''
+        elif isinstance(buffer, str):
+            buffer = buffer.encode()
+        self.buffer = buffer
@@ -1,5 +1,6 @@
 from . import coap_macros as macros
 from .coap_option import CoapOption
+from .coap_reader import iterOptions
 
 class CoapPacket:
     def __init__(self):
@@ -12,6 +13,10 @@ class CoapPacket:
         self.content_format = macros.COAP_CONTENT_FORMAT.COAP_NONE
         self.query = bytearray()  # uint8_t*
         self.options = []
+        # encoded Uri-Host and Uri-Path options, written before the other options
+        self.uriOptions = None
+        # options of a received packet, still encoded
+        self.optionBytes = None
 
     # def __eq__(self, other):
     #     return self.toString() == other.toString()
@@ -21,10 +26,14 @@ class CoapPacket:
         #     self.content_format == other.content_format and self.query == other.query and\
         #     self.options == other.options)
 
+    # options are kept ordered by number, repeated options (Uri-Path) stay in the order they were added
     def addOption(self, number, opt_payload):
         if(len(self.options) >= macros._MAX_OPTION_NUM):
             return
-        self.options.append(CoapOption(number, opt_payload))
+        i = len(self.options)
+        while i > 0 and self.options[i-1].number > number:
+            i -= 1
+        self.options.insert(i, CoapOption(number, opt_payload))
 
     def setUriHost(self, address):
         self.addOption(macros.COAP_OPTION_NUMBER.COAP_URI_HOST, address)
@@ -33,6 +42,19 @@ class CoapPacket:
         for subPath in url.split('/'):
             self.addOption(macros.COAP_OPTION_NUMBER.COAP_URI_PATH, subPath)
 
+    # (number, value) of each option, received options are decoded as they are iterated
+    def iterOptions(self):
+        if self.optionBytes is not None:
+            return iterOptions(self.optionBytes)
+        return ((opt.number, opt.buffer) for opt in self.options)
+
+    # value of the first option with number, None when the packet has none
+    def getOption(self, number):
+        for optionNumber, value in self.iterOptions():
+            if optionNumber == number:
+                return value
+        return None
+
     def toString(self):
         class_, detail = macros.CoapResponseCode.decode(self.method)
-        return "type: {}, method: {}.{:02d}, messageid: {}, payload: {}".format(macros.coapTypeToString(self.type), class_, detail, self.messageid, self.payload)
+        return "type: {}, method: {}.{:02d}, messageid: {}, payload: {}".format(macros.coapTypeToString(self.type), class_, detail, self.messageid, None if self.payload is None else bytes(self.payload))
@@ -1,62 +1,66 @@
 from . import coap_macros as macros
-from .coap_option import CoapOption
 
-def parseOption(packet, runningDelta, buffer, i):
-    option = CoapOption()
-    headlen = 1
+# The readers work on a memoryview of the receive buffer: token, options and payload
+# of the parsed packet are slices of it, valid until the next packet is received.
 
-    errorMessage = (False, runningDelta, i)
-
-    if (buffer is None):
-        return errorMessage
-
-    buflen = len(buffer) - i
-
-    if (buflen < headlen):
-        return errorMessage
+# reads the option header at i, returns (delta, length, index of the value)
+# or None when the option is malformed or runs past end
+def parseOptionHeader(buffer, i, end):
+    if i >= end:
+        return None
 
     delta = (buffer[i] & 0xF0) >> 4
     length = buffer[i] & 0x0F
+    i += 1
 
     if delta == 15 or length == 15:
-        return errorMessage
+        return None
 
     if delta == 13:
-        headlen += 1
-        if (buflen < headlen):
-            return errorMessage
-        delta = buffer[i+1] + 13
+        if i + 1 > end:
+            return None
+        delta = buffer[i] + 13
         i += 1
     elif delta == 14:
-        headlen += 2
-        if (buflen < headlen):
-            return errorMessage
-        delta = ((buffer[i+1] << 8) | buffer[i+2]) + 269
+        if i + 2 > end:
+            return None
+        delta = ((buffer[i] << 8) | buffer[i+1]) + 269
         i += 2
 
     if length == 13:
-        headlen += 1
-        if (buflen < headlen):
-            return errorMessage
-        length = buffer[i+1] + 13
+        if i + 1 > end:
+            return None
+        length = buffer[i] + 13
         i += 1
     elif length == 14:
-        headlen += 2
-        if (buflen < headlen):
-            return errorMessage
-        length = ((buffer[i+1] << 8) | buffer[i+2]) + 269
+        if i + 2 > end:
+            return None
+        length = ((buffer[i] << 8) | buffer[i+1]) + 269
         i += 2
 
-    endOfOptionIndex = (i + 1 + length)
-
-    if endOfOptionIndex > len(buffer):
-        return errorMessage
-
-    option.number = delta + runningDelta
-    option.buffer = buffer[i+1:i+1+length]
-    packet.options.append(option)
-
-    return (True, runningDelta + delta, endOfOptionIndex)
+    if i + length > end:
+        return None
+    return (delta, length, i)
+
+# (number, value) of every option in buffer, decoded as they are iterated
+def iterOptions(buffer):
+    i = 0
+    number = 0
+    end = len(buffer)
+    while i < end:
+        header = parseOptionHeader(buffer, i, end)
+        if header is None:
+            return
+        number += header[0]
+        i = header[2] + header[1]
+        yield (number, buffer[header[2]:i])
+
+# value of an unsigned integer option, big endian in 0 to 4 bytes
+def decodeUint(buffer):
+    value = 0
+    for byte in buffer:
+        value = (value << 8) | byte
+    return value
 
 def parsePacketHeaderInfo(buffer, packet):
     packet.version = (buffer[0] & 0xC0) >> 6
@@ -66,20 +70,30 @@ def parsePacketHeaderInfo(buffer, packet):
     packet.messageid = 0xFF00 & (buffer[2] << 8)
     packet.messageid |= 0x00FF & buffer[3]
 
+# token lengths 9 to 15 are reserved, such a message is a format error (rfc7252 #3)
+def parsePacketToken(buffer, packet):
+    if (packet.tokenLength > 8) or (macros._COAP_HEADER_SIZE + packet.tokenLength > len(buffer)):
+        return False
+    if packet.tokenLength == 0:
+        packet.token = None
+    else:
+        packet.token = buffer[macros._COAP_HEADER_SIZE:macros._COAP_HEADER_SIZE + packet.tokenLength]
+    return True
+
+# only finds where the options end, they are decoded when looked up
 def parsePacketOptionsAndPayload(buffer, packet):
     bufferLen = len(buffer)
-    if (macros._COAP_HEADER_SIZE + packet.tokenLength) < bufferLen:
-        delta = 0
-        bufferIndex = macros._COAP_HEADER_SIZE + packet.tokenLength
-        while (len(packet.options) < macros._MAX_OPTION_NUM) and\
-              (bufferIndex < bufferLen) and\
-              (buffer[bufferIndex] != 0xFF):
-            (status, delta, bufferIndex) = parseOption(packet, delta, buffer, bufferIndex)
-            if status is False:
-                return False
-
-        if ((bufferIndex + 1) < bufferLen) and (buffer[bufferIndex] == 0xFF):
-            packet.payload = buffer[bufferIndex+1:]  # does this works?
-        else:
-            packet.payload = None
+    start = macros._COAP_HEADER_SIZE + packet.tokenLength
+    bufferIndex = start
+    while (bufferIndex < bufferLen) and (buffer[bufferIndex] != 0xFF):
+        header = parseOptionHeader(buffer, bufferIndex, bufferLen)
+        if header is None:
+            return False
+        bufferIndex = header[2] + header[1]
+
+    packet.optionBytes = buffer[start:bufferIndex]
+    if ((bufferIndex + 1) < bufferLen) and (buffer[bufferIndex] == 0xFF):
+        packet.payload = buffer[bufferIndex+1:]
+    else:
+        packet.payload = None
     return True
@@ -1,5 +1,9 @@
-from .coap_macros import _BUF_MAX_SIZE
 from .coap_macros import COAP_VERSION
+from .coap_macros import COAP_OPTION_NUMBER
+from .coap_macros import COAP_CONTENT_FORMAT
+
+# The writers serialize into a preallocated buffer: each one takes the offset to
+# write at and returns the offset after what it wrote, or -1 when it does not fit.
 
 def CoapOptionDelta(v):
     if v < 13:
@@ -11,57 +15,127 @@ def CoapOptionDelta(v):
 
 def writePacketHeaderInfo(buffer, packet):
     # make coap packet base header
-    buffer.append(COAP_VERSION.COAP_VERSION_1 << 6)
-    buffer[0] |= (packet.type & 0x03) << 4
     # max: 8 bytes of tokens, if token length is greater, it is ignored
     tokenLength = 0
-    if (packet.token is not None) and (len(packet.token) <= 0x0F):
+    if (packet.token is not None) and (len(packet.token) <= 8):
         tokenLength = len(packet.token)
 
-    buffer[0] |= (tokenLength & 0x0F)
-    buffer.append(packet.method)
-    buffer.append(packet.messageid >> 8)
-    buffer.append(packet.messageid & 0xFF)
+    buffer[0] = (COAP_VERSION.COAP_VERSION_1 << 6) | ((packet.type & 0x03) << 4) | tokenLength
+    buffer[1] = packet.method
+    buffer[2] = packet.messageid >> 8
+    buffer[3] = packet.messageid & 0xFF
 
     if tokenLength > 0:
-        buffer.extend(packet.token)
+        buffer[4:4+tokenLength] = packet.token
+    return 4 + tokenLength
 
-def writePacketOptions(buffer, packet):
-    runningDelta = 0
-    # make option header
-    for opt in packet.options:
-        if (opt is None) or (opt.buffer is None) or (len(opt.buffer) == 0):
-            continue
+def writeOptionHeader(buffer, i, optdelta, optBufferLen):
+    if (i + 5 + optBufferLen) > len(buffer):
+        return -1
+
+    delta = CoapOptionDelta(optdelta)
+    length = CoapOptionDelta(optBufferLen)
 
-        optBufferLen = len(opt.buffer)
+    buffer[i] = 0xFF & (delta << 4 | length)
+    i += 1
+    if (delta == 13):
+        buffer[i] = optdelta - 13
+        i += 1
+    elif (delta == 14):
+        buffer[i] = (optdelta - 269) >> 8
+        buffer[i+1] = 0xFF & (optdelta - 269)
+        i += 2
 
-        if (len(buffer) + 5 + optBufferLen) >= _BUF_MAX_SIZE:
-            return 0
+    if (length == 13):
+        buffer[i] = optBufferLen - 13
+        i += 1
+    elif (length == 14):
+        buffer[i] = (optBufferLen - 269) >> 8
+        buffer[i+1] = 0xFF & (optBufferLen - 269)
+        i += 2
+    return i
 
-        optdelta = opt.number - runningDelta
-        delta = CoapOptionDelta(optdelta)
-        length = CoapOptionDelta(optBufferLen)
+def writeOption(buffer, i, number, runningDelta, value):
+    if isinstance(value, str):
+        value = value.encode()
+    optBufferLen = len(value)
+    i = writeOptionHeader(buffer, i, number - runningDelta, optBufferLen)
+    if i < 0:
+        return -1
+    buffer[i:i+optBufferLen] = value
+    return i + optBufferLen
 
-        buffer.append(0xFF & (delta << 4 | length))
-        if (delta == 13):
-            buffer.append(optdelta - 13)
-        elif (delta == 14):
-            buffer.append((optdelta - 269) >> 8)
-            buffer.append(0xFF & (optdelta - 269))
+# Uri-Host and Uri-Path options of a request, encoded once and cached by the client
+def encodeUriOptions(host, url):
+    host = host.encode()
+    url = url.encode()
+    buffer = bytearray(len(host) + len(url) + 5 * (url.count(b'/') + 2))
+    i = writeOption(buffer, 0, COAP_OPTION_NUMBER.COAP_URI_HOST, 0, host)
+    runningDelta = COAP_OPTION_NUMBER.COAP_URI_HOST
+    for subPath in url.split(b'/'):
+        i = writeOption(buffer, i, COAP_OPTION_NUMBER.COAP_URI_PATH, runningDelta, subPath)
+        runningDelta = COAP_OPTION_NUMBER.COAP_URI_PATH
+    return bytes(buffer[:i])
 
-        if (length == 13):
-            buffer.append(optBufferLen - 13)
-        elif (length == 14):
-            buffer.append(optBufferLen >> 8)
-            buffer.append(0xFF & (optBufferLen - 269))
+def writeContentFormat(buffer, i, runningDelta, content_format):
+    i = writeOptionHeader(buffer, i, COAP_OPTION_NUMBER.COAP_CONTENT_FORMAT - runningDelta, 2)
+    if i < 0:
+        return -1
+    buffer[i] = (content_format & 0xFF00) >> 8
+    buffer[i+1] = content_format & 0x00FF
+    return i + 2
 
-        buffer.extend(opt.buffer)
+# options are written in ascending number: the cached uri options (numbers up to
+# Uri-Path), the packet options, Content-Format and Uri-Query
+def writePacketOptions(buffer, i, packet):
+    runningDelta = 0
+    if packet.uriOptions is not None:
+        end = i + len(packet.uriOptions)
+        if end > len(buffer):
+            return -1
+        buffer[i:end] = packet.uriOptions
+        i = end
+        runningDelta = COAP_OPTION_NUMBER.COAP_URI_PATH
+
+    contentFormat = packet.content_format != COAP_CONTENT_FORMAT.COAP_NONE
+    query = (packet.query is not None) and (len(packet.query) > 0)
+    for opt in packet.options:
+        if (opt is None) or (opt.buffer is None) or (len(opt.buffer) == 0):
+            continue
+        if contentFormat and opt.number > COAP_OPTION_NUMBER.COAP_CONTENT_FORMAT:
+            i = writeContentFormat(buffer, i, runningDelta, packet.content_format)
+            runningDelta = COAP_OPTION_NUMBER.COAP_CONTENT_FORMAT
+            contentFormat = False
+            if i < 0:
+                return -1
+        if query and opt.number > COAP_OPTION_NUMBER.COAP_URI_QUERY:
+            i = writeOption(buffer, i, COAP_OPTION_NUMBER.COAP_URI_QUERY, runningDelta, packet.query)
+            runningDelta = COAP_OPTION_NUMBER.COAP_URI_QUERY
+            query = False
+            if i < 0:
+                return -1
+        i = writeOption(buffer, i, opt.number, runningDelta, opt.buffer)
+        if i < 0:
+            return -1
         runningDelta = opt.number
 
-def writePacketPayload(buffer, packet):
+    if contentFormat:
+        i = writeContentFormat(buffer, i, runningDelta, packet.content_format)
+        runningDelta = COAP_OPTION_NUMBER.COAP_CONTENT_FORMAT
+    if query and i >= 0:
+        i = writeOption(buffer, i, COAP_OPTION_NUMBER.COAP_URI_QUERY, runningDelta, packet.query)
+    return i
+
+def writePacketPayload(buffer, i, packet):
     # make payload
-    if (packet.payload is not None) and (len(packet.payload)):
-        if (len(buffer) + 1 + len(packet.payload)) >= _BUF_MAX_SIZE:
-            return 0
-        buffer.append(0xFF)
-        buffer.extend(packet.payload)
+    payload = packet.payload
+    if (payload is not None) and (len(payload)):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        end = i + 1 + len(payload)
+        if end > len(buffer):
+            return -1
+        buffer[i] = 0xFF
+        buffer[i+1:end] = payload
+        return end
+    return i
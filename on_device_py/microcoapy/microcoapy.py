@@ -4,17 +4,54 @@ except ImportError:
     pass
 import uos
 import utime as time
+import select
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 from . import coap_macros as macros
 from .coap_packet import CoapPacket
 
 from .coap_reader import parsePacketHeaderInfo
+from .coap_reader import parsePacketToken
 from .coap_reader import parsePacketOptionsAndPayload
+from .coap_reader import decodeUint
 from .coap_writer import writePacketHeaderInfo
 from .coap_writer import writePacketOptions
 from .coap_writer import writePacketPayload
+from .coap_writer import encodeUriOptions
 
 import binascii
 
+# A confirmable message waiting for its ACK, resent with a doubling timeout (rfc7252 #4.2)
+class PendingExchange:
+    def __init__(self, buffer, sockaddr, messageid, timeoutMs):
+        self.buffer = buffer
+        self.sockaddr = sockaddr
+        self.messageid = messageid
+        self.timeoutMs = timeoutMs
+        self.deadline = time.ticks_add(time.ticks_ms(), timeoutMs)
+        self.retransmissions = 0
+
+# A resource observed with Coap.observe, notifications with a sequence number not
+# newer than the last one are stale and dropped (rfc7641 #3.4)
+class Observation:
+    def __init__(self, callback):
+        self.callback = callback
+        self.sequence = None
+        self.ticks = 0
+
+    def isFresh(self, sequence):
+        now = time.ticks_ms()
+        fresh = self.sequence is None or\
+            (self.sequence < sequence and sequence - self.sequence < (1 << 23)) or\
+            (self.sequence > sequence and self.sequence - sequence > (1 << 23)) or\
+            time.ticks_diff(now, self.ticks) > macros._OBSERVE_FRESHNESS_MS
+        if fresh:
+            self.sequence = sequence
+            self.ticks = now
+        return fresh
+
 class Coap:
     TRANSMISSION_STATE = macros.enum(
         STATE_IDLE = 0,
@@ -30,10 +67,26 @@ class Coap:
         self.isServer = False
         self.state = self.TRANSMISSION_STATE.STATE_IDLE
         self.isCustomSocket = False
+        self.poller = None
 
-        #beta flags
-        self.discardRetransmissions = False
-        self.lastPacketStr = ""
+        # message ids are consecutive from a random start, drawn once
+        randBytes = uos.urandom(2)
+        self.messageId = (randBytes[0] << 8) | randBytes[1]
+        self.pending = None
+        self.exchangeFailed = False
+        # ring of recently received (ip, port, messageid, is response) keys
+        self.recentMessages = [None] * macros._DEDUP_TABLE_SIZE
+        self.recentIndex = 0
+        # packets are serialized into and received in these buffers, no per packet allocation
+        self.txBuffer = memoryview(bytearray(macros._BUF_MAX_SIZE))
+        self.rxBuffer = memoryview(bytearray(macros._BUF_MAX_SIZE))
+        self.scratchBuffer = memoryview(bytearray(macros._BUF_MAX_SIZE))
+        self.uriOptionCache = {}
+        # token -> Observation of the resources registered with observe
+        self.observations = {}
+        # (ip, port) -> (sockaddr, expiry ticks), dropped on a failed send
+        self.addressCache = {}
+        self.addressTtlMs = macros._ADDRESS_TTL_MS
 
     def log(self, s):
         if self.debug:
@@ -41,9 +94,30 @@ class Coap:
 
     # Create and initialize a new UDP socket to listen to.
     # port: the local port to be used.
-    def start(self, port=macros._COAP_DEFAULT_PORT):
+    # peers: (ip, port) pairs resolved now, so the first send does not wait on DNS
+    def start(self, port=macros._COAP_DEFAULT_PORT, peers=()):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(('', port))
+        self.poller = None
+        for ip, peerPort in peers:
+            self.resolve(ip, peerPort)
+
+    # socket address of ip:port, getaddrinfo is only called again after addressTtlMs
+    def resolve(self, ip, port):
+        key = (ip, port)
+        entry = self.addressCache.get(key)
+        if entry is not None and time.ticks_diff(entry[1], time.ticks_ms()) > 0:
+            return entry[0]
+        try:
+            sockaddr = socket.getaddrinfo(ip, port)[0][-1]
+        except Exception:
+            # not cached, the lookup is retried on the next send
+            return key
+        self.addressCache[key] = (sockaddr, time.ticks_add(time.ticks_ms(), self.addressTtlMs))
+        return sockaddr
+
+    def invalidateAddress(self, ip, port):
+        self.addressCache.pop((ip, port), None)
 
     # Stop and destroy the socket that has been created by
     # a previous call of 'start' function
@@ -65,44 +139,44 @@ class Coap:
         self.stop()
         self.isCustomSocket = True
         self.sock = custom_socket
+        self.poller = None
 
     def addIncomingRequestCallback(self, requestUrl, callback):
         self.callbacks[requestUrl] = callback
         self.isServer = True
 
     def sendPacket(self, ip, port, coapPacket):
-        if coapPacket.content_format != macros.COAP_CONTENT_FORMAT.COAP_NONE:
-            optionBuffer = bytearray(2)
-            optionBuffer[0] = (coapPacket.content_format & 0xFF00) >> 8
-            optionBuffer[1] = (coapPacket.content_format & 0x00FF)
-            coapPacket.addOption(macros.COAP_OPTION_NUMBER.COAP_CONTENT_FORMAT, optionBuffer)
-
-        if (coapPacket.query is not None) and (len(coapPacket.query) > 0):
-            coapPacket.addOption(macros.COAP_OPTION_NUMBER.COAP_URI_QUERY, coapPacket.query)
-
-        buffer = bytearray()
-        writePacketHeaderInfo(buffer, coapPacket)
-
-        writePacketOptions(buffer, coapPacket)
-
-        writePacketPayload(buffer, coapPacket)
+        # confirmable messages are kept in txBuffer until acknowledged, the rest use scratchBuffer
+        if coapPacket.type == macros.COAP_TYPE.COAP_CON:
+            buffer = self.txBuffer
+        else:
+            buffer = self.scratchBuffer
+        length = writePacketHeaderInfo(buffer, coapPacket)
+        length = writePacketOptions(buffer, length, coapPacket)
+        if length >= 0:
+            length = writePacketPayload(buffer, length, coapPacket)
+        if length < 0:
+            print('Packet does not fit in', macros._BUF_MAX_SIZE, 'bytes')
+            return 0
+        buffer = buffer[:length]
 
         status = 0
         try:
-            sockaddr = (ip, port)
-            try:
-                sockaddr = socket.getaddrinfo(ip, port)[0][-1]
-            except Exception as e:
-                pass
-            
+            sockaddr = self.resolve(ip, port)
             status = self.sock.sendto(buffer, sockaddr)
 
             if status > 0:
                 status = coapPacket.messageid
+                if coapPacket.type == macros.COAP_TYPE.COAP_CON:
+                    self.pending = PendingExchange(buffer, sockaddr, coapPacket.messageid, self.initialTimeoutMs())
+                    self.exchangeFailed = False
 
-            self.log('Packet sent. messageid: ' + str(status))
+            if self.debug:
+                self.log('Packet sent. messageid: ' + str(status))
         except Exception as e:
             status = 0
+            # the address may be stale, it is resolved again on the next send
+            self.invalidateAddress(ip, port)
             print('Exception while sending packet...')
             import sys
             sys.print_exception(e)
@@ -122,15 +196,69 @@ class Coap:
 
     def sendEx(self, ip, port, url, packet):
         self.state = self.TRANSMISSION_STATE.STATE_IDLE
-        # messageId field: 16bit -> 0-65535
-        # urandom to generate 2 bytes
-        randBytes = uos.urandom(2)
-        packet.messageid = (randBytes[0] << 8) | randBytes[1]
-        packet.setUriHost(ip)
-        packet.setUriPath(url)
+        packet.messageid = self.nextMessageId()
+        if any(opt.number <= macros.COAP_OPTION_NUMBER.COAP_URI_PATH for opt in packet.options):
+            # options numbered up to Uri-Path go between the uri options, addOption inserts
+            # the uri options in order and all are written one by one
+            packet.setUriHost(ip)
+            packet.setUriPath(url)
+        else:
+            packet.uriOptions = self.uriOptions(ip, url)
 
         return self.sendPacket(ip, port, packet)
 
+    # encoded Uri-Host and Uri-Path options, a client sends to a handful of urls
+    def uriOptions(self, ip, url):
+        key = (ip, url)
+        options = self.uriOptionCache.get(key)
+        if options is None:
+            if len(self.uriOptionCache) >= macros._URI_CACHE_SIZE:
+                self.uriOptionCache.clear()
+            options = self.uriOptionCache[key] = encodeUriOptions(ip, url)
+        return options
+
+    # messageId field: 16bit -> 0-65535
+    def nextMessageId(self):
+        self.messageId = (self.messageId + 1) & 0xFFFF
+        return self.messageId
+
+    # ACK_TIMEOUT randomized up to ACK_TIMEOUT * ACK_RANDOM_FACTOR
+    def initialTimeoutMs(self):
+        spread = int(macros._ACK_TIMEOUT_MS * (macros._ACK_RANDOM_FACTOR - 1))
+        return macros._ACK_TIMEOUT_MS + spread * uos.urandom(1)[0] // 255
+
+    # resends the pending confirmable message when its timeout expired,
+    # after MAX_RETRANSMIT retransmissions the exchange is given up
+    def retransmit(self):
+        pending = self.pending
+        if pending is None or time.ticks_diff(time.ticks_ms(), pending.deadline) < 0:
+            return
+        if pending.retransmissions >= macros._MAX_RETRANSMIT:
+            self.log('No ACK received, giving up. messageid: ' + str(pending.messageid))
+            self.pending = None
+            self.exchangeFailed = True
+            return
+        pending.retransmissions += 1
+        pending.timeoutMs *= 2
+        pending.deadline = time.ticks_add(time.ticks_ms(), pending.timeoutMs)
+        try:
+            self.sock.sendto(pending.buffer, pending.sockaddr)
+            self.log('Packet retransmitted. messageid: ' + str(pending.messageid))
+        except Exception as e:
+            print('Exception while retransmitting packet...')
+            import sys
+            sys.print_exception(e)
+
+    # True when the message was already received, otherwise it is remembered
+    def isDuplicate(self, remoteAddress, packet):
+        key = (remoteAddress[0], remoteAddress[1], packet.messageid,
+               packet.type == macros.COAP_TYPE.COAP_ACK or packet.type == macros.COAP_TYPE.COAP_RESET)
+        if key in self.recentMessages:
+            return True
+        self.recentMessages[self.recentIndex] = key
+        self.recentIndex = (self.recentIndex + 1) % macros._DEDUP_TABLE_SIZE
+        return False
+
     # to be tested
     def sendResponse(self, ip, port, messageid, payload, method, content_format, token):
         packet = CoapPacket()
@@ -154,6 +282,40 @@ class Coap:
     def post(self, ip, port, url, payload=bytearray(), query_option=None, content_format=macros.COAP_CONTENT_FORMAT.COAP_NONE, token=bytearray()):
         return self.send(ip, port, url, macros.COAP_TYPE.COAP_CON, macros.COAP_METHOD.COAP_POST, token, payload, content_format, query_option)
 
+    # Registers for notifications of url (rfc7641): callback(packet, remoteAddress) gets the
+    # response and every fresh notification. Returns the token of the observation, None
+    # when the registration could not be sent.
+    def observe(self, ip, port, url, callback, token=None):
+        if token is None:
+            token = uos.urandom(4)
+        packet = CoapPacket()
+        packet.type = macros.COAP_TYPE.COAP_CON
+        packet.method = macros.COAP_METHOD.COAP_GET
+        packet.token = token
+        # register is Observe 0, sent as one zero byte
+        packet.addOption(macros.COAP_OPTION_NUMBER.COAP_OBSERVE, b'\x00')
+        self.observations[bytes(token)] = Observation(callback)
+        if self.sendEx(ip, port, url, packet) == 0:
+            self.cancelObserve(token)
+            return None
+        return token
+
+    # notifications for token are no longer delivered, the server drops the
+    # observation once it gets no ACK for one of them
+    def cancelObserve(self, token):
+        self.observations.pop(bytes(token), None)
+
+    def handleNotification(self, observation, packet, remoteAddress):
+        sequence = packet.getOption(macros.COAP_OPTION_NUMBER.COAP_OBSERVE)
+        if sequence is None:
+            # a response without Observe ends the observation (rfc7641 #3.2)
+            self.cancelObserve(packet.token)
+        elif not observation.isFresh(decodeUint(sequence)):
+            self.log("Discarded stale notification: " + str(decodeUint(sequence)))
+            return False
+        observation.callback(packet, remoteAddress)
+        return True
+
     #non Confirmable
     def getNonConf(self, ip, port, url, token=bytearray()):
         return self.send(ip, port, url, macros.COAP_TYPE.COAP_NONCON, macros.COAP_METHOD.COAP_GET, token, None, macros.COAP_CONTENT_FORMAT.COAP_NONE, None)
@@ -166,11 +328,11 @@ class Coap:
 
     def handleIncomingRequest(self, requestPacket, sourceIp, sourcePort):
         url = ""
-        for opt in requestPacket.options:
-            if (opt.number == macros.COAP_OPTION_NUMBER.COAP_URI_PATH) and (len(opt.buffer) > 0):
+        for number, value in requestPacket.iterOptions():
+            if (number == macros.COAP_OPTION_NUMBER.COAP_URI_PATH) and (len(value) > 0):
                 if url != "":
                     url += "/"
-                url += opt.buffer.decode('unicode_escape')
+                url += bytes(value).decode('unicode_escape')
 
         urlCallback = None
         if url != "":
@@ -189,86 +351,123 @@ class Coap:
             urlCallback(requestPacket, sourceIp, sourcePort)
         return True
 
-    def readBytesFromSocket(self, numOfBytes):
+    # the datagram is received into rxBuffer where the socket supports recvfrom_into,
+    # MicroPython sockets do not and the bytes returned by recvfrom are viewed instead
+    def readPacket(self):
         try:
-            return self.sock.recvfrom(numOfBytes)
+            if hasattr(self.sock, 'recvfrom_into'):
+                (length, remoteAddress) = self.sock.recvfrom_into(self.rxBuffer)
+                return (self.rxBuffer[:length], remoteAddress)
+            (data, remoteAddress) = self.sock.recvfrom(macros._BUF_MAX_SIZE)
+            return (memoryview(data), remoteAddress)
         except Exception:
             return (None, None)
 
-    def parsePacketToken(self, buffer, packet):
-        if (packet.tokenLength == 0):
-            packet.token = None
-        elif (packet.tokenLength <= 8):
-            packet.token = buffer[4:4+packet.tokenLength]
-        else:
-            (tempBuffer, tempRemoteAddress) = self.readBytesFromSocket(macros._BUF_MAX_SIZE - bufferLen)
-            if tempBuffer is not None:
-                buffer.extend(tempBuffer)
-            return False
-        return True
-
     def loop(self, blocking=True):
         if self.sock is None:
             return False
 
+        self.retransmit()
         self.sock.setblocking(blocking)
-        (buffer, remoteAddress) = self.readBytesFromSocket(macros._BUF_MAX_SIZE)
+        (buffer, remoteAddress) = self.readPacket()
         self.sock.setblocking(True)
 
-        while (buffer is not None) and (len(buffer) > 0):
-            bufferLen = len(buffer)
-            if (bufferLen < macros._COAP_HEADER_SIZE) or (((buffer[0] & 0xC0) >> 6) != 1):
-                (tempBuffer, tempRemoteAddress) = self.readBytesFromSocket(macros._BUF_MAX_SIZE - bufferLen)
-                if tempBuffer is not None:
-                    buffer.extend(tempBuffer)
-                continue
+        if (buffer is None) or (len(buffer) == 0):
+            return False
+        # a datagram holds one whole message, a short or foreign one is dropped
+        if (len(buffer) < macros._COAP_HEADER_SIZE) or (((buffer[0] & 0xC0) >> 6) != 1):
+            self.log("Discarded malformed packet")
+            return False
 
-            packet = CoapPacket()
+        if self.debug:
+            self.log("Incoming Packet bytes: " + str(binascii.hexlify(buffer)))
 
-            self.log("Incoming Packet bytes: " + str(binascii.hexlify(bytearray(buffer))))
+        packet = CoapPacket()
+        parsePacketHeaderInfo(buffer, packet)
 
-            parsePacketHeaderInfo(buffer, packet)
+        if not parsePacketToken(buffer, packet):
+            self.log("Discarded packet with token length " + str(packet.tokenLength))
+            return False
 
-            if not self.parsePacketToken(buffer, packet):
-                continue
+        if not parsePacketOptionsAndPayload(buffer, packet):
+            return False
 
-            if not parsePacketOptionsAndPayload(buffer, packet):
-                return False
+        if self.isDuplicate(remoteAddress, packet):
+            self.log("Discarded duplicate message: " + str(packet.messageid))
+            # the peer did not get our ACK, a duplicate confirmable message is acknowledged again
+            if packet.type == macros.COAP_TYPE.COAP_CON:
+                self.sendResponse(remoteAddress[0], remoteAddress[1], packet.messageid,
+                                  None, macros.COAP_METHOD.COAP_EMPTY_MESSAGE,
+                                  macros.COAP_CONTENT_FORMAT.COAP_NONE, None)
+            return False
 
-            # beta functionality
-            if self.discardRetransmissions:
-                if packet.toString() == self.lastPacketStr:
-                    self.log("Discarded retransmission message: " + packet.toString())
-                    return False
-                else:
-                    self.lastPacketStr = packet.toString()
-            ####
-
-            if not self.isServer or not self.handleIncomingRequest(packet, remoteAddress[0], remoteAddress[1]):
-                # To handle cases of Separate response (rfc7252 #5.2.2)
-                if packet.type == macros.COAP_TYPE.COAP_ACK and\
-                    packet.method == macros.COAP_METHOD.COAP_EMPTY_MESSAGE:
-                      self.state = self.TRANSMISSION_STATE.STATE_SEPARATE_ACK_RECEIVED_WAITING_DATA
-                      return False
-                # case of piggybacked response where the response is in the ACK (rfc7252 #5.2.1)
-                # or the data of a separate message
-                else:
-                    if self.state == self.TRANSMISSION_STATE.STATE_SEPARATE_ACK_RECEIVED_WAITING_DATA:
-                        self.state = self.TRANSMISSION_STATE.STATE_IDLE
-                        self.sendResponse(remoteAddress[0], remoteAddress[1], packet.messageid,
-                                        None, macros.COAP_TYPE.COAP_ACK,
-                                        macros.COAP_CONTENT_FORMAT.COAP_NONE, packet.token)
-                    if self.responseCallback is not None:
-                        self.responseCallback(packet, remoteAddress)
-            return True
+        # an ACK or RST for the pending confirmable message ends its retransmissions
+        if self.pending is not None and self.pending.messageid == packet.messageid and\
+            (packet.type == macros.COAP_TYPE.COAP_ACK or packet.type == macros.COAP_TYPE.COAP_RESET):
+            self.pending = None
+            if packet.type == macros.COAP_TYPE.COAP_RESET:
+                self.exchangeFailed = True
+                return False
 
-        return False
+        if not self.isServer or not self.handleIncomingRequest(packet, remoteAddress[0], remoteAddress[1]):
+            # To handle cases of Separate response (rfc7252 #5.2.2)
+            if packet.type == macros.COAP_TYPE.COAP_ACK and\
+                packet.method == macros.COAP_METHOD.COAP_EMPTY_MESSAGE:
+                  self.state = self.TRANSMISSION_STATE.STATE_SEPARATE_ACK_RECEIVED_WAITING_DATA
+                  return False
+            # case of piggybacked response where the response is in the ACK (rfc7252 #5.2.1)
+            # or the data of a separate message
+            else:
+                # a confirmable response, separate or a notification, is acknowledged with an empty ACK
+                if packet.type == macros.COAP_TYPE.COAP_CON:
+                    self.state = self.TRANSMISSION_STATE.STATE_IDLE
+                    self.sendResponse(remoteAddress[0], remoteAddress[1], packet.messageid,
+                                    None, macros.COAP_METHOD.COAP_EMPTY_MESSAGE,
+                                    macros.COAP_CONTENT_FORMAT.COAP_NONE, None)
+                if packet.token is not None:
+                    observation = self.observations.get(bytes(packet.token))
+                    if observation is not None:
+                        return self.handleNotification(observation, packet, remoteAddress)
+                if self.responseCallback is not None:
+                    self.responseCallback(packet, remoteAddress)
+        return True
 
     def poll(self, timeoutMs=-1, pollPeriodMs=500):
         start_time = time.ticks_ms()
         status = False
+        exchange = self.pending
         while not status:
             status = self.loop(False)
+            if exchange is not None:
+                # as in pollAsync, the pending message decides
+                if self.exchangeFailed: return False
+                status = self.pending is not exchange
             if (time.ticks_diff(time.ticks_ms(), start_time) >= timeoutMs): break
             time.sleep_ms(pollPeriodMs)
         return status
+
+    # Same as poll but for uasyncio: the socket is checked with select.poll and the
+    # coroutine yields to the other tasks between checks instead of sleeping the CPU.
+    async def pollAsync(self, timeoutMs=-1, pollPeriodMs=20):
+        if self.sock is None:
+            return False
+        if self.poller is None:
+            self.poller = select.poll()
+            self.poller.register(self.sock, select.POLLIN)
+        start_time = time.ticks_ms()
+        # with a confirmable message pending only its ACK or RST ends the wait, other
+        # packets (notifications, duplicates) are handled and polling goes on
+        exchange = self.pending
+        while True:
+            self.retransmit()
+            if self.poller.poll(0) and self.loop(False) and exchange is None:
+                return True
+            if exchange is not None:
+                if self.exchangeFailed:
+                    return False
+                # acknowledged, possibly by another task polling the same client
+                if self.pending is not exchange:
+                    return True
+            if timeoutMs >= 0 and time.ticks_diff(time.ticks_ms(), start_time) >= timeoutMs:
+                return False
+            await asyncio.sleep_ms(pollPeriodMs)
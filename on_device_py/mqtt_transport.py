@@ -0,0 +1,79 @@
+from time import ticks_ms, ticks_diff, ticks_add
+from umqtt.simple import MQTTClient
+
+class MqttTransport:
+    # One broker connection kept for the life of the Sender. QoS 1 publishes wait for
+    # the broker's PUBACK. A failed connect or publish closes the connection and the
+    # next attempt is only made after a backoff doubling up to max_backoff seconds.
+    # Without clean_session the broker keeps the session of client_id, which must stay the
+    # same across reboots, and QoS 1 messages queued for it while the device slept.
+    def __init__(self, client_id, server, port=1883, keepalive=60, qos=0, max_backoff=60, clean_session=False):
+        self.client = MQTTClient(client_id, server, port=int(port), keepalive=keepalive)
+        self.clean_session = clean_session
+        self.keepalive = keepalive
+        self.qos = qos
+        self.max_backoff = max_backoff
+        self.connected = False
+        self.backoff = 1
+        self.next_attempt = ticks_ms()
+        self.last_packet = ticks_ms()
+
+    def connect(self):
+        if self.connected:
+            return True
+        if ticks_diff(self.next_attempt, ticks_ms()) > 0:
+            return False
+        try:
+            self.client.connect(clean_session=self.clean_session)
+        except OSError as e:
+            print("MQTT connect failed:", e)
+            self.fail()
+            return False
+        self.connected = True
+        self.backoff = 1
+        self.last_packet = ticks_ms()
+        return True
+
+    def fail(self):
+        self.close()
+        self.next_attempt = ticks_add(ticks_ms(), self.backoff * 1000)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def publish(self, topic, payload):
+        # the broker drops clients silent for 1.5 keepalive, such a connection is reopened first
+        if self.connected and ticks_diff(ticks_ms(), self.last_packet) > self.keepalive * 1000:
+            self.close()
+        if not self.connect():
+            return False
+        try:
+            self.client.publish(topic, payload, qos=self.qos)
+        except OSError as e:
+            print("MQTT publish failed:", e)
+            self.fail()
+            return False
+        self.last_packet = ticks_ms()
+        return True
+
+    def ping(self):
+        if not self.connected:
+            return
+        try:
+            self.client.ping()
+            self.client.check_msg()
+            self.last_packet = ticks_ms()
+        except OSError as e:
+            print("MQTT ping failed:", e)
+            self.fail()
+
+    def close(self):
+        if self.connected:
+            try:
+                self.client.disconnect()
+            except OSError:
+                pass
+        else:
+            try:
+                self.client.sock.close()
+            except (AttributeError, OSError):
+                pass
+        self.connected = False
@@ -0,0 +1,74 @@
+import struct
+
+# Binary reading understood by the proxy (data_acquisition_proxy/payload_codec.py):
+# <B kind> <B id length> <id> <B position length> <position> <f32 value> <u32 time>, little endian
+KIND_TEMPERATURE = 1
+KIND_LUMINOSITY = 2
+CONTENT_TYPE = "application/octet-stream"
+# report codes, kept in bits 5-6 of the kind byte of a reading
+REPORT_CODES = {None: 0, "exception": 1, "heartbeat": 2}
+REPORT_SHIFT = 5
+
+def encode_reading(kind, device_id, position, value, time, report=None):
+    device_id = device_id.encode()
+    position = position.encode()
+    return struct.pack("<BB%dsB%dsfI" % (len(device_id), len(position)),
+                       kind | (REPORT_CODES[report] << REPORT_SHIFT), len(device_id), device_id,
+                       len(position), position, value, int(time))
+
+# payload of the per-device MQTT topics, the identity is in the topic
+def encode_sample(value, time):
+    return struct.pack("<fI", value, int(time))
+
+# delta-encoded batch of one device's samples, see data_acquisition_proxy/payload_codec.py
+BATCH_FLAG = 0x80
+# set when every sample of the batch is followed by its report code byte
+BATCH_REPORTS = 0x40
+# set when every sample carries its sequence number, as a delta from the previous one
+BATCH_SEQUENCES = 0x20
+
+def write_varint(out, offset, value):
+    while value >= 0x80:
+        out[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+    out[offset] = value
+    return offset + 1
+
+# ints are arbitrary precision, the 32-bit (value << 1) ^ (value >> 31) breaks past 2^31
+def write_zigzag(out, offset, value):
+    return write_varint(out, offset, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+# writes the batch into the preallocated out buffer and returns the number of bytes used,
+# out needs 7 + len(id) + len(position) + 16 * count bytes at most
+def encode_batch(out, kind, device_id, position, values, times, count, scale=2, reports=None, seqs=None):
+    device_id = device_id.encode()
+    position = position.encode()
+    out[0] = (kind | BATCH_FLAG | (BATCH_REPORTS if reports is not None else 0)
+              | (BATCH_SEQUENCES if seqs is not None else 0))
+    out[1] = len(device_id)
+    offset = 2 + len(device_id)
+    out[2:offset] = device_id
+    out[offset] = len(position)
+    out[offset + 1:offset + 1 + len(position)] = position
+    offset += 1 + len(position)
+    out[offset] = scale
+    offset = write_varint(out, offset + 1, count)
+    factor = 10 ** scale
+    last_time = 0
+    last_value = 0
+    last_seq = 0
+    for i in range(count):
+        time = times[i]
+        value = int(round(values[i] * factor))
+        offset = write_zigzag(out, offset, time - last_time)
+        offset = write_zigzag(out, offset, value - last_value)
+        if seqs is not None:
+            offset = write_zigzag(out, offset, seqs[i] - last_seq)
+            last_seq = seqs[i]
+        if reports is not None:
+            out[offset] = reports[i]
+            offset += 1
+        last_time = time
+        last_value = value
+    return offset
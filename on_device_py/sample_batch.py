@@ -0,0 +1,87 @@
+import gc
+import json
+import struct
+from array import array
+from time import time
+import payload_codec
+
+VALUE_KEYS = {payload_codec.KIND_TEMPERATURE: "TEMPERATURE", payload_codec.KIND_LUMINOSITY: "LUMINOSITY"}
+REPORT_NAMES = {code: name for name, code in payload_codec.REPORT_CODES.items()}
+
+class SampleBatch:
+    # Samples of one sensor kept in arrays allocated once, uploaded together when
+    # capacity samples are held, the oldest is max_age seconds old or free memory
+    # drops under min_free bytes. With reports every sample also keeps its report code.
+    def __init__(self, kind, device_id, position, capacity, max_age, min_free, reports=False):
+        self.kind = kind
+        self.device_id = device_id
+        self.position = position
+        self.capacity = capacity
+        self.max_age = max_age
+        self.min_free = min_free
+        self.values = array('f', [0.0] * capacity)
+        self.times = array('I', [0] * capacity)
+        self.reports = array('B', [0] * capacity) if reports else None
+        self.count = 0
+        self.buffer = bytearray(7 + len(device_id.encode()) + len(position.encode()) + 11 * capacity)
+
+    def add(self, value, timestamp, report=None):
+        # a batch still full after a failed upload makes room by dropping its oldest sample
+        if self.count == self.capacity:
+            self.drop_oldest()
+        self.values[self.count] = value
+        self.times[self.count] = int(timestamp)
+        if self.reports is not None:
+            self.reports[self.count] = payload_codec.REPORT_CODES[report]
+        self.count += 1
+
+    def due(self):
+        if self.count == 0:
+            return False
+        if self.count >= self.capacity or time() - self.times[0] >= self.max_age:
+            return True
+        return self.min_free > 0 and gc.mem_free() < self.min_free
+
+    def encode(self, binary):
+        if binary:
+            size = payload_codec.encode_batch(self.buffer, self.kind, self.device_id, self.position,
+                                              self.values, self.times, self.count, reports=self.reports)
+            return memoryview(self.buffer)[:size]
+        key = VALUE_KEYS[self.kind]
+        readings = []
+        for i in range(self.count):
+            reading = {"ID": self.device_id, "POSITION": self.position, key: self.values[i], "TIME": self.times[i]}
+            if self.reports is not None and self.reports[i] != 0:
+                reading["REPORT"] = REPORT_NAMES[self.reports[i]]
+            readings.append(reading)
+        return json.dumps(readings)
+
+    def clear(self):
+        self.count = 0
+
+    def drop_oldest(self):
+        for i in range(1, self.count):
+            self.values[i - 1] = self.values[i]
+            self.times[i - 1] = self.times[i]
+            if self.reports is not None:
+                self.reports[i - 1] = self.reports[i]
+        self.count -= 1
+
+    # raw samples for state kept across deepsleep: count, then the times, values and report codes
+    def dump(self):
+        count = self.count
+        reports = self.reports[:count] if self.reports is not None else [0] * count
+        return struct.pack("<H%dI%df%dB" % (count, count, count), count,
+                           *self.times[:count], *self.values[:count], *reports)
+
+    def restore(self, data):
+        stored = struct.unpack_from("<H", data)[0]
+        fields = struct.unpack_from("<%dI%df%dB" % (stored, stored, stored), data, 2)
+        # keeps the newest samples if the capacity shrank since they were stored
+        count = min(stored, self.capacity)
+        for i in range(count):
+            self.times[i] = fields[stored - count + i]
+            self.values[i] = fields[2 * stored - count + i]
+            if self.reports is not None:
+                self.reports[i] = fields[3 * stored - count + i]
+        self.count = count
@@ -0,0 +1,63 @@
+import struct
+from array import array
+
+REPORT_EXCEPTION = "exception"
+REPORT_HEARTBEAT = "heartbeat"
+
+class OversampledADC:
+    # Takes samples consecutive read_u16 readings into a buffer allocated once and
+    # returns their mean, or their median which also drops single-read spikes.
+    def __init__(self, adc, samples=16, mode="mean"):
+        self.adc = adc
+        self.mode = mode
+        self.buffer = array('H', [0] * samples)
+
+    def read_u16(self):
+        buffer = self.buffer
+        for i in range(len(buffer)):
+            buffer[i] = self.adc.read_u16()
+        if self.mode == "median":
+            # insertion sort in place, samples is small
+            for i in range(1, len(buffer)):
+                v = buffer[i]
+                j = i - 1
+                while j >= 0 and buffer[j] > v:
+                    buffer[j + 1] = buffer[j]
+                    j -= 1
+                buffer[j + 1] = v
+            return buffer[len(buffer) // 2]
+        total = 0
+        for v in buffer:
+            total += v
+        return total // len(buffer)
+
+class ReportPolicy:
+    # Report by exception: a value is sent when it moved more than deadband away from
+    # the last sent one, otherwise only once heartbeat seconds passed without a send.
+    def __init__(self, deadband, heartbeat):
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.last_value = None
+        self.last_time = 0
+
+    def check(self, value, now):
+        if self.last_value is None or abs(value - self.last_value) > self.deadband:
+            report = REPORT_EXCEPTION
+        elif now - self.last_time >= self.heartbeat:
+            report = REPORT_HEARTBEAT
+        else:
+            return None
+        self.last_value = value
+        self.last_time = int(now)
+        return report
+
+    def dump(self):
+        if self.last_value is None:
+            return struct.pack("<fI", 0.0, 0)
+        return struct.pack("<fI", self.last_value, self.last_time)
+
+    def restore(self, data):
+        value, last_time = struct.unpack_from("<fI", data)
+        if last_time != 0:
+            self.last_value = value
+            self.last_time = last_time
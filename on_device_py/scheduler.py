@@ -0,0 +1,88 @@
+import machine
+import asyncio
+from time import ticks_ms, ticks_diff
+
+STATE_MAGIC = b"DCS3"
+
+class StateStore:
+    # Keeps a few bytes across deepsleep, which resets the board. RTC memory is used
+    # where the port has it (esp32), the rp2 has none so a small file is written instead.
+    def __init__(self, path="state.bin"):
+        self.path = path
+        self.rtc = None
+        try:
+            rtc = machine.RTC()
+            rtc.memory()
+            self.rtc = rtc
+        except (AttributeError, OSError):
+            pass
+
+    def load(self):
+        try:
+            if self.rtc is not None:
+                data = self.rtc.memory()
+            else:
+                with open(self.path, "rb") as f:
+                    data = f.read()
+        except OSError:
+            return None
+        if len(data) < len(STATE_MAGIC) or data[:len(STATE_MAGIC)] != STATE_MAGIC:
+            return None
+        return data[len(STATE_MAGIC):]
+
+    def save(self, data):
+        if self.rtc is not None:
+            self.rtc.memory(STATE_MAGIC + data)
+        else:
+            with open(self.path, "wb") as f:
+                f.write(STATE_MAGIC + data)
+
+class DutyCycleScheduler:
+    # Takes one sample per sampling_rate and sleeps in between. Wi-Fi is only up while
+    # the sender has something to send (every sample, or every flushed batch), and is
+    # brought down again before sleeping.
+    #   sleep_mode "light": machine.lightsleep, RAM and the pending batch are kept
+    #   sleep_mode "deep":  machine.deepsleep, the board resets and main.py runs again,
+    #                       the report policy and pending batch are restored from StateStore
+    def __init__(self, sender, config):
+        self.sender = sender
+        self.mode = config.get("sleep_mode", "light")
+        self.interval_ms = int(config["sampling_rate"] * 1000)
+        self.store = StateStore(config.get("state_file", "state.bin"))
+        self.restore()
+
+    def restore(self):
+        data = self.store.load()
+        if data is None:
+            return
+        if self.sender.temperature_policy is not None:
+            self.sender.temperature_policy.restore(data[:8])
+        if self.sender.temperature_batch is not None and len(data) > 8:
+            self.sender.temperature_batch.restore(data[8:])
+
+    # last sent value of the report policy, pending batch; readings are numbered
+    # (SEQ) by the flash ring, which keeps its own counter
+    def save(self):
+        if self.sender.temperature_policy is not None:
+            data = self.sender.temperature_policy.dump()
+        else:
+            data = bytes(8)
+        if self.sender.temperature_batch is not None:
+            data += self.sender.temperature_batch.dump()
+        self.store.save(data)
+
+    async def cycle(self):
+        await self.sender.submit_temperature(self.sender.read_temperature())
+        if self.sender.wlan.active():
+            await self.sender.disconnect()
+
+    def run(self):
+        while True:
+            start = ticks_ms()
+            asyncio.run(self.cycle())
+            remaining = max(0, self.interval_ms - ticks_diff(ticks_ms(), start))
+            if self.mode == "deep":
+                self.save()
+                machine.deepsleep(remaining)
+            else:
+                machine.lightsleep(remaining)
@@ -1,50 +1,123 @@
 import network
 import requests
 import machine
-from time import sleep, time
+from time import sleep, time, ticks_ms, ticks_diff
 import asyncio
 import json
 import microcoapy
+import payload_codec
+from http_client import HttpClient
+from sample_batch import SampleBatch, VALUE_KEYS, REPORT_NAMES
+from sampling import OversampledADC, ReportPolicy
+from flash_ring import FlashRing
+from mqtt_transport import MqttTransport
+import wifi
+from array import array
+
+# MQTT topics of the proxy for the HTTP routes, binary payloads go to the same topic plus /bin
+MQTT_TOPICS = {
+    "submitTemperature": "submit_temperature_data",
+    "submitLight": "submit_light_data",
+    "submitBatch": "submit_batch_data"
+}
 
 def receivedMessageCallback(packet, sender):
         print('Message received:', packet.toString(), ', from: ', sender)
-        print('Message payload: ', packet.payload.decode('unicode_escape'))
+        if packet.payload is not None:
+            print('Message payload: ', bytes(packet.payload).decode('unicode_escape'))
 
 class Sender:
     def __init__(self, config, readers):
         self.config = config
         self.readers = readers
-        self.connect()
-        self.sensor = machine.ADC(4)
+        # "binary" sends the compact struct encoding of payload_codec instead of JSON
+        self.binary = config.get("payload_format", "json") == "binary"
+        # with a deadband only readings that moved past it, or a heartbeat every heartbeat seconds, are sent
+        self.temperature_policy = None
+        if "deadband" in config:
+            self.temperature_policy = ReportPolicy(config["deadband"], config.get("heartbeat", 3600))
+        # with batch_size > 1 samples are uploaded together, see SampleBatch for the flush triggers
+        self.temperature_batch = None
+        if config.get("batch_size", 1) > 1:
+            self.temperature_batch = SampleBatch(payload_codec.KIND_TEMPERATURE, config["device_id"], "P01",
+                                                 config["batch_size"],
+                                                 config.get("batch_max_age", 3600),
+                                                 config.get("batch_min_free", 8192),
+                                                 reports=self.temperature_policy is not None)
+        # with ring_capacity > 0 every reading is first stored in a ring buffer on flash and
+        # the ring is drained to the proxy, readings survive failed sends and reboots
+        self.ring = None
+        if config.get("ring_capacity", 0) > 0:
+            self.ring = FlashRing(config.get("ring_file", "ring.bin"), config["ring_capacity"])
+            self.drain_batch = config.get("ring_drain_batch", 32)
+            self.drain_rate = config.get("ring_drain_rate", 64)
+            self.drain_values = array('f', [0.0] * self.drain_batch)
+            self.drain_times = array('I', [0] * self.drain_batch)
+            self.drain_reports = array('B', [0] * self.drain_batch)
+            self.drain_seqs = array('I', [0] * self.drain_batch)
+            self.drain_buffer = bytearray(2 * (10 + len(config["device_id"].encode())) + 16 * self.drain_batch)
+        self.sensor = OversampledADC(machine.ADC(4), config.get("oversample", 16), config.get("oversample_mode", "mean"))
         self.client = None
+        self.coap_lock = asyncio.Lock()
+        # code of the last CoAP response, set by response_received
+        self.coap_code = None
+        self.http = None
+        self.mqtt = None
+        self.wlan = network.WLAN(network.STA_IF)
+        # ticks_ms at boot, set by main.py, the time to the first delivered sample is logged once
+        self.boot_ms = None
+        # duty-cycled devices only bring Wi-Fi up when they have something to send
+        if config.get("sleep_mode", "none") == "none":
+            self.connect()
 
+    # returns False when Wi-Fi is down or the proxy does not answer the ping, sends are
+    # then left for later (the ring or batch keeps the readings)
     def connect(self):
-        wlan = network.WLAN(network.STA_IF)
-        wlan.active(True)
-        wlan.connect(self.config["wifi_ssid"], self.config["wifi_pwd"])
-        for i in range(20):
-            print(f'({i}) Waiting for connection...')
-            sleep(1)
-            if wlan.isconnected():
-                break
-        if not wlan.isconnected():
+        if self.wlan.isconnected():
+            return True
+        wifi.connect(self.config["wifi_ssid"], self.config["wifi_pwd"], self.config.get("device_ip"),
+                     self.config.get("wifi_timeout", 20) * 1000)
+        if not self.wlan.isconnected():
             print("cannot establish connection")
-            return
-        wlan_config = wlan.ifconfig()
-        wlan_config = (self.config["device_ip"], wlan_config[1], wlan_config[2], wlan_config[3])
-        wlan.ifconfig(wlan_config)
-        response = requests.get(f'http://{self.config["server_address"]}/ping')
-        print(response.status_code)
-        
+            return False
+        # the proxy is only pinged again once ping_interval seconds passed since the last success
+        if not wifi.ping_due(self.config.get("ping_interval", 3600)):
+            return True
+        # /ping is an HTTP route, over CoAP or MQTT server_port is not the proxy's HTTP port
+        port = self.config["server_port"] if self.config["protocol"] == "HTTP" else self.config.get("http_port", 5000)
+        try:
+            response = requests.get(f'http://{self.config["server_address"]}:{port}/ping',
+                                    timeout=self.config.get("ping_timeout", 5))
+            status = response.status_code
+            response.close()
+        except Exception as e:
+            print("ping failed:", e)
+            return False
+        print(status)
+        if status != 200:
+            return False
+        wifi.ping_done()
+        return True
+
+    async def disconnect(self):
+        # the sockets do not survive the interface going down
+        await self.close()
+        self.wlan.disconnect()
+        self.wlan.active(False)
+
     def collect_and_send(self, loop):
         async def gatherer():
             while True:
                 await asyncio.gather(self.__read_temperature(), self.__read_2())
         task = loop.create_task(gatherer())
+        if self.config["protocol"] == "MQTT":
+            loop.create_task(self.mqtt_keepalive())
+        if self.config.get("config_observe", False):
+            loop.create_task(self.config_observer())
         return loop
     
-    async def __read_temperature(self):
-    # Read the raw ADC value
+    def read_temperature(self):
+        # Read the raw ADC value
         adc_value = self.sensor.read_u16()
 
         # Convert ADC value to voltage
@@ -54,48 +127,257 @@ class Sender:
         temperature_celsius = 27 - (voltage - 0.706) / 0.001721
 
         print(f"temperature: {temperature_celsius} C")
-        payload = {
+        return temperature_celsius
+
+    async def submit_temperature(self, temperature_celsius):
+        report = None
+        if self.temperature_policy is not None:
+            report = self.temperature_policy.check(temperature_celsius, time())
+            if report is None:
+                return
+        if self.ring is not None:
+            self.ring.append(payload_codec.KIND_TEMPERATURE, temperature_celsius, time(),
+                             payload_codec.REPORT_CODES[report])
+            if self.ring_due():
+                await self.drain()
+        elif self.temperature_batch is None:
+            await self.send(self.encode_reading(payload_codec.KIND_TEMPERATURE, "TEMPERATURE", temperature_celsius, report),
+                            "submitTemperature", "temperatureData")
+        else:
+            self.temperature_batch.add(temperature_celsius, time(), report)
+            # a failed upload keeps the batch, it is sent again with the next sample
+            if self.temperature_batch.due():
+                if await self.send(self.temperature_batch.encode(self.binary), "submitBatch", "batchData"):
+                    self.temperature_batch.clear()
+
+    def ring_due(self):
+        pending = self.ring.pending()
+        if pending == 0:
+            return False
+        if pending >= self.config.get("batch_size", 1):
+            return True
+        oldest = self.ring.peek(1)
+        return len(oldest) > 0 and time() - oldest[0][1] >= self.config.get("batch_max_age", 3600)
+
+    # sends the ring oldest first, drain_batch records per request and at most drain_rate
+    # records per second, until it is empty or a send fails
+    async def drain(self):
+        while self.ring.pending() > 0:
+            records = self.ring.peek(self.drain_batch)
+            if len(records) == 0:
+                break
+            if not await self.send(self.encode_records(records), "submitBatch", "batchData"):
+                return False
+            self.ring.ack(records[-1][0])
+            if self.ring.pending() > 0:
+                await asyncio.sleep(len(records) / self.drain_rate)
+        return True
+
+    def encode_records(self, records):
+        if not self.binary:
+            readings = []
+            for seq, timestamp, value, kind, report in records:
+                reading = {"ID": self.config['device_id'], "POSITION": "P01",
+                           VALUE_KEYS[kind]: value, "TIME": timestamp, "SEQ": seq}
+                if report != 0:
+                    reading["REPORT"] = REPORT_NAMES[report]
+                readings.append(reading)
+            return json.dumps(readings)
+        # one delta-encoded batch per kind, one after the other in the buffer
+        buffer = memoryview(self.drain_buffer)
+        size = 0
+        for kind in VALUE_KEYS:
+            count = 0
+            for seq, timestamp, value, record_kind, report in records:
+                if record_kind == kind:
+                    self.drain_values[count] = value
+                    self.drain_times[count] = timestamp
+                    self.drain_reports[count] = report
+                    self.drain_seqs[count] = seq
+                    count += 1
+            if count > 0:
+                size += payload_codec.encode_batch(buffer[size:], kind, self.config['device_id'], "P01",
+                                                   self.drain_values, self.drain_times, count,
+                                                   reports=self.drain_reports, seqs=self.drain_seqs)
+        return buffer[:size]
+
+    async def __read_temperature(self):
+        await self.submit_temperature(self.read_temperature())
+        await asyncio.sleep(self.config["sampling_rate"])
+
+    def encode_reading(self, kind, key, value, report=None):
+        if self.binary:
+            return payload_codec.encode_reading(kind, self.config['device_id'], "P01", value, time(), report)
+        reading = {
             "ID":self.config['device_id'],
             "POSITION":"P01",
-            "TEMPERATURE": temperature_celsius,
+            key: value,
             "TIME":time()
         }
+        if report is not None:
+            reading["REPORT"] = report
+        return json.dumps(reading)
+
+    # returns False when the request should be retried later
+    async def send(self, payload, http_parameter, coap_parameter):
+        if not self.wlan.isconnected() and not self.connect():
+            return False
         if self.config["protocol"] == "HTTP":
-            await self.http_request(payload, "submitTemperature")
+            sent = await self.http_request(payload, http_parameter)
         elif self.config["protocol"] == "COAP":
-            await self.coap_request(payload, "temperatureData")
+            sent = await self.coap_request(payload, coap_parameter)
+        elif self.config["protocol"] == "MQTT":
+            sent = self.mqtt_request(payload, http_parameter)
         else:
             raise Exception(f"Unknown protocol {self.config['protocol']}")
-        await asyncio.sleep(self.config["sampling_rate"])
+        if sent and self.boot_ms is not None:
+            print("boot to first sample: %d ms" % ticks_diff(ticks_ms(), self.boot_ms))
+            self.boot_ms = None
+        return sent
     
     async def http_request(self, payload, parameter):
+        if self.http is None:
+            self.http = HttpClient(self.config["server_address"], self.config["server_port"])
         try:
-            response = requests.put(
-                f'http://{self.config["server_address"]}:{self.config["server_port"]}/{parameter}',
-                data=json.dumps(payload),
-                headers={'Content-Type': 'application/json'})
-            print(response.text)
+            status, body = await self.http.put(parameter, payload,
+                                               payload_codec.CONTENT_TYPE if self.binary else 'application/json')
+            print(status, body)
+            # a 4xx will not get better by sending the same payload again, only 5xx are retried
+            return status < 500
         except Exception as e:
             print("Error:", e)
+            return False
             
-    async def coap_request(self, payload, parameter):
+    # the client and its socket are created on the first request and kept until close()
+    def coap_client(self):
         if self.client is None:
             self.client = microcoapy.Coap()
-            self.client.responseCallback = receivedMessageCallback
-        self.client.start()
-        bytesTransferred = self.client.put(
-            self.config["server_address"],
-            self.config["server_port"],
-            parameter,
-            json.dumps(payload),
-            None,
-            microcoapy.COAP_CONTENT_FORMAT.COAP_TEXT_PLAIN
-        )
-        print("[PUT] Sent bytes: ", bytesTransferred)
-
-        self.client.poll(2000)
-
-        self.client.stop()
+            # microcoapy logs (and hexlifies) every packet in debug mode
+            self.client.debug = self.config.get("coap_debug", False)
+            self.client.responseCallback = self.response_received
+            self.client.start(peers=((self.config["server_address"], self.config["server_port"]),))
+        return self.client
+
+    def response_received(self, packet, sender):
+        self.coap_code = packet.method
+        receivedMessageCallback(packet, sender)
+
+    async def coap_request(self, payload, parameter):
+        client = self.coap_client()
+        # one confirmable exchange at a time, the configuration observer shares the client
+        async with self.coap_lock:
+            self.coap_code = None
+            bytesTransferred = client.put(
+                self.config["server_address"],
+                self.config["server_port"],
+                parameter,
+                payload,
+                None,
+                microcoapy.COAP_CONTENT_FORMAT.COAP_APPLICATION_OCTET_STREAM if self.binary else microcoapy.COAP_CONTENT_FORMAT.COAP_TEXT_PLAIN
+            )
+            print("[PUT] Sent bytes: ", bytesTransferred)
+
+            if bytesTransferred == 0:
+                return False
+            # the PUT is confirmable, pollAsync returns early if it was not acknowledged after the retransmissions
+            if not await client.pollAsync(microcoapy.MAX_TRANSMIT_WAIT_MS):
+                return False
+            # with a separate response (rfc7252 #5.2.2) the ACK is empty and the code follows
+            start = ticks_ms()
+            while self.coap_code is None and ticks_diff(ticks_ms(), start) < microcoapy.MAX_TRANSMIT_WAIT_MS:
+                await client.pollAsync(100)
+            # as on HTTP, a 4.xx will not get better by sending the same payload again, only 5.xx are retried
+            return self.coap_code is not None and (self.coap_code >> 5) != 5
+
+    # With config_observe the device observes deviceConfig/{device_id} on the CoAP server and
+    # applies the configurations pushed to it. The registration is renewed every
+    # config_observe_interval seconds, in case the server lost it.
+    async def config_observer(self):
+        interval = self.config.get("config_observe_interval", 3600) * 1000
+        token = None
+        while True:
+            if self.wlan.isconnected():
+                client = self.coap_client()
+                port = self.config["server_port"] if self.config["protocol"] == "COAP" else self.config.get("coap_port", 5683)
+                async with self.coap_lock:
+                    if token is not None:
+                        client.cancelObserve(token)
+                    token = client.observe(self.config["server_address"], int(port),
+                                           "deviceConfig/" + self.config["device_id"], self.apply_config)
+                    if token is not None:
+                        await client.pollAsync(microcoapy.MAX_TRANSMIT_WAIT_MS)
+            start = ticks_ms()
+            while ticks_diff(ticks_ms(), start) < interval:
+                if self.client is None:
+                    await asyncio.sleep(1)
+                else:
+                    await self.client.pollAsync(1000)
+
+    # configurations carry a SEQ, one not above the last applied is stale
+    def apply_config(self, packet, remoteAddress):
+        if packet.payload is None:
+            return
+        try:
+            changes = json.loads(bytes(packet.payload).decode())
+        except ValueError:
+            return
+        if not isinstance(changes, dict):
+            return
+        seq = changes.pop("SEQ", 0)
+        if seq <= self.config.get("config_seq", 0):
+            return
+        print("configuration", seq, "received:", changes)
+        # the HTTP connection is to the old server
+        if self.http is not None and ("server_address" in changes or "server_port" in changes):
+            asyncio.create_task(self.http.close())
+            self.http = None
+        self.config.update(changes)
+        self.config["config_seq"] = seq
+        self.binary = self.config.get("payload_format", "json") == "binary"
+        self.save_config()
+
+    # the active configuration is the last one in config_file, it is rewritten so pushed changes survive a reboot
+    def save_config(self):
+        path = self.config.get("config_file", "config.json")
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            stored["configs"][-1] = self.config
+            with open(path, "w") as f:
+                json.dump(stored, f)
+        except (OSError, ValueError) as e:
+            print("cannot save configuration:", e)
+
+    # the broker connection is opened on the first publish and kept until close()
+    def mqtt_request(self, payload, parameter):
+        if self.mqtt is None:
+            self.mqtt = MqttTransport(self.config["device_id"],
+                                      self.config.get("mqtt_broker", self.config["server_address"]),
+                                      self.config.get("mqtt_port", 1883),
+                                      keepalive=self.config.get("mqtt_keepalive", 60),
+                                      qos=self.config.get("mqtt_qos", 0),
+                                      clean_session=self.config.get("mqtt_clean_session", False))
+        topic = MQTT_TOPICS[parameter]
+        if self.binary:
+            topic += "/bin"
+        return self.mqtt.publish(topic, payload)
+
+    async def mqtt_keepalive(self):
+        while True:
+            await asyncio.sleep(self.config.get("mqtt_keepalive", 60) / 2)
+            if self.mqtt is not None:
+                self.mqtt.ping()
+
+    async def close(self):
+        if self.client is not None:
+            self.client.stop()
+            self.client = None
+        if self.mqtt is not None:
+            self.mqtt.close()
+            self.mqtt = None
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
 
     async def __read_2(self):
         print(f"sending {42} to 2")
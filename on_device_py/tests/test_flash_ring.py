@@ -0,0 +1,72 @@
+import importlib.util
+import os
+import pytest
+
+# loaded by path: the device modules are not on the proxy's import path and share some of its names
+spec = importlib.util.spec_from_file_location("flash_ring", os.path.join(os.path.dirname(__file__), "..", "flash_ring.py"))
+flash_ring = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(flash_ring)
+
+@pytest.fixture
+def open_ring(tmp_path):
+    rings = []
+
+    def make(capacity=4, ack_slots=3):
+        ring = flash_ring.FlashRing(str(tmp_path / "ring.bin"), capacity, str(tmp_path / "ring.ack"), ack_slots)
+        rings.append(ring)
+        return ring
+
+    yield make
+    for ring in rings:
+        if not ring.file.closed:
+            ring.close()
+
+def fill(ring, n, start=0):
+    return [ring.append(1, 20.0 + i, 1000 + i) for i in range(start, start + n)]
+
+def test_records_are_peeked_oldest_first(open_ring):
+    ring = open_ring()
+    assert fill(ring, 3) == [1, 2, 3]
+    assert ring.pending() == 3
+    assert [(r[0], r[1], r[2]) for r in ring.peek(10)] == [(1, 1000, 20.0), (2, 1001, 21.0), (3, 1002, 22.0)]
+    assert [r[0] for r in ring.peek(2)] == [1, 2]
+
+def test_wrap_around_overwrites_the_oldest(open_ring):
+    ring = open_ring(capacity=4)
+    fill(ring, 6)
+    assert ring.pending() == 4
+    assert [r[0] for r in ring.peek(10)] == [3, 4, 5, 6]
+
+def test_ack_removes_delivered_records(open_ring):
+    ring = open_ring()
+    fill(ring, 3)
+    ring.ack(2)
+    assert ring.pending() == 1
+    assert [r[0] for r in ring.peek(10)] == [3]
+    # older acks are ignored
+    ring.ack(1)
+    assert ring.pending() == 1
+
+def test_state_survives_reopening(open_ring):
+    ring = open_ring(capacity=4, ack_slots=3)
+    fill(ring, 6)
+    # more acks than slots, the slots are reused in turn
+    for seq in [3, 4, 5]:
+        ring.ack(seq)
+    ring.close()
+
+    ring = open_ring(capacity=4, ack_slots=3)
+    assert ring.next_seq == 7
+    assert [r[0] for r in ring.peek(10)] == [6]
+    assert ring.append(1, 30.0, 2000) == 7
+
+def test_corrupt_record_is_skipped(open_ring, tmp_path):
+    ring = open_ring(capacity=4)
+    fill(ring, 3)
+    ring.close()
+    with open(tmp_path / "ring.bin", "r+b") as f:
+        f.seek(2 * flash_ring.RECORD.size + 5)
+        f.write(b"\xff")
+
+    ring = open_ring(capacity=4)
+    assert [r[0] for r in ring.peek(10)] == [1, 3]
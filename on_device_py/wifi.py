@@ -0,0 +1,83 @@
+import json
+import network
+import ubinascii
+from time import ticks_ms, ticks_diff, sleep_ms, time
+
+# Fast join: the BSSID, channel and IP settings of the last successful join are cached
+# in CACHE_FILE. With a cache the static address is applied before associating (no
+# DHCP round) and the join targets the cached access point directly (no full scan).
+# If that fails the cache is dropped and a normal join is made.
+CACHE_FILE = "wifi_cache.json"
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        print("cannot save wifi cache:", e)
+
+def wait_connected(wlan, timeout_ms, poll_ms):
+    start = ticks_ms()
+    while ticks_diff(ticks_ms(), start) < timeout_ms:
+        if wlan.isconnected():
+            return True
+        # negative status: wrong password, no AP found, join failed
+        if wlan.status() < 0:
+            return False
+        sleep_ms(poll_ms)
+    return wlan.isconnected()
+
+def join(wlan, ssid, pwd, entry, device_ip, timeout_ms, poll_ms):
+    if entry is not None:
+        if device_ip is not None:
+            wlan.ifconfig((device_ip, entry["mask"], entry["gateway"], entry["dns"]))
+        wlan.connect(ssid, pwd, bssid=ubinascii.unhexlify(entry["bssid"]))
+    else:
+        wlan.connect(ssid, pwd)
+    return wait_connected(wlan, timeout_ms, poll_ms)
+
+def connect(ssid, pwd, device_ip=None, timeout_ms=20000, poll_ms=50):
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    start = ticks_ms()
+    cache = load_cache()
+    entry = cache.get(ssid)
+    connected = join(wlan, ssid, pwd, entry, device_ip, timeout_ms, poll_ms)
+    if not connected and entry is not None:
+        print("cached access point unavailable, joining without it")
+        wlan.disconnect()
+        entry = None
+        connected = join(wlan, ssid, pwd, None, device_ip, timeout_ms, poll_ms)
+    if not connected:
+        return wlan
+    print("wifi joined in %d ms" % ticks_diff(ticks_ms(), start))
+
+    if entry is None:
+        # first join on this network: the DHCP settings are kept for the static address
+        ip, mask, gateway, dns = wlan.ifconfig()
+        if device_ip is not None:
+            wlan.ifconfig((device_ip, mask, gateway, dns))
+        for net_ssid, bssid, channel, rssi, security, hidden in sorted(wlan.scan(), key=lambda n: -n[3]):
+            if net_ssid.decode() == ssid:
+                cache[ssid] = {"bssid": ubinascii.hexlify(bssid).decode(), "channel": channel,
+                               "mask": mask, "gateway": gateway, "dns": dns}
+                save_cache(cache)
+                break
+    return wlan
+
+# the /ping check is skipped when one succeeded less than max_age seconds ago
+def ping_due(max_age):
+    last = load_cache().get("last_ping", 0)
+    return not (0 <= time() - last < max_age)
+
+def ping_done():
+    cache = load_cache()
+    cache["last_ping"] = time()
+    save_cache(cache)